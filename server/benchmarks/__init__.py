@@ -0,0 +1,36 @@
+# micro-benchmarks for the services' hot paths; they run on synthetic data so
+# they don't need a database, e.g.
+#
+#     python -m benchmarks.blocks
+#
+# from the server directory
+import time
+# django
+import django
+from django.conf import settings
+
+
+# configures just enough of django to import the services' models
+def setup_django():
+    if not settings.configured:
+        settings.configure(INSTALLED_APPS=['services'])
+        django.setup()
+
+
+# returns the best wall-clock time of repeat calls to the given function
+def best_of(f, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        f()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# prints the times of a reference and an optimized implementation
+def report(name, reference, optimized):
+    print('%-40s reference %9.2f ms  optimized %9.2f ms  speedup %6.1fx' % (
+        name, reference*1000, optimized*1000,
+        reference/optimized if optimized else float('inf')
+    ))
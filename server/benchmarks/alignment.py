@@ -0,0 +1,146 @@
+# compares the vectorized smith-waterman and batched repeat alignments with
+# per-cell ports of the client's implementations, serially and in a process
+# pool
+import numpy as np
+# the code being benchmarked
+from benchmarks import best_of, report, setup_django
+setup_django()
+from django.conf import settings
+from services import alignment
+
+
+# the client's per-cell smith-waterman, returning the score and columns
+def align_reference(sequence, reference, match, mismatch, gap):
+    def score(a, b):
+        return match if a == b and a != '' else mismatch
+    rows, cols = len(reference) + 1, len(sequence) + 1
+    a = [[0] * cols for i in range(rows)]
+    i_max = j_max = best = 0
+    for i in range(1, rows):
+        for j in range(1, cols):
+            a[i][j] = max(
+                0,
+                a[i-1][j-1] + score(reference[i-1], sequence[j-1]),
+                a[i-1][j] + gap,
+                a[i][j-1] + gap
+            )
+            if a[i][j] >= best:
+                i_max, j_max, best = i, j, a[i][j]
+    i, j = i_max, j_max
+    columns = []
+    while i > 0 and j > 0:
+        s = a[i][j]
+        if s == 0:
+            break
+        if s == a[i-1][j-1] + score(reference[i-1], sequence[j-1]):
+            columns.append((j-1, i-1))
+            i -= 1
+            j -= 1
+        elif s == a[i-1][j] + gap:
+            columns.append((None, i-1))
+            i -= 1
+        elif s == a[i][j-1] + gap:
+            columns.append((j-1, None))
+            j -= 1
+        else:
+            break
+    while j > 0:
+        columns.append((j-1, None))
+        j -= 1
+    return best, columns[::-1]
+
+
+def align_tracks_reference(query, tracks, params):
+    args = (params['match'], params['mismatch'], params['gap'])
+    results = []
+    for track in tracks:
+        forward = align_reference(query, track, *args)
+        reverse = align_reference(query, track[::-1], *args)
+        results.append(max(forward[0], reverse[0]))
+    return results
+
+
+# the client's per-cell repeat matrix fill; the traceback is shared with the
+# batched implementation
+def repeat_reference(sequence, reference, match, mismatch, gap, threshold):
+    def score(a, b):
+        return match if a == b and a != -1 else mismatch
+    rows, cols = len(reference) + 1, len(sequence) + 1
+    a = [[0] * cols for i in range(rows)]
+    for i in range(1, rows):
+        a[i][0] = max([a[i-1][0]] + [s - threshold for s in a[i-1][1:]])
+        for j in range(1, cols):
+            a[i][j] = max(
+                a[i][0],
+                a[i-1][j-1] + score(reference[i-1], sequence[j-1]),
+                a[i-1][j] + gap,
+                a[i][j-1] + gap
+            )
+    return alignment.repeat_traceback(a, sequence, reference, threshold)
+
+
+def repeat_tracks_reference(query, tracks, params):
+    encoder = alignment.FamilyEncoder()
+    sequence = encoder.encode(query).tolist()
+    args = (params['match'], params['mismatch'], params['gap'],
+            params['threshold'])
+    results = []
+    for track in tracks:
+        reference = encoder.encode(track).tolist()
+        results.append(
+            [s for s, c in repeat_reference(sequence, reference, *args)] +
+            [s for s, c in repeat_reference(sequence, reference[::-1], *args)]
+        )
+    return results
+
+
+# generates a query and tracks of family labels that share some families
+def synthetic_tracks(count, query_length, track_length, seed=0):
+    random = np.random.RandomState(seed)
+    families = ['family%d' % i for i in range(query_length * 2)] + ['']
+    query = [families[i] for i in random.randint(len(families),
+                                                 size=query_length)]
+    tracks = [[families[i] for i in random.randint(len(families),
+                                                   size=track_length)]
+              for t in range(count)]
+    return query, tracks
+
+
+def benchmark(name, reference_tracks, query, tracks, params):
+    expected = reference_tracks(query, tracks, params)
+    actual = [[a.score for a in alignments] for alignments in
+              alignment.align_tracks(query, tracks, params)]
+    if params['algorithm'] == 'smith-waterman':
+        actual = [scores[0] for scores in actual]
+    assert expected == actual
+    reference = best_of(lambda: reference_tracks(query, tracks, params))
+    settings.GCV_ALIGNMENT_PROCESSES = None
+    optimized = best_of(lambda: alignment.align_tracks(query, tracks, params))
+    report(name, reference, optimized)
+    # the pool is only used once it's started, as a worker does
+    settings.GCV_ALIGNMENT_PROCESSES = 4
+    alignment.start_pool()
+    try:
+        pooled = best_of(lambda: alignment.align_tracks(query, tracks,
+                                                        params))
+    finally:
+        alignment.stop_pool()
+    report(name + ', 4 processes', reference, pooled)
+
+
+def main():
+    smith_waterman = alignment.parse_params({})
+    repeat = alignment.parse_params({'algorithm': 'repeat', 'match': 10,
+                                     'mismatch': -1, 'threshold': 25})
+    for count, query_length, track_length in [(100, 20, 20), (1000, 20, 40),
+                                              (200, 100, 100)]:
+        query, tracks = synthetic_tracks(count, query_length, track_length)
+        name = '%d tracks, %dx%d' % (count, query_length, track_length)
+        benchmark('smith-waterman, ' + name, align_tracks_reference, query,
+                  tracks, smith_waterman)
+        benchmark('repeat, ' + name, repeat_tracks_reference, query, tracks,
+                  repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# compares the vectorized micro-synteny block detection with the per-gene loop
+# it replaced on genome-scale synthetic families
+import numpy as np
+# the code being benchmarked
+from benchmarks import best_of, report
+from services.search import find_blocks
+
+
+# the per-gene block detection loop formerly used by v1_micro_synteny_search
+def find_blocks_reference(chromosome_ids, numbers, families, matched,
+                          intermediate):
+    chromosome_genes_map = {}
+    for c, n, f in zip(chromosome_ids, numbers, families):
+        chromosome_genes_map.setdefault(c, []).append((n, f))
+    tracks = []
+    for chromosome_id, genes in sorted(chromosome_genes_map.items()):
+        if len(genes) < 2:
+            continue
+        block = [0]
+        matched_families = set([genes[0][1]])
+        for i in range(1, len(genes)):
+            gap_size = genes[i][0]-genes[block[-1]][0]-1
+            if gap_size <= intermediate:
+                matched_families.add(genes[i][1])
+                block.append(i)
+            if gap_size > intermediate or i == len(genes)-1:
+                if len(matched_families) >= matched:
+                    tracks.append(
+                        (chromosome_id, genes[block[0]][0], genes[block[-1]][0])
+                    )
+                block = [i]
+                matched_families = set([genes[i][1]])
+    return tracks
+
+
+# generates the genes of the given families on a synthetic genome, sorted by
+# chromosome and number
+def synthetic_genes(chromosomes, genes_per_chromosome, family_sizes, seed=0):
+    random = np.random.RandomState(seed)
+    total = chromosomes * genes_per_chromosome
+    families = np.concatenate([np.repeat(f, size)
+                               for f, size in enumerate(family_sizes)])
+    positions = random.choice(total, size=len(families), replace=False)
+    order = np.argsort(positions)
+    positions = positions[order]
+    return (
+        positions // genes_per_chromosome,
+        positions % genes_per_chromosome,
+        families[order]
+    )
+
+
+def main():
+    cases = [
+        ('typical query (20 families)', [50] * 20),
+        ('large families (20 x 2k)', [2000] * 20),
+        ('very large family (100k + 20 x 500)', [100000] + [500] * 20),
+    ]
+    for name, family_sizes in cases:
+        genes = synthetic_genes(20, 50000, family_sizes)
+        for matched, intermediate in [(2, 5), (6, 5)]:
+            expected = find_blocks_reference(
+                *[a.tolist() for a in genes] + [matched, intermediate])
+            actual = zip(*[a.tolist() for a in
+                           find_blocks(*genes + (matched, intermediate))])
+            assert sorted(expected) == sorted(actual)
+            reference = best_of(lambda: find_blocks_reference(
+                *[a.tolist() for a in genes] + [matched, intermediate]))
+            optimized = best_of(
+                lambda: find_blocks(*genes + (matched, intermediate)))
+            report('%s, matched=%d' % (name, matched), reference, optimized)
+
+
+if __name__ == '__main__':
+    main()
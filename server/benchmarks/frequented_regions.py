@@ -0,0 +1,99 @@
+# compares the priority queue frequented regions contraction with the
+# client's, which scans every edge for the next one to contract and re-sorts
+# all of a region's intervals when it's merged, on synthetic genomes
+import time
+from collections import OrderedDict
+import numpy as np
+# the code being benchmarked
+from benchmarks import best_of, report
+from services import frequented_regions
+from services.frequented_regions import FrequentedRegion, RegionGraph
+
+
+# the client's merge: every path's intervals are sorted and swept again
+def merge_reference(self, other, alpha):
+    region = FrequentedRegion(descendants=(self, other),
+                              size=self.size + other.size)
+    for path in set(self.intervals) | set(other.intervals):
+        intervals = sorted(self.intervals.get(path, []) +
+                           other.intervals.get(path, []))
+        merged = frequented_regions.merge_sorted(intervals)
+        region.intervals[path] = merged
+        region.spans[path] = max(s for b, e, s in merged)
+    region.compute_support(alpha)
+    return region
+
+
+# the client's graph: the edges are kept in the order they were added and
+# scanned for the most supported one
+class ReferenceGraph(RegionGraph):
+
+    def __init__(self, alpha):
+        super(ReferenceGraph, self).__init__(alpha)
+        self.edges = OrderedDict()
+
+    def _push(self, key, region, added):
+        pass
+
+    def pop(self):
+        best = None
+        for key, (region, added) in self.edges.items():
+            if best is None or best[1].avg_alpha < region.avg_alpha:
+                best = (key, region)
+        return best
+
+
+def frequented_regions_reference(tracks, alpha, kappa, minsup, minsize):
+    graph_class = frequented_regions.RegionGraph
+    merge = FrequentedRegion.merge
+    frequented_regions.RegionGraph = ReferenceGraph
+    FrequentedRegion.merge = merge_reference
+    try:
+        return frequented_regions.frequented_regions(
+            tracks, alpha, kappa, minsup, minsize)
+    finally:
+        frequented_regions.RegionGraph = graph_class
+        FrequentedRegion.merge = merge
+
+
+# generates chromosomes that descend from a common ancestor by inversions,
+# deletions and duplications, with a few genes that have no family
+def synthetic_genome(chromosomes, genes, seed=0):
+    random = np.random.RandomState(seed)
+    ancestor = ['family%d' % i for i in range(genes)]
+    tracks = []
+    for c in range(chromosomes):
+        track = list(ancestor)
+        for k in range(genes // 20):
+            i = random.randint(len(track))
+            j = min(len(track), i + random.randint(1, 10))
+            operation = random.randint(3)
+            if operation == 0:
+                track[i:j] = track[i:j][::-1]
+            elif operation == 1:
+                del track[i:j]
+            else:
+                track.insert(i, ancestor[random.randint(genes)])
+        track = [f if random.rand() > 0.05 else '' for f in track]
+        tracks.append(track)
+    return tracks
+
+
+def main():
+    params = {'alpha': 0.5, 'kappa': 3, 'minsup': 2, 'minsize': 1}
+    for chromosomes, genes in [(5, 200), (20, 1000), (10, 4000)]:
+        tracks = synthetic_genome(chromosomes, genes)
+        # the reference is slow on large genomes, so it's only run once
+        start = time.time()
+        expected = frequented_regions_reference(tracks, **params)
+        reference = time.time() - start
+        assert frequented_regions.frequented_regions(tracks, **params) ==\
+            expected
+        optimized = best_of(
+            lambda: frequented_regions.frequented_regions(tracks, **params))
+        report('%d chromosomes of %d genes' % (chromosomes, genes),
+               reference, optimized)
+
+
+if __name__ == '__main__':
+    main()
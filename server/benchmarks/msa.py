@@ -0,0 +1,51 @@
+# times the multiple alignment of track sets of increasing size, aligning the
+# tracks to the trained HMM one at a time, as the client does, and in batches
+import numpy as np
+# the code being benchmarked
+from benchmarks import best_of, report
+from services import msa
+
+
+# generates tracks of (family, strand) that are variations of a common track,
+# some of them reversed
+def synthetic_tracks(count, length, seed=0):
+    random = np.random.RandomState(seed)
+    families = ['family%d' % i for i in range(length)] + ['']
+    base = [(families[i], 1 if random.rand() < 0.5 else -1)
+            for i in random.randint(len(families), size=length)]
+    tracks = []
+    for t in range(count):
+        track = list(base)
+        for k in range(random.randint(5)):
+            i = random.randint(len(track) + 1)
+            if random.rand() < 0.5 and i < len(track):
+                del track[i]
+            else:
+                track.insert(i, (families[random.randint(len(families))], 1))
+        if random.rand() < 0.5:
+            track = [(f, -s) for f, s in reversed(track)]
+        tracks.append(track)
+    return tracks
+
+
+def align_serially(tracks):
+    chunk_size = msa.CHUNK_SIZE
+    msa.CHUNK_SIZE = 2
+    try:
+        return msa.align(tracks)
+    finally:
+        msa.CHUNK_SIZE = chunk_size
+
+
+def main():
+    for count, length in [(10, 20), (50, 20), (200, 20), (100, 50)]:
+        tracks = synthetic_tracks(count, length)
+        assert align_serially(tracks) == msa.align(tracks)
+        reference = best_of(lambda: align_serially(tracks))
+        optimized = best_of(lambda: msa.align(tracks))
+        report('%d tracks of %d genes' % (count, length), reference,
+               optimized)
+
+
+if __name__ == '__main__':
+    main()
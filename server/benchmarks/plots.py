@@ -0,0 +1,72 @@
+# compares a global plot of a chromosome's genes grouped by family, as the
+# chromosome family index stores them, with the client's per-gene loop over a
+# map of the query's families, and times grouping a chromosome's genes, which
+# the index does once per chromosome, and binning the points into a grid
+import numpy as np
+# the code being benchmarked
+from benchmarks import best_of, report
+from services import plots
+
+
+# the client's plot: each gene is paired with each query gene of its family
+def points_reference(gene_families, gene_positions, query_families,
+                     query_positions):
+    family_map = {}
+    for family, position in zip(query_families, query_positions):
+        if family:
+            family_map.setdefault(family, []).append(position)
+    x = []
+    y = []
+    for family, position in zip(gene_families, gene_positions):
+        for query_position in family_map.get(family, []):
+            x.append(position)
+            y.append(query_position)
+    return np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+
+# groups a chromosome's gene positions by family with a stable sort, as the
+# chromosome family index does when a chromosome is loaded
+def group_positions(gene_families, gene_positions):
+    labels, codes = np.unique(gene_families, return_inverse=True)
+    order = np.argsort(codes, kind='mergesort')
+    breaks = np.flatnonzero(np.diff(codes[order])) + 1
+    positions = np.asarray(gene_positions, dtype=np.float64)
+    return dict((labels[codes[group[0]]], positions[group])
+                for group in np.split(order, breaks))
+
+
+# generates a chromosome's genes and a query whose families are drawn from a
+# few large families
+def synthetic_plot(genes, query_length, families, seed=0):
+    random = np.random.RandomState(seed)
+    labels = ['family%d' % i for i in range(families)]
+    gene_families = [labels[i] for i in random.randint(families, size=genes)]
+    gene_positions = np.sort(random.randint(10**8, size=genes)).tolist()
+    query_families = [labels[i] for i in
+                      random.randint(families, size=query_length)]
+    return gene_families, gene_positions, query_families,\
+        range(query_length)
+
+
+def main():
+    for genes, query_length, families in [(1000, 20, 10), (50000, 40, 20),
+                                          (200000, 40, 20)]:
+        plot = synthetic_plot(genes, query_length, families)
+        groups = group_positions(*plot[:2])
+        x, y = plots.grouped_points(groups, *plot[2:])
+        expected = points_reference(*plot)
+        assert sorted(zip(x, y)) == sorted(zip(*expected))
+        reference = best_of(lambda: points_reference(*plot))
+        optimized = best_of(lambda: plots.grouped_points(groups, *plot[2:]))
+        name = '%d genes, %d query genes' % (genes, query_length)
+        report(name, reference, optimized)
+        grouped = best_of(lambda: group_positions(*plot[:2]))
+        print('%-40s %d genes grouped in %.2f ms' % (
+            name, genes, grouped*1000))
+        binned = best_of(lambda: plots.density(x, y, (200, 200)))
+        print('%-40s %d points binned in %.2f ms' % (
+            name, len(x), binned*1000))
+
+
+if __name__ == '__main__':
+    main()
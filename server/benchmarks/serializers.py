@@ -0,0 +1,108 @@
+# compares the encode time and payload size of the v1 micro-synteny json (a
+# json encoded string) with the v2 native and columnar json for the same
+# search results
+import json
+import random
+# the code being benchmarked
+from benchmarks import best_of, setup_django
+setup_django()
+from services import serializers
+
+
+# synthetic micro-synteny search results
+def synthetic_results(num_groups, genes_per_group, seed=0):
+    rand = random.Random(seed)
+    families = serializers.Families()
+    groups = []
+    for i in range(num_groups):
+        genes = []
+        for j in range(genes_per_group):
+            family = 'phytozome_10_2.%d' % rand.randint(0, 50000)
+            families.add(family)
+            fmin = rand.randint(0, 50000000)
+            genes.append({
+                'name': 'glyma.Gm%02d.%06d' % (i % 20, j),
+                'id': i * genes_per_group + j,
+                'family': family,
+                'fmin': fmin,
+                'fmax': fmin + rand.randint(500, 5000),
+                'strand': rand.choice([1, -1])
+            })
+        groups.append({
+            'genus': 'Glycine',
+            'species': 'max',
+            'species_id': 1,
+            'chromosome_name': 'glyma.Gm%02d' % (i % 20),
+            'chromosome_id': i % 20,
+            'genes': genes
+        })
+    return families, groups
+
+
+# the string concatenation formerly used by v1_micro_synteny_search
+def encode_v1_concatenation(families, groups):
+    group_json = []
+    for group in groups:
+        gene_json = []
+        for g in group['genes']:
+            gene_json.append('{"name":"' + g['name'] + '", "id":' +
+                str(g['id']) + ', "family":"' + g['family'] + '", "fmin":' +
+                str(g['fmin']) + ', "fmax":' + str(g['fmax']) +
+                ', "strand":' + str(g['strand']) + '}')
+        group_json.append('{"genus":"' + group['genus'] +
+            '", "species":"' + group['species'] +
+            '", "species_id":' + str(group['species_id']) +
+            ', "chromosome_name":"' + group['chromosome_name'] +
+            '", "chromosome_id":' + str(group['chromosome_id']) +
+            ', "genes":[' + ','.join(gene_json) + ']}')
+    family_json = []
+    for f in families:
+        family_json.append('{"name":"' + f + '", "id":"' + f + '"}')
+    view_json = ('{"families":[' + ','.join(family_json) + '], "groups":[' +
+        ','.join(group_json) + ']}')
+    return json.dumps(view_json)
+
+
+# a stand-in for the request the responses are for
+class Request(object):
+    META = {}
+
+
+def encode_v1(families, groups):
+    return serializers.micro_synteny_response(
+        Request(), {}, families, groups, 1).content
+
+
+def encode_v2(families, groups):
+    return serializers.micro_synteny_response(
+        Request(), {}, families, groups, 2).content
+
+
+def encode_columnar(families, groups):
+    return serializers.micro_synteny_response(
+        Request(), {'format': 'columnar'}, families, groups, 2).content
+
+
+def main():
+    for num_groups, genes_per_group in [(100, 20), (2000, 20), (10000, 40)]:
+        families, groups = synthetic_results(num_groups, genes_per_group)
+        print('%d groups of %d genes' % (num_groups, genes_per_group))
+        encodings = [
+            ('v1 (string concatenation)', encode_v1_concatenation),
+            ('v1 (json encoded string)', encode_v1),
+        ]
+        for name in sorted(serializers.ENCODERS):
+            settings = serializers.settings
+            def encode(families, groups, name=name):
+                settings.GCV_JSON_ENCODER = name
+                return encode_v2(families, groups)
+            encodings.append(('v2 (%s)' % name, encode))
+        encodings.append(('v2 columnar', encode_columnar))
+        for name, encode in encodings:
+            size = len(encode(families, groups))
+            elapsed = best_of(lambda: encode(families, groups))
+            print('  %-30s %9.2f ms %12d bytes' % (name, elapsed*1000, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# compares assembling the micro-synteny search's tracks with a single sweep of
+# the gene order index to the per-track scan of the gene pool it replaced, and
+# checks that the sweep's time grows linearly with the number of blocks
+import sys
+from collections import namedtuple
+import numpy as np
+# the code being benchmarked
+from benchmarks import best_of, report, setup_django
+setup_django()
+from services.indexes import GeneOrderIndex
+from services.search import assemble_tracks
+
+
+Order = namedtuple('Order', ['chromosome_id', 'number', 'gene_id'])
+
+
+# the track assembly formerly used by v1_micro_synteny_search; it visits every
+# gene in the pool for every track
+def assemble_tracks_reference(gene_pool, blocks):
+    tracks = dict((key, []) for key in blocks)
+    for key in tracks.keys():
+        chromosome_id, lower_bound, upper_bound = key
+        for o in gene_pool:
+            if o.chromosome_id == chromosome_id and o.number >= lower_bound\
+            and o.number <= upper_bound:
+                tracks[key].append(o)
+        tracks[key] = map(
+            lambda x: x.gene_id,
+            sorted(tracks[key], key=lambda o: o.number)
+        )
+    return tracks
+
+
+# a synthetic index and num_blocks disjoint blocks of block_size genes
+def synthetic_blocks(num_blocks, block_size=10, chromosomes=20,
+                     genes_per_chromosome=50000, seed=0):
+    random = np.random.RandomState(seed)
+    chromosome_ids = np.repeat(np.arange(chromosomes), genes_per_chromosome)
+    numbers = np.tile(np.arange(genes_per_chromosome), chromosomes)
+    gene_ids = random.permutation(len(numbers))
+    index = GeneOrderIndex(chromosome_ids, numbers, gene_ids)
+    # space the blocks out so they don't overlap
+    slots = random.choice(
+        len(numbers) // (block_size * 2),
+        size=num_blocks,
+        replace=False
+    ) * block_size * 2
+    slots = slots[(slots % genes_per_chromosome) + block_size <=
+                  genes_per_chromosome]
+    blocks = (
+        chromosome_ids[slots],
+        numbers[slots],
+        numbers[slots] + block_size - 1
+    )
+    return index, blocks
+
+
+def sweep(index, blocks):
+    positions, offsets = assemble_tracks(index, *blocks)
+    gene_ids = index.gene_ids[positions].tolist()
+    offsets = offsets.tolist()
+    return dict((key, gene_ids[start:stop]) for key, start, stop in zip(
+        zip(*[b.tolist() for b in blocks]), offsets[:-1], offsets[1:]))
+
+
+def main():
+    # compare with the reference on sizes it can handle
+    for num_blocks in [100, 1000]:
+        index, blocks = synthetic_blocks(num_blocks)
+        keys = zip(*[b.tolist() for b in blocks])
+        pool_positions = np.concatenate([np.arange(*index.slice(*k).indices(
+            len(index))) for k in keys])
+        gene_pool = [Order(*o) for o in zip(
+            index.chromosomes(pool_positions).tolist(),
+            index.numbers[pool_positions].tolist(),
+            index.gene_ids[pool_positions].tolist()
+        )]
+        assert assemble_tracks_reference(gene_pool, keys) ==\
+            sweep(index, blocks)
+        reference = best_of(
+            lambda: assemble_tracks_reference(gene_pool, keys), repeat=1)
+        optimized = best_of(lambda: sweep(index, blocks))
+        report('%d blocks' % num_blocks, reference, optimized)
+    # make sure the sweep scales linearly up to 10k blocks on a genome-sized
+    # (1M gene) index
+    times = {}
+    for num_blocks in [1000, 10000]:
+        index, blocks = synthetic_blocks(num_blocks)
+        times[num_blocks] = best_of(lambda: sweep(index, blocks))
+        print('%-40s sweep %9.2f ms' % ('%d blocks' % num_blocks,
+                                         times[num_blocks]*1000))
+    growth = times[10000] / times[1000]
+    print('growth from 1k to 10k blocks: %.1fx (linear is 10x)' % growth)
+    if growth > 20:
+        sys.exit('track assembly is no longer linear in the number of blocks')
+
+
+if __name__ == '__main__':
+    main()
@@ -35,7 +35,13 @@ CORS_ALLOW_HEADERS = (
     # cache busting headers
     'Cache-Control',
     'Pragma',
-    'If-Modified-Since'
+    'If-Modified-Since',
+    # conditional request header
+    'If-None-Match'
+)
+# let clients read the response ETags so they can revalidate
+CORS_EXPOSE_HEADERS = (
+    'ETag',
 )
 
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -115,10 +121,74 @@ DATABASES = {
         'PASSWORD': os.environ['PGPASSWORD'],
         'HOST': os.environ['PGHOST'],
         'PORT': os.environ['PGPORT'],
+        # how long (in seconds) a worker keeps its connection open between
+        # requests; 0 closes it after each request and None never does. To
+        # share connections through the services' in-process pool instead,
+        # set ENGINE to 'services.backends.postgresql_pool' and this to 0.
+        'CONN_MAX_AGE': 60,
     }
 }
 
 
+# Caching
+# the services' responses are cached by the backend named here: 'lru' for an
+# in-process cache that holds at most GCV_RESPONSE_CACHE_BYTES per worker, the
+# name of a cache in CACHES (e.g. a FileBasedCache), or None to disable caching
+GCV_RESPONSE_CACHE = None
+GCV_RESPONSE_CACHE_BYTES = 256 * 1024 * 1024
+
+# cached responses and ETags are keyed on the data version: the version in the
+# database's gcv_data_version table, which the build_read_store,
+# build_macro_synteny and bump_data_version commands bump and the workers read
+# when they start and when they receive SIGUSR1. Setting GCV_DATA_VERSION
+# overrides it. Responses are only cached and given ETags if there's a version.
+GCV_DATA_VERSION = None
+
+
+# Connection pool
+# used by the services.backends.postgresql_pool database backend: at most
+# GCV_DB_POOL_SIZE connections are open per worker (requests wait up to
+# GCV_DB_POOL_TIMEOUT seconds for one), connections are closed after
+# GCV_DB_POOL_MAX_LIFETIME seconds and checked before they're reused if they've
+# been idle for GCV_DB_POOL_HEALTH_CHECK_INTERVAL seconds; usage is reported at
+# pool-stats/
+GCV_DB_POOL_SIZE = 10
+GCV_DB_POOL_TIMEOUT = 10
+GCV_DB_POOL_MAX_LIFETIME = 3600
+GCV_DB_POOL_HEALTH_CHECK_INTERVAL = 30
+
+
+# Instrumentation
+# count the queries each view makes and the time they take; the counts are
+# sent in the X-DB-Queries and X-DB-Time headers and totaled at query-stats/
+GCV_QUERY_STATS = False
+
+
+# Alignment
+# the number of processes micro-synteny search results are aligned in when a
+# request asks for them to be aligned; None aligns them in the request's
+# process. The processes are started with the worker (in server/wsgi.py), so
+# a worker forked from a process that loaded the application, e.g. by
+# gunicorn's --preload, aligns them in the request's process.
+GCV_ALIGNMENT_PROCESSES = None
+
+
+# Macro-synteny
+# the path the macro-synteny block table is built at by the build_macro_synteny
+# command, e.g. os.path.join(BASE_DIR, 'macro-synteny'); each build is written
+# to a new directory next to it and the path is made a symlink to it, so the
+# path's parent directory must be writable. Macro-synteny is queried from the
+# database if it's None or hasn't been built
+GCV_MACRO_SYNTENY_TABLE = None
+
+
+# Read store
+# read the micro-synteny views' genes from the denormalized read store instead
+# of joining the Chado tables; build the store (and refresh it when the
+# database is updated) with the build_read_store command before enabling it
+GCV_READ_STORE = False
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -0,0 +1,44 @@
+"""
+Django settings for running the services' tests, e.g.
+
+    python manage.py test services --settings=server.test_settings
+
+The tests run against a throwaway SQLite database, so they don't need the
+PostgreSQL database or credentials the server's settings read from the
+environment.
+"""
+
+import os
+
+# the server's settings require these environment variables; the tests don't
+# use their values
+for name in ('SECRET_KEY', 'PGNAME', 'PGUSER', 'PGPASSWORD', 'PGHOST',
+             'PGPORT'):
+    os.environ.setdefault(name, 'test')
+
+from server.settings import *
+
+
+# Database
+# the test database is created in memory from the models
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+# the services' migrations package is empty because the Chado tables already
+# exist in the server's database, so django would treat the app as migrated
+# and create no tables for it; a migrations module that doesn't exist makes it
+# create them from the models instead
+MIGRATION_MODULES = {
+    'services': 'services.no_migrations',
+}
+
+# the test runner reports errors, so they aren't logged to errors.log
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+}
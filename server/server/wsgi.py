@@ -8,9 +8,42 @@ https://docs.djangoproject.com/en/1.9/howto/deployment/wsgi/
 """
 
 import os
+import signal
 
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
 
 application = get_wsgi_application()
+
+# resolve the cvterms, load the in-memory indexes and read the data version
+# before the worker serves any requests and reload them on demand when the
+# worker receives SIGUSR1
+from services import cvterms, indexes, pool, versions
+cvterms.preload()
+indexes.preload()
+versions.preload()
+
+# close the connections the preloading opened so workers forked from this
+# process don't share them
+from django.db import connections
+connections.close_all()
+pool.close_idle()
+
+# start the processes search results are aligned in, if any, before the worker
+# serves any requests
+from services import alignment
+alignment.start_pool()
+
+
+def reload_data(signum, frame):
+    cvterms.invalidate()
+    indexes.invalidate()
+    versions.invalidate()
+
+
+try:
+    signal.signal(signal.SIGUSR1, reload_data)
+except ValueError:
+    # signal handlers can only be set from the main thread
+    pass
@@ -0,0 +1,435 @@
+# aligns micro-synteny tracks to the query track on the server, so clients
+# don't have to; ported from the client's GCV.alignment module
+import atexit
+import itertools
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+# arrays
+import numpy as np
+# django
+from django.conf import settings
+from django.db import connections
+
+
+# the default algorithm and each algorithm's default parameters, as the
+# client's implementations of the algorithms default them
+DEFAULT_ALGORITHM = 'smith-waterman'
+DEFAULT_PARAMS = {
+    'smith-waterman': {
+        'match': 5,
+        'mismatch': 0,
+        'gap': -1,
+        'threshold': 0
+    },
+    'repeat': {
+        'match': 5,
+        'mismatch': 0,
+        'gap': -1,
+        'threshold': 10
+    }
+}
+
+# how many tracks are aligned at a time, e.g. by each pool process
+CHUNK_SIZE = 64
+
+# an alignment of a track to the query: its score, whether the track was
+# reversed, and the (index, x) of each aligned track gene in the order they
+# should be drawn
+Alignment = namedtuple('Alignment', ['score', 'reverse', 'genes'])
+
+
+##############
+# parameters #
+##############
+
+# returns the alignment parameters with the algorithm's defaults for any that
+# are missing; raises a ValueError if any are invalid
+def parse_params(params):
+    if not isinstance(params, dict):
+        raise ValueError('alignment parameters must be an object')
+    algorithm = params.get('algorithm', DEFAULT_ALGORITHM)
+    if algorithm not in ALGORITHMS:
+        raise ValueError('unknown alignment algorithm')
+    parsed = dict(DEFAULT_PARAMS[algorithm], algorithm=algorithm)
+    parsed.update(params)
+    for name in ('match', 'mismatch', 'gap', 'threshold'):
+        parsed[name] = float(parsed[name])
+    return parsed
+
+
+# encodes lists of family labels as integer arrays using a shared code table;
+# genes without a family are -1
+class FamilyEncoder(object):
+
+    def __init__(self):
+        self._codes = {}
+
+    def encode(self, families):
+        return np.asarray(
+            [self._codes.setdefault(f, len(self._codes)) if f else -1
+             for f in families],
+            dtype=np.int64
+        )
+
+
+##################
+# smith-waterman #
+##################
+
+# fills the smith-waterman matrix of the reference (rows) aligned to the
+# sequence (columns). Each row is computed with array operations: the diagonal
+# and vertical moves only depend on the previous row, and the horizontal moves
+# of a linear gap penalty are a running maximum, since
+# a[i][j] = max_{k<=j} v[k] + (j-k)*gap = j*gap + max_{k<=j} (v[k] - k*gap)
+def smith_waterman_matrix(sequence, reference, match, mismatch, gap):
+    rows = len(reference) + 1
+    cols = len(sequence) + 1
+    matches = (reference[:, None] == sequence[None, :]) &\
+              (reference[:, None] != -1)
+    scores = np.where(matches, match, mismatch)
+    a = np.zeros((rows, cols))
+    gaps = np.arange(cols) * gap
+    v = np.zeros(cols)
+    for i in range(1, rows):
+        v[1:] = np.maximum(
+            np.maximum(a[i-1, :-1] + scores[i-1], a[i-1, 1:] + gap),
+            0
+        )
+        a[i] = np.maximum.accumulate(v - gaps) + gaps
+    return a, scores
+
+
+# aligns the reference to the sequence; returns the alignment's score and its
+# columns as (sequence index, reference index) pairs, either of which can be
+# None for a gap
+def smith_waterman_align(sequence, reference, match, mismatch, gap):
+    a, scores = smith_waterman_matrix(sequence, reference, match, mismatch, gap)
+    rows, cols = a.shape
+    if rows == 1 or cols == 1:
+        return 0, []
+    # the last cell (in row-major order) with the maximum score
+    cells = a[1:, 1:].ravel()
+    best = cells.max()
+    last = int(np.flatnonzero(cells == best)[-1])
+    i = last // (cols-1) + 1
+    j = last % (cols-1) + 1
+    # traceback
+    a = a.tolist()
+    columns = []
+    while i > 0 and j > 0:
+        score = a[i][j]
+        if score == 0:
+            break
+        if score == a[i-1][j-1] + scores[i-1, j-1]:
+            columns.append((j-1, i-1))
+            i -= 1
+            j -= 1
+        elif score == a[i-1][j] + gap:
+            columns.append((None, i-1))
+            i -= 1
+        elif score == a[i][j-1] + gap:
+            columns.append((j-1, None))
+            j -= 1
+        else:
+            break
+    while j > 0:
+        columns.append((j-1, None))
+        j -= 1
+    columns.reverse()
+    return float(best), columns
+
+
+# positions the aligned reference genes relative to the query genes, like the
+# client's trackify; returns the (reference index, x) of each positioned gene
+def trackify(columns, length):
+    genes = []
+    query_count = 0
+    pre_query = 0
+    insertion_count = 0
+    for i, (s, r) in enumerate(columns):
+        # keep track of how many genes come before the query genes
+        if s is None and query_count == 0:
+            pre_query += 1
+        # an insertion
+        elif s is None:
+            # position the genes that come after the query genes
+            if query_count >= length:
+                genes.append((r, query_count))
+                query_count += 1
+            # track how many genes were inserted
+            else:
+                insertion_count += 1
+        # a deletion
+        elif r is None:
+            query_count += 1
+        # a (mis)match
+        else:
+            # position the genes that came before the query
+            if pre_query > 0:
+                for j in range(pre_query):
+                    genes.append((columns[j][1], -(pre_query - (j + 1))))
+                pre_query = 0
+            # position the genes that go between query genes
+            elif insertion_count > 0:
+                step = 1.0 / (insertion_count + 1)
+                for j in range(i - insertion_count, i):
+                    if columns[j][1] is not None:
+                        genes.append(
+                            (columns[j][1], query_count + (step * (i - j)) - 1)
+                        )
+                insertion_count = 0
+            genes.append((r, query_count))
+            query_count += 1
+    return genes
+
+
+# aligns a track to the query forward and reversed and keeps the better
+def smith_waterman_track(sequence, reference, params):
+    match, mismatch, gap = params['match'], params['mismatch'], params['gap']
+    forward_score, forward = smith_waterman_align(
+        sequence, reference, match, mismatch, gap)
+    reverse_score, reverse = smith_waterman_align(
+        sequence, reference[::-1], match, mismatch, gap)
+    if forward_score >= reverse_score:
+        return Alignment(
+            forward_score,
+            False,
+            trackify(forward, len(sequence))
+        )
+    n = len(reference)
+    reverse = [(s, None if r is None else n - 1 - r) for s, r in reverse]
+    return Alignment(reverse_score, True, trackify(reverse, len(sequence)))
+
+
+def smith_waterman(sequence, references, params):
+    return [[smith_waterman_track(sequence, r, params)] for r in references]
+
+
+##########
+# repeat #
+##########
+
+# fills the repeat matrices of a batch of references (rows) aligned to the
+# sequence (columns) at once. The references are given as a 2D array padded
+# with -1; a reference's matrix rows past its length aren't meaningful. Like
+# smith-waterman, each row is computed with array operations, but a cell's
+# floor is the row's first cell, which carries the best score of the previous
+# row less the threshold, so unmatched regions separate repeated alignments.
+def repeat_matrices(sequence, references, match, mismatch, gap, threshold):
+    count, rows = references.shape[0], references.shape[1] + 1
+    cols = len(sequence) + 1
+    matches = (references[:, :, None] == sequence[None, None, :]) &\
+              (references[:, :, None] != -1)
+    scores = np.where(matches, match, mismatch)
+    a = np.zeros((count, rows, cols))
+    gaps = np.arange(cols) * gap
+    v = np.zeros((count, cols))
+    for i in range(1, rows):
+        previous = a[:, i-1]
+        v[:, 0] = np.maximum(previous[:, 0], previous[:, 1:].max(axis=1) -
+                             threshold) if cols > 1 else previous[:, 0]
+        v[:, 1:] = np.maximum(
+            np.maximum(previous[:, :-1] + scores[:, i-1], previous[:, 1:] + gap),
+            v[:, :1]
+        )
+        a[:, i] = np.maximum.accumulate(v - gaps, axis=1) + gaps
+    return a
+
+
+# traces the alignments out of a reference's repeat matrix, like the client's
+# repeat; returns the score and columns of each alignment that has at least
+# two aligned genes
+def repeat_traceback(a, sequence, reference, threshold):
+    cols = len(sequence) + 1
+    i = len(reference)
+    j = 0
+    alignments = []
+    saving = False
+    length = 0
+    start = None
+    while not (i == 0 and j == 0):
+        if j == 0:
+            if saving and length < 2:
+                alignments.pop()
+                length = 0
+            saving = False
+            row = a[i]
+            best = max(row)
+            j_max = cols - 1 - row[::-1].index(best)
+            # start a new alignment only if j is a match and the alignment's
+            # score meets the threshold. An alignment can be traced back to
+            # the row it started in, so alignments aren't restarted in the same
+            # row (the client loops forever in this case)
+            if j_max > 0 and i > 0 and i != start and\
+               reference[i-1] == sequence[j_max-1] and best >= threshold:
+                length = 1
+                saving = True
+                start = i
+                j = j_max
+                # pad with the sequence genes not traversed by the alignment
+                columns = [(k, None) for k in range(len(sequence)-1, j-1, -1)]
+                columns.append((j-1, i-1))
+                alignments.append((best, columns))
+            else:
+                # try starting an alignment in the next row
+                i -= 1
+        elif i == 0:
+            j = 0
+        else:
+            # diag, up, left
+            moves = [a[i-1][j-1], a[i][j-1], a[i-1][j]]
+            best = max(moves)
+            # stop the alignment if a 0 cell was reached
+            if best == 0:
+                # add any missing sequence genes
+                if saving:
+                    columns.extend((k-1, None) for k in range(j-1, 0, -1))
+                i -= 1
+                j = 0
+            else:
+                move = 2 - moves[::-1].index(best)
+                if move == 0:
+                    i -= 1
+                    j -= 1
+                    # no alignments happen in the first row or column
+                    if saving and j > 0 and i > 0:
+                        columns.append((j-1, i-1))
+                        length += 1
+                elif move == 1:
+                    j -= 1
+                    if saving and j > 0:
+                        columns.append((j-1, None))
+                else:
+                    i -= 1
+                    if saving and i > 0:
+                        columns.append((None, i-1))
+    if saving and length < 2:
+        alignments.pop()
+    return [(score, path[::-1]) for score, path in alignments]
+
+
+# aligns a batch of tracks to the query forward and reversed in one pass; each
+# track can have any number of alignments, and its reverse alignments follow
+# its forward alignments
+def repeat(sequence, references, params):
+    if not references:
+        return []
+    lengths = [len(r) for r in references]
+    padded = np.full((2*len(references), max(lengths)), -1, dtype=np.int64)
+    for k, r in enumerate(references):
+        padded[2*k, :len(r)] = r
+        padded[2*k+1, :len(r)] = r[::-1]
+    a = repeat_matrices(sequence, padded, params['match'], params['mismatch'],
+                        params['gap'], params['threshold'])
+    sequence_list = sequence.tolist()
+    results = []
+    for k, n in enumerate(lengths):
+        track_alignments = []
+        for reverse in (False, True):
+            reference = padded[2*k + reverse, :n].tolist()
+            matrix = a[2*k + reverse, :n+1].tolist()
+            for score, columns in repeat_traceback(
+                    matrix, sequence_list, reference, params['threshold']):
+                if reverse:
+                    columns = [(s, None if r is None else n - 1 - r)
+                               for s, r in columns]
+                track_alignments.append(Alignment(
+                    score,
+                    reverse,
+                    trackify(columns, len(sequence))
+                ))
+        results.append(track_alignments)
+    return results
+
+
+# the algorithms tracks can be aligned with, by request name; each aligns a
+# batch of tracks to the query and returns a list of alignments for each track
+ALGORITHMS = {'smith-waterman': smith_waterman, 'repeat': repeat}
+
+
+############
+# pipeline #
+############
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+# starts the process pool tracks are aligned in if GCV_ALIGNMENT_PROCESSES
+# sets its size; it's started when a worker starts (see server/wsgi.py) rather
+# than in a request. The pool's processes are forked from this one, so its
+# database connections are closed first rather than shared with them, and the
+# pool is shut down when this process exits.
+def start_pool():
+    global _pool, _pool_pid
+    processes = getattr(settings, 'GCV_ALIGNMENT_PROCESSES', None)
+    with _pool_lock:
+        if processes and _pool is None:
+            connections.close_all()
+            _pool = multiprocessing.Pool(processes)
+            _pool_pid = os.getpid()
+            atexit.register(stop_pool)
+    return _pool
+
+
+# closes the pool and waits for its processes to exit; only the process that
+# started the pool can stop it
+def stop_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            return
+        pool, _pool, _pool_pid = _pool, None, None
+    pool.close()
+    pool.join()
+
+
+# the pool tracks are aligned in, or None to align them in the request's
+# process, e.g. if the pool wasn't started or this process was forked from the
+# one that started it, whose pool it can't use
+def get_pool():
+    pool = _pool
+    if pool is not None and _pool_pid == os.getpid():
+        return pool
+    return None
+
+
+def align_chunk(args):
+    sequence, references, params = args
+    return ALGORITHMS[params['algorithm']](sequence, references, params)
+
+
+# aligns each track (a list of family labels) to the query (also a list of
+# family labels); returns a list of Alignments for each track
+def align_tracks(query, tracks, params):
+    encoder = FamilyEncoder()
+    sequence = encoder.encode(query)
+    references = [encoder.encode(t) for t in tracks]
+    chunks = [(sequence, references[k:k+CHUNK_SIZE], params)
+              for k in range(0, len(references), CHUNK_SIZE)]
+    pool = get_pool()
+    if pool is None or len(chunks) <= 1:
+        results = map(align_chunk, chunks)
+    else:
+        results = pool.map(align_chunk, chunks)
+    return list(itertools.chain.from_iterable(results))
+
+
+# returns a copy of a track's genes (dicts) in alignment order, positioned and
+# with their strands flipped if the track was reversed; genes that are None
+# are skipped
+def apply_alignment(genes, alignment):
+    aligned = []
+    for i, x in alignment.genes:
+        if genes[i] is None:
+            continue
+        gene = dict(genes[i])
+        gene['x'] = x
+        gene['y'] = 0
+        if alignment.reverse and gene['strand'] is not None:
+            gene['strand'] = -gene['strand']
+        aligned.append(gene)
+    return aligned
@@ -0,0 +1,80 @@
+# the postgresql backend with its connections shared through an in-process
+# pool: opening a connection takes one from the pool and closing it gives it
+# back. Set CONN_MAX_AGE to 0 with this backend so connections are given back
+# after each request and can be used by the worker's other threads.
+import functools
+# django
+from django.conf import settings
+from django.db.backends.postgresql_psycopg2 import base
+from psycopg2 import extensions
+# import our helpers
+from services import pool
+
+
+Database = base.Database
+
+
+# whether an idle connection still works
+def check_connection(connection):
+    try:
+        connection.cursor().execute('SELECT 1')
+        connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+# ends a released connection's transaction and restores the session
+# settings of a new connection; returns False if the connection is broken
+def reset_connection(connection):
+    if connection.closed:
+        return False
+    try:
+        if connection.get_transaction_status() !=\
+           extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        connection.autocommit = False
+    except Database.Error:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_pool(self, conn_params):
+        return pool.get_pool(self.alias, lambda: pool.ConnectionPool(
+            functools.partial(Database.connect, **conn_params),
+            check_connection,
+            reset_connection,
+            max_size=getattr(settings, 'GCV_DB_POOL_SIZE',
+                             pool.DEFAULT_SIZE),
+            max_lifetime=getattr(settings, 'GCV_DB_POOL_MAX_LIFETIME',
+                                 pool.DEFAULT_MAX_LIFETIME),
+            health_check_interval=getattr(
+                settings,
+                'GCV_DB_POOL_HEALTH_CHECK_INTERVAL',
+                pool.DEFAULT_HEALTH_CHECK_INTERVAL
+            ),
+            timeout=getattr(settings, 'GCV_DB_POOL_TIMEOUT',
+                            pool.DEFAULT_TIMEOUT)
+        ))
+
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool(conn_params).acquire()
+        # set the isolation level as the postgresql backend does for a new
+        # connection
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.get_pool(self.get_connection_params())\
+                    .release(self.connection)
@@ -0,0 +1,228 @@
+# a server-side cache of the services' responses keyed on the normalized
+# request body and the data version
+import collections
+import functools
+import hashlib
+import json
+import threading
+# django
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+# import our helpers
+from services.versions import data_version
+
+
+############
+# backends #
+############
+
+# an in-process least recently used cache that holds at most max_bytes of
+# response content
+class LRUBackend(object):
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        size = len(entry[2])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[2])
+            self._entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                k, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[2])
+
+
+# stores responses in one of the caches configured in the CACHES setting, e.g.
+# a FileBasedCache on the filesystem or a cache shared by all the workers
+class DjangoCacheBackend(object):
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def get(self, key):
+        return caches[self.alias].get(key)
+
+    def set(self, key, entry):
+        caches[self.alias].set(key, entry)
+
+
+# the backend the GCV_RESPONSE_CACHE setting asks for: 'lru' for the
+# in-process cache, bounded by GCV_RESPONSE_CACHE_BYTES, the name of a cache in
+# CACHES, or None to disable caching. Caching is also disabled if the data
+# version isn't set, since cached responses couldn't be invalidated.
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    name = getattr(settings, 'GCV_RESPONSE_CACHE', None)
+    if name is None or data_version() is None:
+        return None
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if name == 'lru':
+                    _backend = LRUBackend(getattr(
+                        settings,
+                        'GCV_RESPONSE_CACHE_BYTES',
+                        DEFAULT_MAX_BYTES
+                    ))
+                else:
+                    _backend = DjangoCacheBackend(name)
+    return _backend
+
+
+############
+# counters #
+############
+
+_counters = {'hits': 0, 'misses': 0}
+_counters_lock = threading.Lock()
+
+
+def count(counter):
+    with _counters_lock:
+        _counters[counter] += 1
+
+
+# returns the cache's hit and miss counts (for this process)
+def stats():
+    with _counters_lock:
+        counts = dict(_counters)
+    backend = get_backend()
+    counts['backend'] = getattr(settings, 'GCV_RESPONSE_CACHE', None)\
+        if backend is not None else None
+    if isinstance(backend, LRUBackend):
+        counts['bytes'] = backend.size
+        counts['max_bytes'] = backend.max_bytes
+    return counts
+
+
+#########
+# cache #
+#########
+
+# returns the cache key of a request: a hash of its path, the data version,
+# the content types it accepts and its body with the keys sorted
+def request_key(request):
+    if not hasattr(request, 'gcv_request_key'):
+        request.gcv_request_key = compute_request_key(request)
+    return request.gcv_request_key
+
+
+def compute_request_key(request):
+    try:
+        body = json.dumps(
+            json.loads(request.body),
+            sort_keys=True,
+            separators=(',', ':')
+        )
+    except ValueError:
+        body = request.body
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    key = hashlib.sha1()
+    for part in (request.path, data_version(),
+                 request.META.get('HTTP_ACCEPT', '')):
+        key.update(part.encode('utf-8') + b'\0')
+    key.update(body)
+    return 'gcv-response:' + key.hexdigest()
+
+
+# decorator that serves a view's successful responses from the cache; streamed
+# responses aren't cached
+def cache_response(view):
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        backend = get_backend()
+        if backend is None:
+            return view(request, *args, **kwargs)
+        key = request_key(request)
+        entry = backend.get(key)
+        if entry is not None:
+            count('hits')
+            status, content_type, content, vary = entry
+            response = HttpResponse(
+                content,
+                content_type=content_type,
+                status=status
+            )
+            if vary:
+                response['Vary'] = vary
+            response['X-Cache'] = 'HIT'
+            return response
+        count('misses')
+        response = view(request, *args, **kwargs)
+        if isinstance(response, HttpResponse) and response.status_code == 200:
+            backend.set(key, (
+                response.status_code,
+                response['Content-Type'],
+                response.content,
+                response.get('Vary')
+            ))
+            response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+# returns the json serializable value cached under the given key, computing
+# and caching it if it isn't cached; the value is kept in the response cache's
+# backend, as the content of an entry, so it's bounded the same way
+def cached_value(key, compute):
+    backend = get_backend()
+    if backend is None:
+        return compute()
+    entry = backend.get(key)
+    if entry is not None:
+        return json.loads(entry[2])
+    value = compute()
+    backend.set(key, (None, None, json.dumps(value), None))
+    return value
+
+
+########################
+# conditional requests #
+########################
+
+# decorator that gives a view's successful responses a strong ETag derived
+# from the request and the data version, and answers requests whose
+# If-None-Match header has the ETag with a 304 without running the view; the
+# responses don't have ETags if the data version isn't set
+def conditional_response(view):
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if data_version() is None:
+            return view(request, *args, **kwargs)
+        etag = quote_etag(request_key(request).split(':')[-1])
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            etags = parse_etags(if_none_match)
+            if '*' in etags or etag.strip('"') in etags:
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+        response = view(request, *args, **kwargs)
+        if getattr(response, 'status_code', None) == 200:
+            response['ETag'] = etag
+        return response
+    return wrapper
@@ -0,0 +1,93 @@
+# a process-resident registry of the controlled vocabulary terms the services
+# look up, e.g. the 'gene' cvterm, so they're resolved once per worker
+# instead of on every request
+import threading
+# import our models
+from services.models import Cvterm
+
+
+# the terms the services use, by registry name: the name of the cv the term
+# must belong to (None for any) and the term's name
+TERMS = {
+    'syntenic_region': (None, 'syntenic_region'),
+    'gene': ('sequence', 'gene')
+}
+
+
+# resolves the ids of the given terms with a single query and caches them
+# until it's refreshed or invalidated
+class CvtermRegistry(object):
+
+    def __init__(self, terms=TERMS, ids=None):
+        self.terms = terms
+        self._ids = ids
+        self._stale = False
+        self._lock = threading.Lock()
+
+    # returns the ids of the terms that exist in the database, by registry name
+    def resolve(self):
+        names = set(term for cv, term in self.terms.values())
+        rows = list(Cvterm.objects.filter(name__in=names).order_by('pk')\
+            .values_list('pk', 'name', 'cv__name'))
+        ids = {}
+        for key, (cv, term) in self.terms.items():
+            for pk, name, cv_name in rows:
+                if name == term and (cv is None or cv == cv_name):
+                    ids[key] = pk
+                    break
+        return ids
+
+    # returns the id of the named term or None if it isn't in the database
+    def get(self, key):
+        ids = None if self._stale else self._ids
+        if ids is None:
+            with self._lock:
+                if self._stale or self._ids is None:
+                    self._ids = self.resolve()
+                    self._stale = False
+                ids = self._ids
+        return ids.get(key)
+
+    # resolves the terms again now
+    def refresh(self):
+        ids = self.resolve()
+        with self._lock:
+            self._ids = ids
+            self._stale = False
+
+    # marks the terms as stale so they're resolved again when they're next
+    # used; safe to call from a signal handler
+    def invalidate(self):
+        self._stale = True
+
+
+_registry = CvtermRegistry()
+
+
+# the registry the services use; another (e.g. one with known ids) can be
+# injected with set_registry
+def get_registry():
+    return _registry
+
+
+def set_registry(registry):
+    global _registry
+    _registry = registry
+
+
+# returns the id of the named term from the services' registry
+def get(key):
+    return _registry.get(key)
+
+
+# resolves the terms before the worker serves any requests
+def preload():
+    _registry.get('gene')
+
+
+def refresh():
+    _registry.refresh()
+
+
+def invalidate():
+    _registry.invalidate()
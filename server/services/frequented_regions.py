@@ -0,0 +1,360 @@
+# finds the frequented regions of a set of tracks on the server, so clients
+# don't have to; ported from the client's GCV.graph.frequentedRegions, an
+# implementation of the Frequented Regions algorithm (Cleary, et al, ACM-BCB
+# 2017). The tracks' families are the nodes of an undirected graph whose edges
+# join the families of neighboring genes, and the edges are contracted, most
+# supported first, into a hierarchy of regions. The client scans every edge to
+# find the next one to contract and re-sorts all of a region's intervals each
+# time an edge is updated; here the edges are kept in a priority queue and the
+# regions' intervals are kept merged, so an update merges two sorted lists.
+import bisect
+import heapq
+import itertools
+from collections import OrderedDict
+
+
+# the client's constraints on the parameters: alpha is the fraction of a
+# region's families a path must traverse to support it, kappa is the largest
+# insertion allowed, minsup is the fewest paths that must support a region for
+# it to be frequent and minsize is the fewest families it must have
+DEFAULT_MINSIZE = 1
+
+# families that aren't nodes of the graph, i.e. genes without a family
+OMIT = ('',)
+
+
+##############
+# parameters #
+##############
+
+# returns the algorithm's parameters, with the default minsize if it's
+# missing; raises a ValueError if any are missing or invalid
+def parse_params(params):
+    if not isinstance(params, dict):
+        raise ValueError('frequented region parameters must be an object')
+    try:
+        parsed = {
+            'alpha': float(params['alpha']),
+            'kappa': float(params['kappa']),
+            'minsup': int(params['minsup']),
+            'minsize': int(params.get('minsize', DEFAULT_MINSIZE))
+        }
+    except KeyError as e:
+        raise ValueError('missing parameter: %s' % e.args[0])
+    except TypeError:
+        raise ValueError('parameters must be numbers')
+    if not 0 < parsed['alpha'] <= 1:
+        raise ValueError('alpha must be in (0, 1]')
+    if parsed['kappa'] < 0:
+        raise ValueError("kappa can't be negative")
+    if parsed['minsup'] < 2:
+        raise ValueError('minsup must be at least 2')
+    if parsed['minsize'] < 1:
+        raise ValueError('minsize must be at least 1')
+    return parsed
+
+
+###########
+# regions #
+###########
+
+# merges intervals sorted by their beginnings, as (begin, end, span), into
+# disjoint intervals spanning the nodes of the intervals they cover;
+# intervals that touch are merged
+def merge_sorted(intervals):
+    merged = []
+    for begin, end, span in intervals:
+        if merged and begin <= merged[-1][1]:
+            b, e, s = merged[-1]
+            merged[-1] = (b, max(e, end), s + span)
+        else:
+            merged.append((begin, end, span))
+    return merged
+
+
+# merges two lists of merged intervals; the shorter list's intervals are
+# spliced into the longer one's where they belong, so the longer list, e.g.
+# that of a large region, isn't swept. Returns the merged intervals and the
+# largest span of those that changed.
+def merge_intervals(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    merged = list(a)
+    largest = 0
+    for begin, end, span in b:
+        # the first interval that ends at or after this one begins, and the
+        # first after it that begins after this one ends
+        lo = bisect.bisect_left(merged, (begin,))
+        if lo and merged[lo-1][1] >= begin:
+            lo -= 1
+        hi = lo
+        while hi < len(merged) and merged[hi][0] <= end:
+            b_, e_, s_ = merged[hi]
+            begin, end, span = min(begin, b_), max(end, e_), span + s_
+            hi += 1
+        merged[lo:hi] = [(begin, end, span)]
+        largest = max(largest, span)
+    return merged, largest
+
+
+# a region of the graph: a family, or the union of the two regions it's
+# contracted from (its descendants). Each path the region is on has the
+# disjoint intervals of the path it covers and how many of the region's nodes
+# each spans.
+class FrequentedRegion(object):
+
+    __slots__ = ('family', 'descendants', 'size', 'intervals', 'spans',
+                 'avg_alpha')
+
+    def __init__(self, family=None, descendants=(), size=1):
+        self.family = family
+        self.descendants = descendants
+        self.size = size
+        # the intervals of each path sorted by their beginnings and the
+        # largest span of each path, by path
+        self.intervals = {}
+        self.spans = {}
+        # the sum over the paths of the largest fraction of the region's nodes
+        # an interval of the path spans, if it's at least alpha
+        self.avg_alpha = 0
+
+    # the region of a family with its nodes on the given paths as (path,
+    # position); a family's intervals each span one node, however many genes
+    # of the family they cover
+    @classmethod
+    def leaf(cls, family, positions, kappa, alpha):
+        region = cls(family)
+        half_kappa = kappa / 2.0
+        for path, position in positions:
+            region.intervals.setdefault(path, []).append(
+                (position - half_kappa, position + half_kappa, 1))
+        for path, intervals in region.intervals.items():
+            region.intervals[path] = [(b, e, 1) for b, e, s in
+                                      merge_sorted(intervals)]
+            region.spans[path] = 1
+        region.compute_support(alpha)
+        return region
+
+    # the union of this region and another; only the intervals of the paths
+    # both regions are on have to be merged
+    def merge(self, other, alpha):
+        region = FrequentedRegion(descendants=(self, other),
+                                  size=self.size + other.size)
+        small, large = sorted((self, other), key=lambda r: len(r.intervals))
+        region.intervals = dict(large.intervals)
+        region.spans = dict(large.spans)
+        for path, intervals in small.intervals.items():
+            if path in region.intervals:
+                # an interval that absorbs others has a larger span than
+                # they did, so the largest span is the larger of the two
+                # regions' or that of an interval that changed
+                merged, largest = merge_intervals(region.intervals[path],
+                                                  intervals)
+                region.intervals[path] = merged
+                region.spans[path] = max(region.spans[path],
+                                         small.spans[path], largest)
+            else:
+                region.intervals[path] = intervals
+                region.spans[path] = small.spans[path]
+        region.compute_support(alpha)
+        return region
+
+    # adds up the region's support in path order, as the client does
+    def compute_support(self, alpha):
+        self.avg_alpha = 0
+        for path in sorted(self.spans):
+            path_alpha = float(self.spans[path]) / self.size
+            if path_alpha >= alpha:
+                self.avg_alpha += path_alpha
+
+    # the paths that support the region, once for each of their intervals
+    # that spans at least alpha of its nodes
+    def supporting(self, alpha):
+        return [path for path in sorted(self.intervals)
+                for b, e, span in self.intervals[path]
+                if float(span) / self.size >= alpha]
+
+    # the families of the region, in the order they were contracted
+    def families(self):
+        families = []
+        stack = [self]
+        while stack:
+            region = stack.pop()
+            if region.descendants:
+                stack.extend(reversed(region.descendants))
+            else:
+                families.append(region.family)
+        return families
+
+
+#########
+# graph #
+#########
+
+# the graph whose edges are contracted: each node's region and neighbors, and
+# each edge's region. The edges are in a priority queue ordered by their
+# support and then the order they were added in, which is the edge the client
+# picks when edges tie; an edge's stale entries are skipped when popped.
+class RegionGraph(object):
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.regions = {}
+        # neighbors are ordered by when their edges were added, like the
+        # client's sets
+        self.neighbors = {}
+        # each edge's region and when it was added, by (u, v) with u < v
+        self.edges = {}
+        self.queue = []
+        self._added = itertools.count()
+        self._pushed = itertools.count()
+
+    def add_node(self, family, region):
+        self.regions[family] = region
+        self.neighbors[family] = OrderedDict()
+
+    def _push(self, key, region, added):
+        heapq.heappush(self.queue, (-region.avg_alpha, added,
+                                    next(self._pushed), key, region))
+
+    # adds an edge whose region is the union of its nodes' regions
+    def add_edge(self, u, v):
+        key = (u, v) if u < v else (v, u)
+        if key in self.edges:
+            return
+        region = self.regions[u].merge(self.regions[v], self.alpha)
+        added = next(self._added)
+        self.edges[key] = (region, added)
+        self.neighbors[u][v] = True
+        self.neighbors[v][u] = True
+        self._push(key, region, added)
+
+    # updates an edge's region after one of its nodes' regions changed
+    def update_edge(self, u, v):
+        key = (u, v) if u < v else (v, u)
+        region = self.regions[u].merge(self.regions[v], self.alpha)
+        added = self.edges[key][1]
+        self.edges[key] = (region, added)
+        self._push(key, region, added)
+
+    def remove_node(self, u):
+        for v in self.neighbors.pop(u):
+            key = (u, v) if u < v else (v, u)
+            del self.edges[key]
+            del self.neighbors[v][u]
+        del self.regions[u]
+
+    # removes and returns the nodes and region of the most supported edge, or
+    # None if there are no edges left
+    def pop(self):
+        while self.queue:
+            neg_alpha, added, pushed, key, region = heapq.heappop(self.queue)
+            edge = self.edges.get(key)
+            if edge is not None and edge[0] is region:
+                return key, region
+        return None
+
+    # contracts an edge into its smaller node, whose region becomes the
+    # edge's; only the edges of the contracted nodes are updated
+    def contract(self, u, v, region):
+        keep, remove = (u, v) if u < v else (v, u)
+        self.regions[keep] = region
+        for w in self.neighbors[keep]:
+            if w != remove:
+                self.update_edge(keep, w)
+        for w in self.neighbors[remove]:
+            if w != keep and w not in self.neighbors[keep]:
+                self.add_edge(keep, w)
+        self.remove_node(remove)
+
+
+#############
+# algorithm #
+#############
+
+# builds the graph of the given tracks, each a list of family labels
+def build_graph(tracks, alpha, kappa, omit=OMIT):
+    positions = OrderedDict()
+    for path, track in enumerate(tracks):
+        for position, family in enumerate(track):
+            if family not in omit:
+                positions.setdefault(family, []).append((path, position))
+    graph = RegionGraph(alpha)
+    for family, family_positions in positions.items():
+        graph.add_node(family, FrequentedRegion.leaf(
+            family, family_positions, kappa, alpha))
+    # families are joined to the next gene with a family that isn't theirs
+    for track in tracks:
+        previous = None
+        for family in track:
+            if family in omit:
+                continue
+            if previous is not None and previous != family:
+                graph.add_edge(previous, family)
+            previous = family
+    return graph
+
+
+# contracts the graph's edges, most supported first, and returns the largest
+# region contracted, i.e. the root of the hierarchy of regions
+def contract(graph):
+    root = None
+    while True:
+        edge = graph.pop()
+        if edge is None:
+            return root
+        (u, v), region = edge
+        if root is None or root.size < region.size:
+            root = region
+        graph.contract(u, v, region)
+
+
+# returns the frequent regions in the hierarchy below the given root, as the
+# client's findFRs does: a region is frequent if it's large enough and it's
+# supported by more paths than the frequent region above it. Each is returned
+# as a json object with the frequent regions below it as its descendants. The
+# hierarchy can be as deep as there are families, so it's traversed with a
+# stack rather than recursively.
+def frequent_regions(root, alpha, minsup, minsize):
+    if root is None:
+        return []
+    # the frequent regions below each region (or itself), by id
+    found = {}
+    stack = [(root, 0, None)]
+    while stack:
+        region, previous_support, supporting = stack.pop()
+        if supporting is None:
+            supporting = region.supporting(alpha)
+            support = len(supporting)
+            frequent = region.size >= minsize and support >= minsup and\
+                support > previous_support
+            stack.append((region, previous_support, supporting))
+            for descendant in reversed(region.descendants):
+                stack.append((
+                    descendant,
+                    support if frequent else previous_support,
+                    None
+                ))
+            continue
+        support = len(supporting)
+        frequent = region.size >= minsize and support >= minsup and\
+            support > previous_support
+        below = [r for d in region.descendants for r in found.pop(id(d))]
+        if frequent:
+            found[id(region)] = [{
+                'families': region.families(),
+                'supporting': supporting,
+                'avg_alpha': region.avg_alpha,
+                'descendants': below
+            }]
+        else:
+            found[id(region)] = below
+    return found[id(root)]
+
+
+# returns the frequent regions of the given tracks, each a list of family
+# labels; a region's supporting paths are indexes of the tracks
+def frequented_regions(tracks, alpha, kappa, minsup, minsize,
+                       omit=OMIT):
+    graph = build_graph(tracks, alpha, kappa, omit)
+    return frequent_regions(contract(graph), alpha, minsup, minsize)
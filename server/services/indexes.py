@@ -0,0 +1,534 @@
+# process-resident indexes over the synteny data
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+# arrays
+import numpy as np
+# django
+from django.conf import settings
+# import our models and helpers
+from services import cvterms
+from services.models import Featureloc, GeneOrder, GeneFamilyAssignment
+
+
+############
+# registry #
+############
+
+# the index loaders in the order they should be (re)loaded and the indexes
+# they've loaded
+_loaders = []
+_indexes = {}
+_stale = False
+# reentrant so loaders can get the indexes they depend on
+_lock = threading.RLock()
+
+
+# decorator for registering a function that loads an index
+def register(name):
+    def decorator(loader):
+        _loaders.append((name, loader))
+        return loader
+    return decorator
+
+
+# returns the named index, loading it if it hasn't been loaded yet
+def get(name):
+    global _stale
+    index = None if _stale else _indexes.get(name)
+    if index is None:
+        with _lock:
+            if _stale:
+                _indexes.clear()
+                _stale = False
+            index = _indexes.get(name)
+            if index is None:
+                index = dict(_loaders)[name]()
+                _indexes[name] = index
+    return index
+
+
+# loads all the registered indexes, e.g. when a worker starts
+def preload():
+    for name, loader in _loaders:
+        get(name)
+
+
+# rebuilds the given indexes (all of them by default) and swaps them in
+def refresh(*names):
+    with _lock:
+        for name, loader in _loaders:
+            if not names or name in names:
+                _indexes[name] = loader()
+
+
+# marks all the indexes as stale so they're reloaded when they're next used;
+# safe to call from a signal handler
+def invalidate():
+    global _stale
+    _stale = True
+
+
+####################
+# gene order index #
+####################
+
+# the gene order stored as flat arrays sorted by chromosome and then number, so
+# the genes within a range of numbers on a chromosome are a contiguous slice
+class GeneOrderIndex(object):
+
+    def __init__(self, chromosome_ids, numbers, gene_ids):
+        self.chromosome_ids, starts = np.unique(
+            chromosome_ids,
+            return_index=True
+        )
+        # offsets[i]:offsets[i+1] are the positions on the ith chromosome
+        self.offsets = np.append(starts, len(chromosome_ids))
+        self.numbers = numbers
+        self.gene_ids = gene_ids
+        self._chromosome_map = dict(
+            (c, i) for i, c in enumerate(self.chromosome_ids.tolist())
+        )
+        # the positions of the genes sorted by gene id (for bisection)
+        self._gene_order = np.argsort(gene_ids, kind='mergesort')
+        self._sorted_gene_ids = gene_ids[self._gene_order]
+
+    @classmethod
+    def load(cls):
+        orders = GeneOrder.objects.filter(number__isnull=False)\
+            .order_by('chromosome_id', 'number')\
+            .values_list('chromosome_id', 'number', 'gene_id')
+        data = np.fromiter(
+            itertools.chain.from_iterable(orders.iterator()),
+            dtype=np.int64
+        ).reshape(-1, 3)
+        return cls(
+            np.ascontiguousarray(data[:, 0]),
+            np.ascontiguousarray(data[:, 1]),
+            np.ascontiguousarray(data[:, 2])
+        )
+
+    def __len__(self):
+        return len(self.gene_ids)
+
+    # returns the (start, end) positions of the given chromosome's genes
+    def bounds(self, chromosome_id):
+        i = self._chromosome_map.get(chromosome_id)
+        if i is None:
+            return 0, 0
+        return int(self.offsets[i]), int(self.offsets[i+1])
+
+    # returns the chromosome ids of the genes at the given positions
+    def chromosomes(self, positions):
+        i = np.searchsorted(self.offsets, positions, 'right') - 1
+        return self.chromosome_ids[i]
+
+    # returns an array of the positions of the given gene ids in the index;
+    # genes that aren't ordered have position -1
+    def lookup(self, gene_ids):
+        gene_ids = np.asarray(gene_ids, dtype=np.int64)
+        positions = np.full(len(gene_ids), -1, dtype=np.int64)
+        if not len(self) or not len(gene_ids):
+            return positions
+        i = np.searchsorted(self._sorted_gene_ids, gene_ids)
+        i[i == len(self._sorted_gene_ids)] = 0
+        found = self._sorted_gene_ids[i] == gene_ids
+        positions[found] = self._gene_order[i[found]]
+        return positions
+
+    # returns a map from the given gene ids to their positions in the index;
+    # genes that aren't ordered are omitted
+    def positions(self, gene_ids):
+        gene_ids = np.asarray(list(gene_ids), dtype=np.int64)
+        positions = self.lookup(gene_ids)
+        found = positions != -1
+        return dict(zip(gene_ids[found].tolist(), positions[found].tolist()))
+
+    # returns a map from the given gene ids to their (chromosome id, number)
+    def locate(self, gene_ids):
+        gene_positions = self.positions(gene_ids).items()
+        positions = np.asarray([p for g, p in gene_positions], dtype=np.int64)
+        return dict(zip(
+            [g for g, p in gene_positions],
+            zip(
+                self.chromosomes(positions).tolist(),
+                self.numbers[positions].tolist()
+            )
+        ))
+
+    # returns the positions of the genes on the given chromosome whose numbers
+    # are within the given (inclusive) bounds
+    def slice(self, chromosome_id, lower, upper):
+        start, end = self.bounds(chromosome_id)
+        numbers = self.numbers[start:end]
+        return slice(
+            start + int(np.searchsorted(numbers, lower, 'left')),
+            start + int(np.searchsorted(numbers, upper, 'right'))
+        )
+
+    # returns the start and stop positions of the genes within each of the
+    # given (inclusive) number ranges; the ranges are grouped by chromosome so
+    # each chromosome's numbers are bisected once for all of its ranges
+    def slices(self, chromosome_ids, lowers, uppers):
+        chromosome_ids = np.asarray(chromosome_ids, dtype=np.int64)
+        lowers = np.asarray(lowers, dtype=np.int64)
+        uppers = np.asarray(uppers, dtype=np.int64)
+        starts = np.zeros(len(chromosome_ids), dtype=np.int64)
+        stops = np.zeros(len(chromosome_ids), dtype=np.int64)
+        if not len(chromosome_ids):
+            return starts, stops
+        order = np.argsort(chromosome_ids, kind='mergesort')
+        breaks = np.flatnonzero(np.diff(chromosome_ids[order])) + 1
+        for group in np.split(order, breaks):
+            start, end = self.bounds(int(chromosome_ids[group[0]]))
+            numbers = self.numbers[start:end]
+            starts[group] = start + np.searchsorted(numbers, lowers[group], 'left')
+            stops[group] = start + np.searchsorted(numbers, uppers[group], 'right')
+        return starts, stops
+
+    # returns the ids of the genes on the given chromosome whose numbers are
+    # within the given (inclusive) bounds, ordered by number
+    def range(self, chromosome_id, lower, upper):
+        return self.gene_ids[self.slice(chromosome_id, lower, upper)]
+
+    # returns the ids of the genes within radius of the given number on the
+    # given chromosome, ordered by number
+    def neighborhood(self, chromosome_id, number, radius):
+        return self.range(chromosome_id, number-radius, number+radius)
+
+
+@register('gene_order')
+def load_gene_order_index():
+    return GeneOrderIndex.load()
+
+
+#####################
+# gene family index #
+#####################
+
+# an inverted index from gene family labels to posting lists of the positions
+# of the family's genes in a gene order index, so the genes of any set of
+# families can be found, sorted by chromosome and number, without the database
+class GeneFamilyIndex(object):
+
+    def __init__(self, gene_order, families, positions, codes):
+        # the index the positions refer to
+        self.gene_order = gene_order
+        self.families = families
+        self._family_codes = dict((f, i) for i, f in enumerate(families))
+        # the posting lists are stored back to back, sorted by family code and
+        # then position; offsets[i]:offsets[i+1] is the ith family's list
+        order = np.lexsort((positions, codes))
+        self.postings = positions[order].astype(np.int32)
+        self.offsets = np.searchsorted(
+            codes[order],
+            np.arange(len(families)+1)
+        )
+        # the family code of the gene at each position, -1 if it has none
+        self.position_codes = np.full(len(gene_order), -1, dtype=np.int32)
+        self.position_codes[positions] = codes
+
+    @classmethod
+    def load(cls, gene_order):
+        assignments = GeneFamilyAssignment.objects\
+            .values_list('gene_id', 'family_label')
+        families = []
+        family_codes = {}
+        gene_ids = []
+        codes = []
+        for gene_id, family in assignments.iterator():
+            if family not in family_codes:
+                family_codes[family] = len(families)
+                families.append(family)
+            gene_ids.append(gene_id)
+            codes.append(family_codes[family])
+        # only genes that are ordered can be indexed
+        positions = gene_order.lookup(gene_ids)
+        found = positions != -1
+        return cls(
+            gene_order,
+            families,
+            positions[found],
+            np.asarray(codes, dtype=np.int32)[found]
+        )
+
+    # returns the codes of the given families; unknown families are omitted
+    def codes(self, families):
+        return [self._family_codes[f] for f in families
+                if f in self._family_codes]
+
+    # returns the positions of the genes in the given families, sorted by
+    # chromosome and number, and the codes of their families
+    def search(self, families):
+        codes = np.asarray(sorted(set(self.codes(families))), dtype=np.int32)
+        lengths = self.offsets[codes+1] - self.offsets[codes]
+        positions = np.concatenate([np.zeros(0, dtype=self.postings.dtype)] +
+            [self.postings[self.offsets[c]:self.offsets[c+1]] for c in codes])
+        # merge the posting lists; a gene assigned to more than one of the
+        # families is only reported once
+        positions, i = np.unique(positions, return_index=True)
+        return positions, np.repeat(codes, lengths)[i]
+
+    # returns the family labels of the genes at the given positions; genes
+    # without a family have the empty label
+    def labels(self, positions):
+        return [self.families[c] if c != -1 else ''
+                for c in self.position_codes[positions].tolist()]
+
+
+@register('gene_family')
+def load_gene_family_index():
+    return GeneFamilyIndex.load(get('gene_order'))
+
+
+######################
+# nearest gene index #
+######################
+
+# the genes on each chromosome sorted by their midpoints, so the gene nearest
+# a position can be found by bisection. Chromosomes are loaded the first time
+# they're searched.
+class NearestGeneIndex(object):
+
+    def __init__(self):
+        self._chromosomes = {}
+        self._lock = threading.Lock()
+
+    # the id of the sequence ontology's gene cvterm
+    def gene_type(self):
+        gene_type = cvterms.get('gene')
+        return gene_type if gene_type is not None else -1
+
+    # returns the midpoints of the given chromosome's genes, sorted, and the
+    # genes' (id, fmin, fmax, strand) in the same order
+    def chromosome(self, chromosome_id):
+        genes = self._chromosomes.get(chromosome_id)
+        if genes is None:
+            with self._lock:
+                genes = self._chromosomes.get(chromosome_id)
+                if genes is None:
+                    genes = self.load(chromosome_id)
+                    self._chromosomes[chromosome_id] = genes
+        return genes
+
+    def load(self, chromosome_id):
+        locs = sorted(Featureloc.objects.filter(
+            feature__type=self.gene_type(),
+            srcfeature=chromosome_id,
+            fmin__isnull=False,
+            fmax__isnull=False
+        ).values_list('feature_id', 'fmin', 'fmax', 'strand'),
+        key=lambda l: ((l[1]+l[2]) // 2, l[0]))
+        midpoints = np.asarray(
+            [(l[1]+l[2]) // 2 for l in locs],
+            dtype=np.int64
+        )
+        return midpoints, locs
+
+    # returns the (id, fmin, fmax, strand) of the genes whose midpoints are
+    # nearest the given positions on the given chromosome, or None for each
+    # position if the chromosome has no genes
+    def nearest(self, chromosome_id, positions):
+        midpoints, locs = self.chromosome(chromosome_id)
+        if not locs:
+            return [None] * len(positions)
+        positions = np.asarray(positions, dtype=np.int64)
+        # the nearest midpoint is either the first at or after the position or
+        # the one before it
+        after = np.searchsorted(midpoints, positions)
+        after[after == len(midpoints)] = len(midpoints) - 1
+        before = np.maximum(after - 1, 0)
+        nearest = np.where(
+            np.abs(midpoints[before] - positions) <=
+                np.abs(midpoints[after] - positions),
+            before,
+            after
+        )
+        return [locs[i] for i in nearest.tolist()]
+
+
+@register('nearest_gene')
+def load_nearest_gene_index():
+    return NearestGeneIndex()
+
+
+###########################
+# chromosome family index #
+###########################
+
+# the genes of each chromosome grouped by family: maps from each family to the
+# positions of its genes on the chromosome in a gene order index, sorted by
+# number, and to the genes' midpoints, so a chromosome's genes in a family are
+# a dictionary lookup. The families come from a gene family index and the
+# midpoints from a nearest gene index; genes without a location on the
+# chromosome are omitted. Chromosomes are loaded the first time they're used.
+class ChromosomeFamilyIndex(object):
+
+    def __init__(self, family_index, nearest_gene):
+        self.family_index = family_index
+        self.nearest_gene = nearest_gene
+        self._chromosomes = {}
+        self._lock = threading.Lock()
+
+    # returns the positions and midpoints maps of the given chromosome
+    def chromosome(self, chromosome_id):
+        genes = self._chromosomes.get(chromosome_id)
+        if genes is None:
+            with self._lock:
+                genes = self._chromosomes.get(chromosome_id)
+                if genes is None:
+                    genes = self.load(chromosome_id)
+                    self._chromosomes[chromosome_id] = genes
+        return genes
+
+    def load(self, chromosome_id):
+        gene_order = self.family_index.gene_order
+        start, end = gene_order.bounds(chromosome_id)
+        codes = self.family_index.position_codes[start:end]
+        positions = np.flatnonzero(codes != -1) + start
+        codes = codes[codes != -1]
+        # look up the midpoints of the genes with a family
+        midpoint_map = dict((l[0], (l[1]+l[2]) / 2.0) for l in
+                            self.nearest_gene.chromosome(chromosome_id)[1])
+        midpoints = np.asarray(
+            [midpoint_map.get(g, np.nan) for g in
+             gene_order.gene_ids[positions].tolist()],
+            dtype=np.float64
+        )
+        located = ~np.isnan(midpoints)
+        positions = positions[located]
+        midpoints = midpoints[located]
+        codes = codes[located]
+        # group the genes by family; the sort is stable so each family's
+        # genes stay sorted by number
+        order = np.argsort(codes, kind='mergesort')
+        breaks = np.flatnonzero(np.diff(codes[order])) + 1
+        position_map = {}
+        midpoint_map = {}
+        for group in np.split(order, breaks) if len(order) else []:
+            family = self.family_index.families[codes[group[0]]]
+            position_map[family] = positions[group]
+            midpoint_map[family] = midpoints[group]
+        return position_map, midpoint_map
+
+    # returns the positions of the given chromosome's genes in the given
+    # families, sorted by family and then number, and their families
+    def genes(self, chromosome_id, families):
+        position_map = self.chromosome(chromosome_id)[0]
+        families = [f for f in sorted(set(families)) if f in position_map]
+        positions = np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                   [position_map[f] for f in families])
+        return positions, list(itertools.chain.from_iterable(
+            [f] * len(position_map[f]) for f in families))
+
+
+@register('chromosome_family')
+def load_chromosome_family_index():
+    return ChromosomeFamilyIndex(get('gene_family'), get('nearest_gene'))
+
+
+#############################
+# macro-synteny block table #
+#############################
+
+# the syntenic blocks of each chromosome stored as flat arrays sorted by
+# chromosome: the block's partner chromosome, its fmin and fmax on the
+# chromosome and its orientation (1 or -1), plus the name, length and organism
+# of each chromosome in a block. The table is built from the database by the
+# build_macro_synteny management command and memory-mapped by the workers.
+class MacroSyntenyTable(object):
+
+    ARRAYS = ('chromosome', 'partner', 'fmin', 'fmax', 'orientation')
+    DTYPES = (np.int64, np.int64, np.int64, np.int64, np.int8)
+
+    def __init__(self, arrays, chromosomes):
+        self.chromosome_ids, self.partners, self.fmins, self.fmaxs,\
+            self.orientations = arrays
+        # chromosome id -> (name, length, genus, species)
+        self.chromosomes = chromosomes
+        self.names = {}
+        for chromosome_id, (name, length, genus, species) in\
+                sorted(chromosomes.items()):
+            self.names.setdefault(name, chromosome_id)
+
+    # whether the table has been built
+    @property
+    def available(self):
+        return bool(self.chromosomes)
+
+    @classmethod
+    def empty(cls):
+        return cls([np.zeros(0, dtype=t) for t in cls.DTYPES], {})
+
+    # memory-maps the table at the given path; the path is resolved first so
+    # all the files are read from the same table even if it's replaced
+    @classmethod
+    def load(cls, path):
+        path = os.path.realpath(path)
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                  for name in cls.ARRAYS]
+        with open(os.path.join(path, 'chromosomes.json')) as f:
+            chromosomes = dict((int(c), tuple(v))
+                               for c, v in json.load(f).items())
+        return cls(arrays, chromosomes)
+
+    # writes the table to a new directory next to the given path and then
+    # swaps it in by renaming a symlink to it over the path, so the path is
+    # always a whole table; the table it replaces is removed, which doesn't
+    # affect workers that have it mapped
+    def save(self, path):
+        path = os.path.abspath(path)
+        parent, name = os.path.split(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        directory = tempfile.mkdtemp(prefix=name + '.', dir=parent)
+        arrays = (self.chromosome_ids, self.partners, self.fmins, self.fmaxs,
+                  self.orientations)
+        for array_name, array in zip(self.ARRAYS, arrays):
+            np.save(os.path.join(directory, array_name + '.npy'), array)
+        with open(os.path.join(directory, 'chromosomes.json'), 'w') as f:
+            json.dump(self.chromosomes, f)
+        os.chmod(directory, 0o755)
+        # a table that was written in place is moved aside, since a symlink
+        # can't be renamed over a directory
+        previous = None
+        if os.path.islink(path):
+            previous = os.path.realpath(path)
+        elif os.path.isdir(path):
+            previous = directory + '.old'
+            os.rename(path, previous)
+        link = directory + '.link'
+        os.symlink(os.path.basename(directory), link)
+        os.rename(link, path)
+        if previous is not None:
+            shutil.rmtree(previous, ignore_errors=True)
+
+    # returns the id of the named chromosome or None if it isn't in the table
+    def chromosome_id(self, name):
+        return self.names.get(name)
+
+    # returns the partner chromosomes, fmins, fmaxs and orientations of the
+    # given chromosome's blocks, optionally only those whose partner is one of
+    # the given chromosomes
+    def blocks(self, chromosome_id, partners=None):
+        start = np.searchsorted(self.chromosome_ids, chromosome_id, 'left')
+        end = np.searchsorted(self.chromosome_ids, chromosome_id, 'right')
+        blocks = [np.asarray(a[start:end]) for a in (self.partners,
+                  self.fmins, self.fmaxs, self.orientations)]
+        if partners is not None:
+            mask = np.in1d(blocks[0], np.asarray(partners, dtype=np.int64))
+            blocks = [a[mask] for a in blocks]
+        return blocks
+
+
+# the table in the directory named by the GCV_MACRO_SYNTENY_TABLE setting; the
+# table is empty if the setting isn't set or the table hasn't been built
+@register('macro_synteny')
+def load_macro_synteny_table():
+    path = getattr(settings, 'GCV_MACRO_SYNTENY_TABLE', None)
+    if path and os.path.exists(os.path.join(path, 'chromosomes.json')):
+        return MacroSyntenyTable.load(path)
+    return MacroSyntenyTable.empty()
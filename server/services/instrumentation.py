@@ -0,0 +1,121 @@
+# counts the database queries each view makes and the time they take
+import collections
+import functools
+import threading
+# django
+from django.conf import settings
+from django.db import connection
+
+
+_local = threading.local()
+_stats = collections.defaultdict(
+    lambda: {'requests': 0, 'queries': 0, 'db_time': 0.0}
+)
+_stats_lock = threading.Lock()
+
+
+# records a query that django's cursors didn't, e.g. one made with a
+# server-side cursor, for the view being instrumented in this thread
+def record(sql, duration):
+    queries = getattr(_local, 'queries', None)
+    if queries is not None:
+        queries.append({'sql': sql, 'time': '%.3f' % duration})
+
+
+# starts recording the current thread's queries; returns the state to restore
+# when recording stops
+def start():
+    state = (
+        getattr(_local, 'queries', None),
+        connection.queries_log,
+        connection.force_debug_cursor
+    )
+    _local.queries = []
+    connection.queries_log = collections.deque(
+        maxlen=connection.queries_log.maxlen
+    )
+    connection.force_debug_cursor = True
+    return state
+
+
+# stops recording the current thread's queries and returns them
+def stop(state):
+    queries, queries_log, force_debug_cursor = state
+    recorded = list(connection.queries_log) + _local.queries
+    # the queries are only kept in django's log if django would have logged
+    # them anyway, i.e. in debug mode, so the log doesn't grow otherwise
+    if force_debug_cursor or settings.DEBUG:
+        queries_log.extend(connection.queries_log)
+    connection.queries_log = queries_log
+    connection.force_debug_cursor = force_debug_cursor
+    _local.queries = queries
+    return recorded
+
+
+# adds a request's queries to the given view's totals; returns the number of
+# queries and their time (in seconds)
+def tally(name, queries):
+    count = len(queries)
+    db_time = sum(float(q['time']) for q in queries)
+    with _stats_lock:
+        stats = _stats[name]
+        stats['requests'] += 1
+        stats['queries'] += count
+        stats['db_time'] += db_time
+    return count, db_time
+
+
+# returns each instrumented view's request count and total queries and
+# database time (in milliseconds), for this process
+def stats():
+    with _stats_lock:
+        return dict(
+            (name, {
+                'requests': s['requests'],
+                'queries': s['queries'],
+                'db_time': round(s['db_time'] * 1000, 3)
+            }) for name, s in _stats.items()
+        )
+
+
+# yields a streaming response's content while recording its queries, since a
+# streamed view keeps querying the database as its content is generated
+def instrument_stream(name, content, state):
+    try:
+        for chunk in content:
+            yield chunk
+    finally:
+        tally(name, stop(state))
+
+
+# decorator that counts the queries a view makes and the time they take when
+# the GCV_QUERY_STATS setting is on. The counts are added to the view's totals
+# and, unless the response is streamed, sent in the X-DB-Queries and X-DB-Time
+# (milliseconds) headers.
+def instrument_queries(view):
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not getattr(settings, 'GCV_QUERY_STATS', False):
+            return view(request, *args, **kwargs)
+        name = view.__name__
+        state = start()
+        try:
+            response = view(request, *args, **kwargs)
+        except:
+            tally(name, stop(state))
+            raise
+        if getattr(response, 'streaming', False):
+            response.streaming_content = instrument_stream(
+                name,
+                response.streaming_content,
+                state
+            )
+            return response
+        count, db_time = tally(name, stop(state))
+        try:
+            response['X-DB-Queries'] = str(count)
+            response['X-DB-Time'] = '%.3f' % (db_time * 1000)
+        except TypeError:
+            pass
+        return response
+    return wrapper
@@ -0,0 +1,211 @@
+# reports the indexes the services' queries need that the database is missing,
+# optionally creates them, and times a canned set of the services' queries
+# before and after
+import time
+# django
+from django.core.management.base import BaseCommand
+from django.db import connection
+# import our helpers
+from services import cvterms, queries
+
+
+# the indexes the services' queries need: the index's name, its table and
+# columns, and the predicate it serves. An existing index whose leading
+# columns are the same serves the predicate just as well.
+INDEXES = (
+    ('gcv_gene_order_chromosome_number', 'gene_order',
+     ('chromosome_id', 'number'),
+     'gene_order ranges: chromosome_id = ? AND number BETWEEN ? AND ?'),
+    ('gcv_gene_order_gene', 'gene_order', ('gene_id',),
+     'gene_order lookups by gene: gene_id IN (...)'),
+    ('gcv_gene_family_assignment_gene', 'gene_family_assignment',
+     ('gene_id',),
+     'family joins: gene_family_assignment.gene_id = feature.feature_id'),
+    ('gcv_gene_family_assignment_family', 'gene_family_assignment',
+     ('family_label',),
+     'family searches: family_label IN (...)'),
+    ('gcv_featureloc_srcfeature_rank', 'featureloc',
+     ('srcfeature_id', 'rank'),
+     'macro-synteny blocks: srcfeature_id = ? AND rank = 0'),
+)
+
+# the canned queries that are timed, by name; their parameters are sampled
+# from the database
+GENE_ORDER_RANGE_SQL = '''
+    SELECT gene_id, number FROM gene_order
+    WHERE chromosome_id = %s AND number BETWEEN %s AND %s
+    ORDER BY number
+'''
+
+FAMILY_SEARCH_SQL = '''
+    SELECT gene_id FROM gene_family_assignment
+    WHERE family_label {families}
+'''
+
+MACRO_SYNTENY_SQL = '''
+    SELECT feature_id, fmin, fmax, strand FROM featureloc
+    WHERE srcfeature_id = %s AND rank = 0
+'''
+
+# how many genes on either side of the sampled gene the range query gets
+NEIGHBORS = 25
+# how many families the family search gets
+FAMILIES = 20
+
+
+# returns the columns of the given table's indexes
+def existing_indexes(cursor, table):
+    constraints = connection.introspection.get_constraints(cursor, table)
+    return [tuple(c['columns']) for c in constraints.values()
+            if c['index'] or c['primary_key'] or c['unique']]
+
+
+# returns the recommended indexes that no existing index serves
+def missing_indexes(cursor):
+    missing = []
+    for name, table, columns, predicate in INDEXES:
+        existing = existing_indexes(cursor, table)
+        if not any(e[:len(columns)] == columns for e in existing):
+            missing.append((name, table, columns, predicate))
+    return missing
+
+
+# creates the given index; on PostgreSQL it's built concurrently so the table
+# isn't locked against writes while it's built, which can't be done in a
+# transaction
+def create_index(cursor, name, table, columns):
+    concurrently = 'CONCURRENTLY ' if connection.vendor == 'postgresql'\
+        else ''
+    cursor.execute('CREATE INDEX %s%s ON %s (%s)' % (
+        concurrently, name, table, ', '.join(columns)))
+
+
+# returns the canned queries as (name, sql, params), with parameters sampled
+# from the database; queries whose parameters can't be sampled are omitted
+def canned_queries(cursor):
+    canned = []
+    cursor.execute('''
+        SELECT chromosome_id, number FROM gene_order
+        WHERE number IS NOT NULL ORDER BY gene_order_id LIMIT 1
+    ''')
+    row = cursor.fetchone()
+    if row is not None:
+        chromosome_id, number = row
+        params = [chromosome_id, number - NEIGHBORS, number + NEIGHBORS]
+        canned.append(('gene order range', GENE_ORDER_RANGE_SQL, params))
+        cursor.execute(GENE_ORDER_RANGE_SQL, params)
+        gene_ids = [gene_id for gene_id, n in cursor.fetchall()]
+        test, params = queries.in_values(gene_ids)
+        canned.append((
+            'gene details',
+            queries.GENE_DETAILS_SQL.format(ids=test),
+            params
+        ))
+    cursor.execute('''
+        SELECT DISTINCT family_label FROM gene_family_assignment
+        ORDER BY family_label LIMIT %s
+    ''', [FAMILIES])
+    families = [family for family, in cursor.fetchall()]
+    if families:
+        test, params = queries.in_values(families)
+        canned.append((
+            'family search',
+            FAMILY_SEARCH_SQL.format(families=test),
+            params
+        ))
+    synteny_type = cvterms.get('syntenic_region')
+    if synteny_type is not None:
+        cursor.execute('''
+            SELECT l.srcfeature_id FROM featureloc l
+            JOIN feature f ON f.feature_id = l.feature_id
+            WHERE f.type_id = %s AND l.rank = 0 LIMIT 1
+        ''', [synteny_type])
+        row = cursor.fetchone()
+        if row is not None:
+            canned.append(('macro-synteny blocks', MACRO_SYNTENY_SQL,
+                           list(row)))
+    return canned
+
+
+# returns the time (in milliseconds) the given query takes and its plan. On
+# PostgreSQL the time is the execution time EXPLAIN ANALYZE reports; other
+# databases have no EXPLAIN ANALYZE, so the query is timed and has no plan
+def explain(cursor, sql, params):
+    if connection.vendor == 'postgresql':
+        cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+        plan = [line for line, in cursor.fetchall()]
+        milliseconds = None
+        for line in plan:
+            # "Execution time" since PostgreSQL 9.4, "Total runtime" before
+            if line.startswith(('Execution time', 'Execution Time',
+                                'Total runtime')):
+                milliseconds = float(line.split(':')[1].split()[0])
+        return milliseconds, plan
+    start = time.time()
+    cursor.execute(sql, params)
+    cursor.fetchall()
+    return (time.time() - start) * 1000, []
+
+
+class Command(BaseCommand):
+
+    help = 'Reports the indexes the services need that the database is ' +\
+           'missing and optionally creates them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--create',
+            action='store_true',
+            default=False,
+            help='create the missing indexes'
+        )
+        parser.add_argument(
+            '--explain',
+            action='store_true',
+            default=False,
+            help='time a canned set of the services\' queries with ' +
+                 'EXPLAIN ANALYZE (before and after the indexes are ' +
+                 'created, with --create)'
+        )
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        with connection.cursor() as cursor:
+            missing = missing_indexes(cursor)
+            if not missing:
+                self.stdout.write('No indexes are missing')
+            for name, table, columns, predicate in missing:
+                self.stdout.write('Missing %s on %s (%s) for %s' % (
+                    name, table, ', '.join(columns), predicate))
+            canned = canned_queries(cursor) if options['explain'] else []
+            before = self.explain_all(cursor, canned, 'before', verbosity)
+            if options['create'] and missing:
+                for name, table, columns, predicate in missing:
+                    start = time.time()
+                    create_index(cursor, name, table, columns)
+                    self.stdout.write('Created %s in %.2fs' % (
+                        name, time.time() - start))
+                cursor.execute('ANALYZE')
+                after = self.explain_all(cursor, canned, 'after', verbosity)
+                for query_name, sql, params in canned:
+                    if before[query_name] is not None and\
+                       after[query_name] is not None:
+                        self.stdout.write('%s: %.3f ms -> %.3f ms' % (
+                            query_name, before[query_name],
+                            after[query_name]))
+
+    # times the given queries, writing their plans if the verbosity is above
+    # the default, and returns their times by name
+    def explain_all(self, cursor, canned, label, verbosity):
+        times = {}
+        for name, sql, params in canned:
+            milliseconds, plan = explain(cursor, sql, params)
+            times[name] = milliseconds
+            self.stdout.write('%s (%s): %s' % (
+                name, label,
+                '%.3f ms' % milliseconds if milliseconds is not None
+                else 'unknown'))
+            if verbosity > 1:
+                for line in plan:
+                    self.stdout.write('    ' + line)
+        return times
@@ -0,0 +1,72 @@
+# builds the macro-synteny block table the workers memory-map
+import numpy as np
+# django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+# import our helpers
+from services import cvterms, queries, versions
+from services.indexes import MacroSyntenyTable
+
+
+# the blocks of each chromosome: the location of each syntenic region on the
+# chromosome (rank 0) and the chromosome it's syntenic with (rank 1)
+BLOCKS_SQL = '''
+    SELECT b.srcfeature_id, r.srcfeature_id, b.fmin, b.fmax, b.strand
+    FROM featureloc b
+    JOIN feature f ON f.feature_id = b.feature_id
+    JOIN featureloc r ON r.feature_id = b.feature_id AND r.rank = 1
+    WHERE f.type_id = %s AND b.rank = 0
+    ORDER BY b.srcfeature_id, b.featureloc_id
+'''
+
+# the name, length and organism of the given chromosomes
+CHROMOSOMES_SQL = '''
+    SELECT c.feature_id, c.name, c.seqlen, o.genus, o.species
+    FROM feature c
+    JOIN organism o ON o.organism_id = c.organism_id
+    WHERE c.feature_id {ids}
+'''
+
+
+class Command(BaseCommand):
+
+    help = 'Builds the macro-synteny block table the services memory-map'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=getattr(settings, 'GCV_MACRO_SYNTENY_TABLE', None),
+            help='the path to write the table at (defaults to the ' +
+                 'GCV_MACRO_SYNTENY_TABLE setting)'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            raise CommandError('no path given and GCV_MACRO_SYNTENY_TABLE ' +
+                               'is not set')
+        synteny_type = cvterms.get('syntenic_region')
+        if synteny_type is None:
+            raise CommandError('the syntenic_region cvterm does not exist')
+        # get the blocks, sorted by chromosome
+        columns = ([], [], [], [], [])
+        for row in queries.stream_rows(BLOCKS_SQL, [synteny_type]):
+            chromosome_id, partner_id, fmin, fmax, strand = row
+            for column, value in zip(columns, (chromosome_id, partner_id,
+                                               fmin, fmax,
+                                               -1 if strand == -1 else 1)):
+                column.append(value)
+        arrays = [np.asarray(c, dtype=t)
+                  for c, t in zip(columns, MacroSyntenyTable.DTYPES)]
+        # get the chromosomes in the blocks
+        chromosome_ids = list(set(columns[0]) | set(columns[1]))
+        chromosomes = {}
+        for row in queries.stream_rows_in(CHROMOSOMES_SQL, 'ids',
+                                          chromosome_ids):
+            chromosome_id, name, length, genus, species = row
+            chromosomes[chromosome_id] = (name, length, genus, species)
+        MacroSyntenyTable(arrays, chromosomes).save(path)
+        self.stdout.write('Wrote %d blocks on %d chromosomes to %s' % (
+            len(arrays[0]), len(chromosomes), path))
+        # responses cached for the old table are no longer served
+        self.stdout.write('Bumped the data version to %d' % versions.bump())
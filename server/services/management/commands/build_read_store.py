@@ -0,0 +1,25 @@
+# builds or refreshes the denormalized read store the views can read from
+from django.core.management.base import BaseCommand
+# import our helpers
+from services import readstore, versions
+
+
+class Command(BaseCommand):
+
+    help = 'Builds the read store the services read genes from, or ' +\
+           'refreshes it if it has already been built'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            default=False,
+            help='rebuild the store from scratch instead of refreshing it'
+        )
+
+    def handle(self, *args, **options):
+        inserted, deleted, elapsed = readstore.build(options['rebuild'])
+        self.stdout.write('Inserted %d and deleted %d rows of %s in %.2fs' % (
+            inserted, deleted, readstore.TABLE, elapsed))
+        # responses cached for the old rows are no longer served
+        self.stdout.write('Bumped the data version to %d' % versions.bump())
@@ -0,0 +1,14 @@
+# bumps the data version the services' cached responses and ETags are keyed on
+from django.core.management.base import BaseCommand
+# import our helpers
+from services import versions
+
+
+class Command(BaseCommand):
+
+    help = 'Bumps the data version after the database is updated, so ' +\
+           'responses cached for the old data are no longer served'
+
+    def handle(self, *args, **options):
+        version = versions.bump()
+        self.stdout.write('Bumped the data version to %d' % version)
@@ -0,0 +1,463 @@
+# a multiple alignment of micro-synteny tracks computed on the server, so
+# clients don't have to; ported from the client's profile HMM based
+# GCV.alignment.msa. A profile HMM is trained on the tracks one at a time,
+# growing match columns where tracks insert genes, and then every track is
+# aligned to it in both orientations with the Viterbi algorithm, in log space.
+import json
+import hashlib
+from collections import Counter
+# arrays
+import numpy as np
+
+
+# the HMM's states; when paths through two states are equally probable the
+# client prefers the state whose id is lexicographically larger, i.e. match
+# over insert over delete over the start state
+START, DELETE, INSERT, MATCH, END = range(5)
+
+# how many sequences are aligned to the trained HMM at a time
+CHUNK_SIZE = 128
+
+# batches of at most this many sequences fill their delete states in python
+SMALL_BATCH = 4
+
+NEG_INF = -np.inf
+
+
+#######
+# hmm #
+#######
+
+# a profile HMM with the canonical multiple sequence alignment topology:
+# num_columns match and delete states and num_columns+1 insert states. Only
+# the match states emit characters (insertions are free); their emission
+# probabilities are learned from the paths embedded in them. The transition
+# probabilities only depend on the number of characters.
+class ProfileHMM(object):
+
+    def __init__(self, num_columns, num_characters):
+        self.num_columns = num_columns
+        self.num_characters = num_characters
+        # each match state starts with a pseudo-count of every character and
+        # embedded paths count amplifier times
+        self.amplifier = num_characters ** 1.25
+        self.counts = np.ones((num_columns, num_characters))
+        self.observations = np.full(num_columns, float(num_characters))
+        # the character each path emits from each match state and the
+        # characters each path emits from each insert state, by path id
+        self.match_paths = [{} for j in range(num_columns)]
+        self.insert_paths = [{} for j in range(num_columns + 1)]
+        indel = 1.0 / (2 + num_characters)
+        self.log_indel = np.log(indel)
+        # with no characters the match states can't be entered
+        with np.errstate(divide='ignore'):
+            self.log_match = np.log(num_characters / (2.0 + num_characters))
+        self.log_end = np.log(1 - indel)
+
+    # the probability of each match state emitting each character; the extra
+    # character (num_characters) is one the model has never seen
+    def emissions(self):
+        return np.hstack([
+            self.counts / self.observations[:, None],
+            np.zeros((self.num_columns, 1))
+        ])
+
+    # the most probable paths of the given sequences (arrays of character
+    # codes) through the HMM and their log probabilities. A path is a list of
+    # (state, column) ending with the end state.
+    def viterbi(self, sequences):
+        L = self.num_columns
+        B = len(sequences)
+        lengths = np.asarray([len(s) for s in sequences], dtype=np.int64)
+        N = lengths.max() if B else 0
+        codes = np.full((B, N), self.num_characters, dtype=np.int64)
+        for b, s in enumerate(sequences):
+            codes[b, :len(s)] = s
+        with np.errstate(divide='ignore'):
+            log_emissions = np.log(self.emissions())
+        lm, li = self.log_match, self.log_indel
+        # the pointers of every row; the values of the previous row
+        m_ptrs = np.zeros((N+1, B, L), dtype=np.int8)
+        i_ptrs = np.zeros((N+1, B, L+1), dtype=np.int8)
+        d_ptrs = np.zeros((N+1, B, L), dtype=np.int8)
+        m = np.full((B, L), NEG_INF)
+        i = np.full((B, L+1), NEG_INF)
+        d = self.deletions(m, i, d_ptrs[0], 0)
+        ends = np.full((B, 3), NEG_INF)
+        self.end_candidates(ends, lengths == 0, m, i, d)
+        neg = np.full((B, 1), NEG_INF)
+        for r in range(1, N+1):
+            # the transitions into a column's match and insert states come
+            # from the previous column's states (or the start state) and the
+            # column's insert state in the previous row
+            e = log_emissions[:, codes[:, r-1]].T
+            from_m = np.hstack([neg, m])
+            from_d = np.hstack([neg, d])
+            from_start = self.start_candidates(B, L+1, r == 1)
+            m = self.select(m_ptrs[r], [
+                (from_m[:, :L] + lm) + e,
+                (i[:, :L] + lm) + e,
+                (from_d[:, :L] + lm) + e,
+                (from_start[:, :L] + lm) + e
+            ])
+            i = self.select(i_ptrs[r], [
+                from_m + li,
+                i + li,
+                from_d + li,
+                from_start + li
+            ])
+            d = self.deletions(m, i, d_ptrs[r], r)
+            self.end_candidates(ends, lengths == r, m, i, d)
+        # the end state is entered from the last column
+        end_ptrs = np.zeros((B, 1), dtype=np.int8)
+        probabilities = self.select(end_ptrs, [
+            ends[:, 0:1],
+            ends[:, 1:2],
+            ends[:, 2:3],
+            np.full((B, 1), NEG_INF)
+        ])[:, 0]
+        paths = [self.traceback(b, lengths[b], probabilities[b],
+                                end_ptrs[b, 0], m_ptrs, i_ptrs, d_ptrs)
+                 for b in range(B)]
+        return paths, probabilities.tolist()
+
+    # the start state's value in the first width columns of a row: it can
+    # only be left for the first column and only from the row before the
+    # sequence's first character
+    def start_candidates(self, B, width, start):
+        candidates = np.full((B, width), NEG_INF)
+        if start and width:
+            candidates[:, 0] = 0.0
+        return candidates
+
+    # returns the most probable of the given match, insert, delete and start
+    # state candidates and puts which it was in ptrs; ties go to the state the
+    # client prefers
+    def select(self, ptrs, candidates):
+        stacked = np.stack(candidates)
+        ptrs[...] = MATCH - np.argmax(stacked, axis=0)
+        return stacked.max(axis=0)
+
+    # returns the delete states' values of row r given its match and insert
+    # states. A column's delete state can be entered from the previous
+    # column's delete state in the same row, so the columns are filled in
+    # order (for all the sequences at once) to add the transitions up in the
+    # same order as the client does.
+    def deletions(self, m, i, ptrs, r):
+        B, L = m.shape
+        li = self.log_indel
+        d = self.select(ptrs, [
+            np.hstack([np.full((B, 1), NEG_INF), m])[:, :L] + li,
+            i[:, :L] + li,
+            np.full((B, L), NEG_INF),
+            self.start_candidates(B, L, r == 0) + li
+        ])
+        # a few sequences' (e.g. while training) are faster to chain in python
+        if B <= SMALL_BATCH:
+            for b in range(B):
+                row, row_ptrs = d[b].tolist(), ptrs[b].tolist()
+                for j in range(1, L):
+                    chain = row[j-1] + li
+                    # the previous delete state loses ties
+                    if chain > row[j]:
+                        row[j] = chain
+                        row_ptrs[j] = DELETE
+                d[b], ptrs[b] = row, row_ptrs
+            return d
+        # the previous delete state rarely wins, so only the columns where it
+        # can are visited: those where it wins over the other candidates and
+        # those after a column it won in
+        candidates = np.flatnonzero((d[:, :-1] + li > d[:, 1:]).any(axis=0))
+        j = candidates[0] + 1 if len(candidates) else L
+        while j < L:
+            chain = d[:, j-1] + li
+            # the previous delete state loses ties
+            take = chain > d[:, j]
+            if take.any():
+                d[take, j] = chain[take]
+                ptrs[take, j] = DELETE
+                j += 1
+            else:
+                later = candidates[candidates >= j]
+                j = later[0] + 1 if len(later) else L
+        return d
+
+    # records the candidates for the end state of the sequences that end at
+    # the current row: the last match, insert and delete states
+    def end_candidates(self, ends, ending, m, i, d):
+        if not ending.any():
+            return
+        L = self.num_columns
+        le = self.log_end
+        if L:
+            ends[ending, 0] = m[ending, L-1] + le
+            ends[ending, 2] = d[ending, L-1] + le
+        ends[ending, 1] = i[ending, L] + le
+
+    # follows a sequence's pointers back from the end state; a sequence has
+    # no path if it's empty and the HMM has no columns
+    def traceback(self, b, length, probability, ptr, m_ptrs, i_ptrs, d_ptrs):
+        path = [(END, self.num_columns)]
+        if probability == NEG_INF:
+            return path
+        state, j, r = END, self.num_columns, length
+        while True:
+            if state != END:
+                ptr = (m_ptrs, i_ptrs, d_ptrs)[(MATCH, INSERT, DELETE)
+                                               .index(state)][r, b, j]
+                if state != DELETE:
+                    r -= 1
+            if ptr == START:
+                break
+            state = int(ptr)
+            if state != INSERT:
+                j -= 1
+            path.append((state, j))
+        path.reverse()
+        return path
+
+    # embeds a sequence's path in the HMM, updating the emission probabilities
+    # of the match states it passes through
+    def embed(self, path_id, path, sequence):
+        k = 0
+        for state, j in path:
+            if state == MATCH:
+                self.match_paths[j][path_id] = sequence[k]
+                self.counts[j, sequence[k]] += self.amplifier
+                self.observations[j] += self.amplifier
+                k += 1
+            elif state == INSERT:
+                self.insert_paths[j].setdefault(path_id, [])\
+                    .append(sequence[k])
+                k += 1
+
+    # converts each insert state that paths pass through into as many new
+    # match columns as the longest run of insertions, embedding the inserted
+    # characters in them
+    def surgery(self):
+        j = 0
+        while j <= self.num_columns:
+            paths = self.insert_paths[j]
+            grow = 0
+            if paths:
+                grow = max(len(p) for p in paths.values())
+                counts = np.ones((grow, self.num_characters))
+                observations = np.full(grow, float(self.num_characters))
+                match_paths = [{} for k in range(grow)]
+                for path_id, characters in paths.items():
+                    for k, c in enumerate(characters):
+                        match_paths[k][path_id] = c
+                        counts[k, c] += self.amplifier
+                        observations[k] += self.amplifier
+                self.counts = np.vstack(
+                    [self.counts[:j], counts, self.counts[j:]])
+                self.observations = np.concatenate(
+                    [self.observations[:j], observations,
+                     self.observations[j:]])
+                self.match_paths[j:j] = match_paths
+                self.insert_paths[j:j+1] = [{} for k in range(grow + 1)]
+                self.num_columns += grow
+            j += grow + 1
+
+
+#############
+# alignment #
+#############
+
+# the probability of each of a sequence's characters being emitted along its
+# path; inserted characters have probability 0
+def sequence_emissions(emissions, path, sequence):
+    probabilities = []
+    k = 0
+    for state, j in path:
+        if state == MATCH:
+            probabilities.append(emissions[j, sequence[k]])
+            k += 1
+        elif state == INSERT:
+            probabilities.append(0)
+            k += 1
+    return probabilities
+
+
+# the x coordinate of each of a sequence's characters along its path: the
+# column of the match state it's emitted from, with inserted characters spread
+# out evenly before the next column
+def path_coordinates(path, length):
+    xs = [None] * length
+    x = 0
+    k = 0
+    insertions = 0
+    for state, j in path:
+        if state == INSERT:
+            insertions += 1
+            continue
+        if insertions > 0:
+            step = 1.0 / (insertions + 1)
+            for n in range(insertions, 0, -1):
+                xs[k] = x - (n * step)
+                k += 1
+            insertions = 0
+        if state == MATCH:
+            xs[k] = x
+            k += 1
+        x += 1
+    return xs
+
+
+# decides the orientation of each character of a sequence given the emission
+# probabilities of its characters in the forward alignment and of its reversed
+# characters in the reverse alignment: 'f' for forward and 'r' for reverse.
+# Ties and characters that would fracture larger blocks are resolved as the
+# client does.
+def orientation_sequence(forward, reverse):
+    n = len(forward)
+    merged = []
+    rlocs = []
+    fcounts = [0]
+    for i in range(n):
+        p1 = forward[i]
+        p2 = reverse[n - (i + 1)]
+        if p1 > p2:
+            merged.append('f')
+            fcounts[len(rlocs)] += 1
+        elif p1 < p2:
+            merged.append('r')
+            rlocs.append(i)
+            fcounts.append(0)
+        else:
+            merged.append('t')
+    rlocs.append(n)
+    fcounts.append(0)
+    for i in range(len(rlocs) - 1):
+        l = rlocs[i]
+        # convert t chains between r's with one or less f's to r's
+        if fcounts[i + 1] <= 1:
+            for j in range(l + 1, rlocs[i + 1]):
+                merged[j] = 'r'
+        # flip island r's
+        else:
+            if l - 1 >= 0 and merged[l - 1] != 'r':
+                merged[l] = 'f'
+            for j in range(l + 1, rlocs[i + 1]):
+                merged[j] = 'f'
+    # there's an inversion at the beginning
+    if rlocs[0] < n and merged[rlocs[0]] == 'r' and fcounts[0] <= 1:
+        for j in range(rlocs[0]):
+            merged[j] = 'r'
+    else:
+        for j in range(rlocs[0]):
+            merged[j] = 'f'
+    return merged
+
+
+# returns the characters of the given tracks, (family, strand) lists, in the
+# forward and reverse orientations, encoded with the given codes; characters
+# without a code are encoded as unknown
+def encode_track(track, codes):
+    unknown = len(codes)
+    forward = [codes.get(('-' if s == -1 else '+') + f, unknown)
+               for f, s in track]
+    reverse = [codes.get(('+' if s == -1 else '-') + f, unknown)
+               for f, s in reversed(track)]
+    return forward, reverse
+
+
+# aligns the given tracks, each a list of the (family, strand) of its genes,
+# and returns each track's aligned genes in the order they should be drawn as
+# (index, x, flipped, y): the gene's index in the track, its x coordinate,
+# whether its strand is flipped, and whether it's drawn inverted (y = 1)
+def align(tracks):
+    if not tracks:
+        return []
+    # the model is trained on the genes whose families occur more than once
+    sizes = Counter(f for track in tracks for f, s in track)
+    filtered = [[(f, s) for f, s in track if f != '' and sizes[f] > 1]
+                for track in tracks]
+    codes = {}
+    for track in filtered:
+        for f, s in track:
+            for c in ('+' + f, '-' + f):
+                codes.setdefault(c, len(codes))
+    # 1) construct an HMM with a column for each gene in the first track
+    hmm = ProfileHMM(len(filtered[0]), len(codes))
+    # 2) iteratively train the HMM on the filtered tracks
+    for k, track in enumerate(filtered):
+        forward, reverse = encode_track(track, codes)
+        (forward_path, reverse_path), (p1, p2) =\
+            hmm.viterbi([forward, reverse])
+        if p1 >= p2:
+            hmm.embed(k, forward_path, forward)
+        else:
+            hmm.embed(k, reverse_path, reverse)
+        hmm.surgery()
+    # 3) align the unfiltered tracks to the trained HMM
+    emissions = hmm.emissions()
+    aligned = []
+    for chunk in range(0, len(tracks), CHUNK_SIZE // 2):
+        chunk_tracks = tracks[chunk:chunk + CHUNK_SIZE // 2]
+        sequences = []
+        for track in chunk_tracks:
+            sequences.extend(encode_track(track, codes))
+        paths, probabilities = hmm.viterbi(sequences)
+        for t, track in enumerate(chunk_tracks):
+            n = len(track)
+            forward, reverse = sequences[2*t], sequences[2*t+1]
+            forward_path, reverse_path = paths[2*t], paths[2*t+1]
+            p1, p2 = probabilities[2*t], probabilities[2*t+1]
+            e1 = sequence_emissions(emissions, forward_path, forward)
+            e2 = sequence_emissions(emissions, reverse_path, reverse)
+            x1 = path_coordinates(forward_path, n)
+            x2 = path_coordinates(reverse_path, n)
+            # the genes of each orientation, as (index, x, flipped)
+            genes1 = [(k, x1[k], False) for k in range(n)]
+            genes2 = [(n-1-k, x2[k], True) for k in range(n)]
+            if p1 >= p2:
+                oseq = orientation_sequence(e1, e2)
+                first, second = genes1, genes2
+            else:
+                oseq = orientation_sequence(e2, e1)
+                first, second = genes2, genes1
+            genes = []
+            for k, o in enumerate(oseq):
+                if o == 'f':
+                    genes.append(first[k] + (False,))
+                else:
+                    genes.append(second[n-(k+1)] + (True,))
+            aligned.append(genes)
+    return aligned
+
+
+###############
+# track sets #
+###############
+
+# returns the (family, strand) of each gene of each of the given groups
+def group_tracks(groups):
+    return [[(g.get('family') or '', g.get('strand'))
+             for g in group['genes']] for group in groups]
+
+
+# returns a hash of the given tracks; tracks with the same hash have the same
+# alignment
+def tracks_key(tracks):
+    encoded = json.dumps(tracks, separators=(',', ':'))
+    return 'gcv-msa:' + hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+# returns copies of the given groups with their genes aligned as given
+def apply_alignments(groups, alignments):
+    aligned = []
+    for group, genes in zip(groups, alignments):
+        group = dict(group)
+        group_genes = group['genes']
+        group['genes'] = []
+        for index, x, flipped, inverted in genes:
+            gene = dict(group_genes[index])
+            gene['x'] = x
+            if flipped and isinstance(gene.get('strand'), (int, float)):
+                gene['strand'] = -gene['strand']
+            if inverted:
+                gene['y'] = 1
+            group['genes'].append(gene)
+        aligned.append(group)
+    return aligned
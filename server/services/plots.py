@@ -0,0 +1,59 @@
+# computes global dot plots over arrays: the points of a plot are the pairs
+# of a chromosome's genes and query genes that have the same family, and a
+# plot can be binned into a grid of point counts so its size doesn't depend
+# on how many genes the chromosome has
+import numpy as np
+
+
+# the largest number of bins a grid can have along either axis
+MAX_BINS = 1024
+
+
+# returns the points of a plot whose genes are grouped by family, given as a
+# map from each family to its genes' positions: each query gene is paired with
+# the genes of its family, so a plot is a dictionary lookup per query gene
+def grouped_points(gene_positions, query_families, query_positions):
+    x = [np.zeros(0, dtype=np.float64)]
+    y = [np.zeros(0, dtype=np.float64)]
+    for family, position in zip(query_families, query_positions):
+        positions = gene_positions.get(family) if family else None
+        if positions is not None:
+            x.append(np.asarray(positions, dtype=np.float64))
+            y.append(np.full(len(positions), position, dtype=np.float64))
+    return np.concatenate(x), np.concatenate(y)
+
+
+# returns the number of points in each bin of a bins[0] (x) by bins[1] (y)
+# grid over the given x and y ranges, indexed by y bin and then x bin, and
+# the bins' edges; the ranges default to the points' extents
+def density(x, y, bins, x_range=None, y_range=None):
+    if x_range is None:
+        x_range = (x.min(), x.max()) if len(x) else (0, 1)
+    if y_range is None:
+        y_range = (y.min(), y.max()) if len(y) else (0, 1)
+    counts, x_edges, y_edges = np.histogram2d(
+        x,
+        y,
+        bins=bins,
+        range=[x_range, y_range]
+    )
+    return counts.T.astype(np.int64), x_edges, y_edges
+
+
+# returns the grid bins and ranges given in a request; raises a ValueError if
+# any are invalid
+def parse_grid(bins, x_range=None, y_range=None):
+    if isinstance(bins, list):
+        bins = [int(b) for b in bins]
+    else:
+        bins = [int(bins)] * 2
+    if len(bins) != 2 or not all(0 < b <= MAX_BINS for b in bins):
+        raise ValueError('bins must be 1 to %d' % MAX_BINS)
+    ranges = []
+    for r in (x_range, y_range):
+        if r is not None:
+            r = [float(v) for v in r]
+            if len(r) != 2 or not r[0] < r[1]:
+                raise ValueError('a range must be an increasing pair')
+        ranges.append(r)
+    return bins, ranges[0], ranges[1]
@@ -0,0 +1,206 @@
+# an in-process pool of database connections, shared by the threads of a
+# worker, so requests don't pay to connect to the database. Connections are
+# closed when they outlive a maximum lifetime and are checked before they're
+# reused if they've been idle for a while. The pools are used by the
+# services.backends.postgresql_pool database backend.
+import collections
+import os
+import threading
+import time
+
+
+# the defaults of the pool settings
+DEFAULT_SIZE = 10
+DEFAULT_MAX_LIFETIME = 3600
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+DEFAULT_TIMEOUT = 10
+
+
+# raised when no connection becomes available before the pool's timeout
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool(object):
+
+    # connect opens a new connection, check returns whether an idle connection
+    # still works, and reset returns a released connection to the state of a
+    # new one, returning False if it can't. At most max_size connections are
+    # open at a time; acquiring one waits for up to timeout seconds when they
+    # are all in use. Connections older than max_lifetime seconds are closed
+    # and those idle for health_check_interval seconds are checked before
+    # they're reused.
+    def __init__(self, connect, check, reset, max_size=DEFAULT_SIZE,
+                 max_lifetime=DEFAULT_MAX_LIFETIME,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL,
+                 timeout=DEFAULT_TIMEOUT):
+        self.connect = connect
+        self.check = check
+        self.reset = reset
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._pid = os.getpid()
+        # the idle connections, most recently released last, as (connection,
+        # time created, time released)
+        self._idle = []
+        # the time each open connection was created, by id
+        self._created = {}
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._counts = collections.Counter()
+
+    # connections opened by a parent process can't be shared with it, so a
+    # forked worker forgets them (closing them would close the parent's)
+    def _check_pid(self):
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._idle = []
+            self._created = {}
+            self._in_use = 0
+
+    def _expired(self, created, now):
+        return self.max_lifetime is not None and\
+            now - created >= self.max_lifetime
+
+    # closes a connection the pool is giving up on, counting why
+    def _discard(self, connection, reason):
+        with self._condition:
+            self._created.pop(id(connection), None)
+            self._counts['closed_' + reason] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    # returns an open connection, reusing an idle one if there is one
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        with self._condition:
+            self._check_pid()
+            if not self._idle and self._in_use >= self.max_size:
+                self._counts['waits'] += 1
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._counts['timeouts'] += 1
+                        raise PoolTimeout(
+                            'no database connection became available ' +
+                            'within %s seconds' % self.timeout)
+                    self._condition.wait(remaining)
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            idle = self._idle.pop() if self._idle else None
+        # idle connections are checked and new ones opened outside the lock
+        try:
+            while idle is not None:
+                connection, created, released = idle
+                now = time.time()
+                if self._expired(created, now):
+                    self._discard(connection, 'lifetime')
+                elif now - released >= self.health_check_interval and\
+                     not self.check(connection):
+                    self._discard(connection, 'health_check')
+                else:
+                    with self._condition:
+                        self._counts['reused'] += 1
+                    return connection
+                with self._condition:
+                    idle = self._idle.pop() if self._idle else None
+            connection = self.connect()
+            with self._condition:
+                self._created[id(connection)] = time.time()
+                self._counts['created'] += 1
+            return connection
+        except:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    # returns a connection to the pool, closing it if it's expired or can't
+    # be reset
+    def release(self, connection):
+        with self._condition:
+            self._check_pid()
+            created = self._created.get(id(connection))
+        if created is None:
+            # not one of this process's connections
+            try:
+                connection.close()
+            except Exception:
+                pass
+            return
+        now = time.time()
+        if self._expired(created, now):
+            self._discard(connection, 'lifetime')
+        elif not self.reset(connection):
+            self._discard(connection, 'broken')
+        else:
+            with self._condition:
+                self._idle.append((connection, created, now))
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+
+    # closes the idle connections, e.g. before a process forks
+    def close_idle(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            for connection, created, released in idle:
+                self._created.pop(id(connection), None)
+        for connection, created, released in idle:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    # the pool's size and how its connections have been used, for sizing it
+    # against the number of workers and threads
+    def stats(self):
+        with self._condition:
+            self._check_pid()
+            stats = {
+                'max_size': self.max_size,
+                'open': len(self._created),
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'peak_in_use': self._peak_in_use
+            }
+            for key in ('created', 'reused', 'waits', 'timeouts',
+                        'closed_lifetime', 'closed_health_check',
+                        'closed_broken'):
+                stats[key] = self._counts[key]
+        return stats
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+# returns the pool of the given database alias, creating it with the given
+# function if it doesn't exist yet
+def get_pool(alias, create):
+    with _lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = create()
+            _pools[alias] = pool
+        return pool
+
+
+# closes the idle connections of every pool
+def close_idle():
+    with _lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_idle()
+
+
+# returns the stats of each database alias's pool for this process
+def stats():
+    with _lock:
+        pools = dict(_pools)
+    return dict((alias, pool.stats()) for alias, pool in pools.items())
@@ -0,0 +1,225 @@
+# the services' database queries; each stage of a view fetches everything it
+# needs, e.g. a track's gene names, locations and families, with one joined
+# SQL statement whose rows are streamed from the database. Stages given only
+# ordered genes read from the denormalized read store when it's enabled, and
+# from the database for any genes the store doesn't have yet.
+import itertools
+import time
+from collections import namedtuple
+# django
+from django.db import connection, transaction
+# import our helpers
+from services import instrumentation, readstore
+
+
+# how many rows are fetched from the database at a time
+ROW_CHUNK_SIZE = 2000
+
+# a gene's location on its chromosome
+GeneLoc = namedtuple('GeneLoc',
+    ['feature_id', 'srcfeature_id', 'fmin', 'fmax', 'strand'])
+
+# a chromosome and its organism
+Chromosome = namedtuple('Chromosome',
+    ['feature_id', 'name', 'organism_id', 'genus', 'species'])
+
+# a focus gene, its location, chromosome, organism and family ('' for none)
+FocusGene = namedtuple('FocusGene',
+    ['feature_id', 'name', 'organism_id', 'genus', 'species', 'loc',
+     'chromosome_name', 'family'])
+
+
+###########
+# cursors #
+###########
+
+_cursor_ids = itertools.count()
+
+
+# yields the rows of the given query ROW_CHUNK_SIZE at a time. On PostgreSQL
+# the rows are read from a server-side (named) cursor, so a large result is
+# never held by the client library all at once; named cursors bypass django's
+# cursor wrappers, so their queries are recorded for the instrumentation here
+def stream_rows(sql, params):
+    if connection.vendor == 'postgresql':
+        with transaction.atomic():
+            connection.ensure_connection()
+            cursor = connection.connection.cursor(
+                name='gcv_cursor_%d' % next(_cursor_ids)
+            )
+            cursor.itersize = ROW_CHUNK_SIZE
+            start = time.time()
+            try:
+                cursor.execute(sql, params)
+                for row in cursor:
+                    yield row
+            finally:
+                cursor.close()
+                instrumentation.record(sql, time.time() - start)
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(ROW_CHUNK_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+
+# the most values an IN list has on backends whose lists are made of
+# placeholders, e.g. SQLite, which allows at most 999 parameters a statement
+MAX_IN_VALUES = 500
+
+
+# returns a test of whether a column is one of the given values and the test's
+# parameters: "= ANY(%s)" with the values as a single array on PostgreSQL, so
+# the statement's size doesn't depend on how many values there are, and an
+# "IN (%s, ...)" list with a placeholder for each value on other backends
+def in_values(values):
+    values = list(values)
+    if connection.vendor == 'postgresql':
+        return '= ANY(%s)', [values]
+    return 'IN ({})'.format(', '.join(['%s'] * len(values))), values
+
+
+# yields the rows of the given query for the given values; the query's test of
+# the values is the key in braces, e.g. "WHERE f.feature_id {ids}". On backends
+# without arrays the values are queried MAX_IN_VALUES at a time.
+def stream_rows_in(sql, key, values):
+    values = list(values)
+    size = len(values) if connection.vendor == 'postgresql' else MAX_IN_VALUES
+    for k in range(0, len(values), max(size, 1)):
+        test, params = in_values(values[k:k+size])
+        for row in stream_rows(sql.format(**{key: test}), params):
+            yield row
+
+
+# yields the queries to run for the given values and the values to run each
+# with: the read store's version of the query if the store is enabled and the
+# query's genes are all ordered (only ordered genes are in the store), and then
+# the database's version for the values the store didn't have, e.g. genes
+# ordered since the store was built. found tells whether a value was found by
+# the rows of the queries yielded before.
+def store_queries(sql, store_sql, ordered, values, found):
+    if ordered and readstore.enabled():
+        yield store_sql, values
+        values = [v for v in values if not found(v)]
+        if not values:
+            return
+    yield sql, values
+
+
+##########
+# stages #
+##########
+
+# returns the named focus genes with their locations, chromosomes, organisms
+# and families, ordered by id
+FOCUS_GENES_SQL = '''
+    SELECT f.feature_id, f.name, f.organism_id, o.genus, o.species,
+           l.srcfeature_id, l.fmin, l.fmax, l.strand, c.name, a.family_label
+    FROM feature f
+    JOIN featureloc l ON l.feature_id = f.feature_id
+    JOIN feature c ON c.feature_id = l.srcfeature_id
+    JOIN organism o ON o.organism_id = f.organism_id
+    LEFT JOIN gene_family_assignment a ON a.gene_id = f.feature_id
+    WHERE f.name {names}
+    ORDER BY f.feature_id
+'''
+
+FOCUS_GENES_STORE_SQL = '''
+    SELECT gene_id, name, organism_id, genus, species, chromosome_id, fmin,
+           fmax, strand, chromosome_name, family_label
+    FROM ''' + readstore.TABLE + '''
+    WHERE name {names}
+    ORDER BY gene_id
+'''
+
+
+# ordered: only the ordered genes are needed, so the read store can be used
+def focus_genes(names, ordered=False):
+    names = list(set(names))
+    if not names:
+        return []
+    genes = {}
+    found = set()
+    for sql, values in store_queries(FOCUS_GENES_SQL, FOCUS_GENES_STORE_SQL,
+                                     ordered, names, found.__contains__):
+        for row in stream_rows_in(sql, 'names', values):
+            feature_id, name, organism_id, genus, species, srcfeature_id,\
+                fmin, fmax, strand, chromosome_name, family = row
+            found.add(name)
+            genes[feature_id] = FocusGene(
+                feature_id, name, organism_id, genus, species,
+                GeneLoc(feature_id, srcfeature_id, fmin, fmax, strand),
+                chromosome_name,
+                family or ''
+            )
+    return [genes[g] for g in sorted(genes)]
+
+
+# returns maps from the given gene ids to their names, locations and families;
+# genes without a family aren't in the family map
+GENE_DETAILS_SQL = '''
+    SELECT f.feature_id, f.name, l.srcfeature_id, l.fmin, l.fmax, l.strand,
+           a.family_label
+    FROM feature f
+    JOIN featureloc l ON l.feature_id = f.feature_id
+    LEFT JOIN gene_family_assignment a ON a.gene_id = f.feature_id
+    WHERE f.feature_id {ids}
+'''
+
+GENE_DETAILS_STORE_SQL = '''
+    SELECT gene_id, name, chromosome_id, fmin, fmax, strand, family_label
+    FROM ''' + readstore.TABLE + '''
+    WHERE gene_id {ids}
+'''
+
+
+# ordered: all the genes are ordered, so the read store can be used
+def gene_details(gene_ids, ordered=False):
+    gene_ids = list(set(gene_ids))
+    name_map, loc_map, family_map = {}, {}, {}
+    if not gene_ids:
+        return name_map, loc_map, family_map
+    for sql, values in store_queries(GENE_DETAILS_SQL, GENE_DETAILS_STORE_SQL,
+                                     ordered, gene_ids, name_map.__contains__):
+        for row in stream_rows_in(sql, 'ids', values):
+            feature_id, name, srcfeature_id, fmin, fmax, strand, family = row
+            name_map[feature_id] = name
+            loc_map[feature_id] = GeneLoc(
+                feature_id, srcfeature_id, fmin, fmax, strand)
+            if family is not None:
+                family_map[feature_id] = family
+    return name_map, loc_map, family_map
+
+
+# returns a map from the given chromosome ids to their chromosomes
+CHROMOSOMES_SQL = '''
+    SELECT c.feature_id, c.name, c.organism_id, o.genus, o.species
+    FROM feature c
+    JOIN organism o ON o.organism_id = c.organism_id
+    WHERE c.feature_id {ids}
+'''
+
+CHROMOSOMES_STORE_SQL = '''
+    SELECT DISTINCT chromosome_id, chromosome_name, organism_id, genus, species
+    FROM ''' + readstore.TABLE + '''
+    WHERE chromosome_id {ids}
+'''
+
+
+# ordered: all the chromosomes have ordered genes, so the read store can be
+# used
+def chromosomes(chromosome_ids, ordered=False):
+    chromosome_ids = list(set(chromosome_ids))
+    if not chromosome_ids:
+        return {}
+    chromosome_map = {}
+    for sql, values in store_queries(CHROMOSOMES_SQL, CHROMOSOMES_STORE_SQL,
+                                     ordered, chromosome_ids,
+                                     chromosome_map.__contains__):
+        for row in stream_rows_in(sql, 'ids', values):
+            chromosome_map[row[0]] = Chromosome(*row)
+    return chromosome_map
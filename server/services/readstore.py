@@ -0,0 +1,133 @@
+# a denormalized read store of the ordered genes: one row per gene with its
+# name, chromosome, organism, order number, location and family, so the views
+# can read a track's genes from a single indexed table instead of joining the
+# Chado tables on every request
+import time
+# django
+from django.conf import settings
+from django.db import connection, transaction
+
+
+TABLE = 'gcv_synteny_gene'
+
+# the store's columns and their types
+COLUMNS = (
+    ('gene_id', 'integer NOT NULL'),
+    ('name', 'varchar(255)'),
+    ('chromosome_id', 'integer NOT NULL'),
+    ('chromosome_name', 'varchar(255)'),
+    ('organism_id', 'integer'),
+    ('genus', 'varchar(255)'),
+    ('species', 'varchar(255)'),
+    ('number', 'integer NOT NULL'),
+    ('fmin', 'integer'),
+    ('fmax', 'integer'),
+    ('strand', 'smallint'),
+    ('family_label', 'text')
+)
+
+# the store's indexes and the columns they're on
+INDEXES = (
+    ('chromosome_number', ('chromosome_id', 'number')),
+    ('family_label', ('family_label',)),
+    ('gene_id', ('gene_id',)),
+    ('name', ('name',))
+)
+
+# the store's rows, computed from the Chado tables; a gene's location is on
+# the chromosome it's ordered on
+SOURCE_SQL = '''
+    SELECT o.gene_id, g.name, o.chromosome_id, c.name AS chromosome_name,
+           g.organism_id, org.genus, org.species, o.number, l.fmin, l.fmax,
+           l.strand, a.family_label
+    FROM gene_order o
+    JOIN feature g ON g.feature_id = o.gene_id
+    JOIN feature c ON c.feature_id = o.chromosome_id
+    JOIN organism org ON org.organism_id = g.organism_id
+    JOIN featureloc l ON l.feature_id = o.gene_id
+                     AND l.srcfeature_id = o.chromosome_id
+    LEFT JOIN gene_family_assignment a ON a.gene_id = o.gene_id
+    WHERE o.number IS NOT NULL
+'''
+
+# the table the source rows are staged in during an incremental refresh
+STAGED = 'gcv_synteny_gene_staged'
+
+
+# whether the views should read from the store, per the GCV_READ_STORE setting
+def enabled():
+    return getattr(settings, 'GCV_READ_STORE', False)
+
+
+# whether the store has been built
+def exists():
+    with connection.cursor() as cursor:
+        return TABLE in connection.introspection.table_names(cursor)
+
+
+# returns a condition that's true when every column of the given tables'
+# rows are equal, including columns that are both null
+def rows_equal(a, b):
+    same = 'IS NOT DISTINCT FROM' if connection.vendor == 'postgresql'\
+        else 'IS'
+    return ' AND '.join('%s.%s %s %s.%s' % (a, column, same, b, column)
+                        for column, definition in COLUMNS)
+
+
+# (re)creates the store from scratch
+def rebuild(cursor):
+    columns = ', '.join(column for column, definition in COLUMNS)
+    cursor.execute('DROP TABLE IF EXISTS %s' % TABLE)
+    cursor.execute('CREATE TABLE %s (%s)' % (TABLE, ', '.join(
+        '%s %s' % column for column in COLUMNS)))
+    cursor.execute('INSERT INTO %s (%s) %s' % (TABLE, columns, SOURCE_SQL))
+    inserted = cursor.rowcount
+    # the indexes are created after the rows are loaded, which is faster than
+    # updating them row by row
+    for name, index_columns in INDEXES:
+        cursor.execute('CREATE INDEX %s_%s ON %s (%s)' % (
+            TABLE, name, TABLE, ', '.join(index_columns)))
+    return inserted, 0
+
+
+# brings the store up to date with the Chado tables by deleting the rows that
+# have changed or are gone and inserting the rows that have changed or are new,
+# leaving the rest of the table (and its indexes) untouched
+def refresh(cursor):
+    columns = ', '.join(column for column, definition in COLUMNS)
+    cursor.execute('DROP TABLE IF EXISTS %s' % STAGED)
+    cursor.execute('CREATE TEMPORARY TABLE %s AS %s' % (STAGED, SOURCE_SQL))
+    cursor.execute('CREATE INDEX %s_gene_id ON %s (gene_id)' % (
+        STAGED, STAGED))
+    cursor.execute('''
+        DELETE FROM {table} WHERE NOT EXISTS (
+            SELECT 1 FROM {staged} s
+            WHERE s.gene_id = {table}.gene_id AND {equal}
+        )
+    '''.format(table=TABLE, staged=STAGED,
+               equal=rows_equal('s', TABLE)))
+    deleted = cursor.rowcount
+    cursor.execute('''
+        INSERT INTO {table} ({columns})
+        SELECT {columns} FROM {staged} s WHERE NOT EXISTS (
+            SELECT 1 FROM {table} t WHERE t.gene_id = s.gene_id AND {equal}
+        )
+    '''.format(table=TABLE, staged=STAGED, columns=columns,
+               equal=rows_equal('s', 't')))
+    inserted = cursor.rowcount
+    cursor.execute('DROP TABLE %s' % STAGED)
+    return inserted, deleted
+
+
+# builds the store if it doesn't exist (or if rebuild is given) and refreshes
+# it otherwise, in one transaction so readers see either the old rows or the
+# new ones; returns the number of rows inserted and deleted and the time taken
+def build(rebuild_store=False):
+    start = time.time()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if rebuild_store or not exists():
+            inserted, deleted = rebuild(cursor)
+        else:
+            inserted, deleted = refresh(cursor)
+        cursor.execute('ANALYZE %s' % TABLE)
+    return inserted, deleted, time.time() - start
@@ -0,0 +1,126 @@
+# the stages of the micro-synteny search, implemented over arrays
+import heapq
+# arrays
+import numpy as np
+
+
+# finds the blocks of genes that make up the search's tracks. The genes are
+# given as parallel arrays of their chromosome ids, numbers and family codes,
+# sorted by chromosome and number. Sequential genes on a chromosome belong to
+# the same block if no more than intermediate genes separate them, and a block
+# becomes a track if it has at least matched distinct families. Returns the
+# chromosome ids and lower and upper numbers of the tracks' blocks and, if
+# return_counts is set, the number of distinct families and of genes in each.
+def find_blocks(chromosome_ids, numbers, families, matched, intermediate,
+                return_counts=False):
+    chromosome_ids = np.asarray(chromosome_ids)
+    numbers = np.asarray(numbers)
+    families = np.asarray(families)
+    n = len(numbers)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        if return_counts:
+            return empty, empty, empty, empty, empty
+        return empty, empty, empty
+    # a gene starts a new block if it's the first gene on its chromosome or if
+    # too many genes separate it from the previous gene
+    new_chromosome = np.ones(n, dtype=bool)
+    new_chromosome[1:] = chromosome_ids[1:] != chromosome_ids[:-1]
+    new_block = new_chromosome.copy()
+    new_block[1:] |= np.diff(numbers) - 1 > intermediate
+    starts = np.flatnonzero(new_block)
+    ends = np.append(starts[1:], n)
+    block_ids = np.cumsum(new_block) - 1
+    # count the distinct families in each block
+    order = np.lexsort((families, block_ids))
+    sorted_blocks = block_ids[order]
+    sorted_families = families[order]
+    distinct = np.ones(n, dtype=bool)
+    distinct[1:] = (sorted_blocks[1:] != sorted_blocks[:-1]) |\
+                   (sorted_families[1:] != sorted_families[:-1])
+    counts = np.bincount(sorted_blocks[distinct], minlength=len(starts))
+    # the last block on a chromosome is only a track if it has more than one
+    # gene, i.e. a chromosome's trailing (or only) gene is never a track
+    last = np.append(new_chromosome[ends[:-1]], True)
+    keep = (counts >= matched) & (~last | (ends - starts > 1))
+    starts = starts[keep]
+    ends = ends[keep]
+    blocks = chromosome_ids[starts], numbers[starts], numbers[ends-1]
+    if return_counts:
+        return blocks + (counts[keep], ends - starts)
+    return blocks
+
+
+# returns the indexes of the (at most) limit best blocks, best first. Blocks
+# are ranked by their number of distinct matched families and then by their
+# density, i.e. the fraction of the genes they span that matched; ties keep
+# their order. A bounded heap is used, so this is O(n log limit).
+def rank_blocks(family_counts, gene_counts, lowers, uppers, limit):
+    density = np.asarray(gene_counts, dtype=np.float64) /\
+        (np.asarray(uppers) - np.asarray(lowers) + 1)
+    keys = zip(np.asarray(family_counts).tolist(), density.tolist())
+    return heapq.nlargest(limit, range(len(keys)), key=keys.__getitem__)
+
+
+# returns the concatenation of the position ranges [starts[i], stops[i]), e.g.
+# the positions of all the genes in a set of tracks
+def concatenate_ranges(starts, stops):
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(stops, dtype=np.int64) - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+
+# merges the blocks that overlap, i.e. that share numbers on a chromosome, with
+# a sweep over the blocks sorted by chromosome and lower number. Returns the
+# chromosome ids and lower and upper numbers of the merged blocks, in the
+# order of the first block merged into each, and the index of the merged
+# block each block was merged into.
+def merge_blocks(chromosome_ids, lowers, uppers):
+    chromosome_ids = np.asarray(chromosome_ids, dtype=np.int64)
+    lowers = np.asarray(lowers, dtype=np.int64)
+    uppers = np.asarray(uppers, dtype=np.int64)
+    n = len(lowers)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    order = np.lexsort((lowers, chromosome_ids))
+    chromosome_ids = chromosome_ids[order]
+    lowers = lowers[order]
+    uppers = uppers[order]
+    # a block starts a merged block if it's the first on its chromosome or if
+    # it begins after all the previous blocks on its chromosome end; each
+    # chromosome's numbers are shifted past the previous chromosome's so one
+    # running maximum of the ends covers every chromosome
+    new_chromosome = np.ones(n, dtype=bool)
+    new_chromosome[1:] = chromosome_ids[1:] != chromosome_ids[:-1]
+    shift = (np.cumsum(new_chromosome) - 1) *\
+        (uppers.max() - lowers.min() + 1)
+    ends = np.maximum.accumulate(uppers + shift)
+    new_block = new_chromosome.copy()
+    new_block[1:] |= (lowers + shift)[1:] > ends[:-1]
+    starts = np.flatnonzero(new_block)
+    merged = np.empty(n, dtype=np.int64)
+    merged[order] = np.cumsum(new_block) - 1
+    # put the merged blocks in the order of their first blocks
+    first = np.full(len(starts), n, dtype=np.int64)
+    np.minimum.at(first, merged, np.arange(n))
+    rank = np.argsort(first)
+    renumbered = np.empty_like(rank)
+    renumbered[rank] = np.arange(len(rank))
+    return (
+        chromosome_ids[starts][rank],
+        lowers[starts][rank],
+        np.maximum.reduceat(uppers, starts)[rank],
+        renumbered[merged]
+    )
+
+
+# assembles the tracks of the given blocks in a single sweep of a gene order
+# index. Returns the positions of all the tracks' genes, in track order, and
+# the offsets of each track's genes in that array.
+def assemble_tracks(gene_order_index, chromosome_ids, lowers, uppers):
+    starts, stops = gene_order_index.slices(chromosome_ids, lowers, uppers)
+    positions = concatenate_ranges(starts, stops)
+    offsets = np.append(0, np.cumsum(stops - starts))
+    return positions, offsets
@@ -0,0 +1,216 @@
+# serializes the services' results in the formats clients can request
+import base64
+import json
+# arrays
+import numpy as np
+# http stuffs
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+
+# how many bytes a streaming response buffers before sending them
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# the content type of columnar micro-synteny results
+COLUMNAR_CONTENT_TYPE = 'application/vnd.gcv.columnar+json'
+
+
+############
+# encoders #
+############
+
+# encodes an object as compact json bytes with the standard library
+def stdlib_dumps(obj):
+    data = json.dumps(obj, separators=(',', ':'))
+    return data if isinstance(data, bytes) else data.encode('utf-8')
+
+
+# functions that encode an object as compact json bytes, by name
+ENCODERS = {'json': stdlib_dumps}
+
+try:
+    import orjson
+    ENCODERS['orjson'] = orjson.dumps
+except ImportError:
+    pass
+
+
+# the encoder used for native json responses; the fastest one available
+# unless the GCV_JSON_ENCODER setting names one
+def get_encoder():
+    name = getattr(settings, 'GCV_JSON_ENCODER', None)
+    if name is None:
+        name = 'orjson' if 'orjson' in ENCODERS else 'json'
+    return ENCODERS[name]
+
+
+#############
+# responses #
+#############
+
+# returns the given object as json; version 1 clients expect the json to be
+# encoded as a json string
+def json_response(obj, version):
+    if version == 1:
+        data = json.dumps(json.dumps(obj))
+    else:
+        data = get_encoder()(obj)
+    return HttpResponse(data, content_type='application/json; charset=utf8')
+
+
+# an insertion ordered set of gene family labels; the empty label (no family)
+# is never added
+class Families(object):
+
+    def __init__(self, families=()):
+        self._families = []
+        self._indexes = {}
+        for f in families:
+            self.add(f)
+
+    def add(self, family):
+        if family and family not in self._indexes:
+            self._indexes[family] = len(self._families)
+            self._families.append(family)
+
+    def __iter__(self):
+        return iter(self._families)
+
+    def __len__(self):
+        return len(self._families)
+
+    # returns the index of the given family, adding it if necessary; the empty
+    # label's index is -1
+    def index(self, family):
+        if not family:
+            return -1
+        self.add(family)
+        return self._indexes[family]
+
+    # the families as they appear in the micro-synteny json
+    def json(self):
+        return [{'name': f, 'id': f} for f in self._families]
+
+    # the families as they appear in the columnar micro-synteny json
+    def labels(self):
+        return list(self._families)
+
+
+# yields the items of the given iterable in lists of at most size items
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+###############################
+# micro-synteny serialization #
+###############################
+
+# encodes the given values as a base64 string of a little-endian typed array;
+# missing values are encoded as the given value
+def typed_array(values, dtype, missing=0):
+    values = [missing if v is None else v for v in values]
+    data = np.asarray(values, dtype=dtype).tobytes()
+    return base64.b64encode(data).decode('ascii')
+
+
+# converts a micro-synteny group to its columnar form. Instead of a list of
+# gene objects, the group's genes are an object of columns: a list of names,
+# base64 encoded little-endian int32 arrays of ids, fmins, fmaxs and family
+# indexes (-1 for no family) into the response's family table, and an int8
+# array of strands. Genes positioned by an alignment also get a float64 array
+# of x coordinates.
+def columnar_group(group, families):
+    genes = group['genes']
+    columnar = dict(group)
+    columnar['genes'] = {
+        'length': len(genes),
+        'name': [g['name'] for g in genes],
+        'id': typed_array([g['id'] for g in genes], '<i4'),
+        'fmin': typed_array([g['fmin'] for g in genes], '<i4'),
+        'fmax': typed_array([g['fmax'] for g in genes], '<i4'),
+        'strand': typed_array([g['strand'] for g in genes], '<i1'),
+        'family': typed_array(
+            [families.index(g['family']) for g in genes],
+            '<i4'
+        )
+    }
+    if genes and 'x' in genes[0]:
+        columnar['genes']['x'] = typed_array([g['x'] for g in genes], '<f8')
+    return columnar
+
+
+# whether the client asked for columnar results, either with the format
+# parameter or the Accept header
+def wants_columnar(request, POST):
+    return POST.get('format') == 'columnar' or\
+        COLUMNAR_CONTENT_TYPE in request.META.get('HTTP_ACCEPT', '')
+
+
+# yields the micro-synteny json one chunk at a time as the groups are
+# generated; the families and any extra fields are written last since they're
+# collected from the groups
+def stream_micro_synteny(families_json, groups, extra=None):
+    dumps = get_encoder()
+    chunk = [b'{"groups":[']
+    size = 0
+    for i, group in enumerate(groups):
+        group_json = (b',' if i else b'') + dumps(group)
+        chunk.append(group_json)
+        size += len(group_json)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(b'],"families":' + dumps(families_json()))
+    for key, value in sorted((extra or {}).items()):
+        chunk.append(b',' + dumps(key) + b':' + dumps(value))
+    chunk.append(b'}')
+    yield b''.join(chunk)
+
+
+# returns micro-synteny results, i.e. an object with families and groups
+# arrays. The groups can be generated lazily and the families collected while
+# they're generated. Clients that set "stream" in their request get the object
+# as it's generated; otherwise it's returned whole, encoded as a json string
+# for version 1 clients. Clients that ask for columnar results always get a
+# json object. Any extra fields, e.g. statistics, are added to the object.
+def micro_synteny_response(request, POST, families, groups, version,
+                           extra=None):
+    extra = extra or {}
+    content_type = 'application/json; charset=utf8'
+    families_json = families.json
+    if wants_columnar(request, POST):
+        content_type = COLUMNAR_CONTENT_TYPE + '; charset=utf8'
+        groups = (columnar_group(g, families) for g in groups)
+        families_json = families.labels
+        version = 2
+    if POST.get('stream', False):
+        response = StreamingHttpResponse(
+            stream_micro_synteny(families_json, groups, extra),
+            content_type=content_type
+        )
+    elif version == 1:
+        groups_json = ','.join(json.dumps(g) for g in groups)
+        extra_json = ''.join(', ' + json.dumps(k) + ':' + json.dumps(v)
+            for k, v in sorted(extra.items()))
+        view_json = ('{"families":' + json.dumps(families_json()) +
+            ', "groups":[' + groups_json + ']' + extra_json + '}')
+        response = HttpResponse(json.dumps(view_json), content_type=content_type)
+    else:
+        view = dict(extra)
+        view['groups'] = list(groups)
+        view['families'] = families_json()
+        response = HttpResponse(
+            get_encoder()(view),
+            content_type=content_type
+        )
+    patch_vary_headers(response, ['Accept'])
+    return response
@@ -1,3 +1,1307 @@
-from django.test import TestCase
+import base64
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from StringIO import StringIO
+# arrays
+import numpy as np
+# django
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+# import our models and helpers
+from services import alignment, cache, cvterms, frequented_regions, indexes,\
+instrumentation, msa, plots, pool, queries, readstore, search, serializers,\
+versions
+from services.management.commands import advise_indexes
+from services.models import Cv, Cvterm, Db, Dbxref, Feature, Featureloc,\
+GeneFamilyAssignment, GeneOrder, Organism
 
-# Create your tests here.
+
+# the families of the genes on the fixture's chromosomes, in order; None is a
+# gene without a family
+CHROMOSOME_FAMILIES = {
+    'Genus0.chr0': ['a', 'b', 'c', None, 'd', 'e', 'a', 'f', 'g', 'h'],
+    'Genus0.chr1': ['x', 'a', 'b', 'c', 'd', None, 'e', 'y', 'z', 'a'],
+    'Genus1.chr0': ['e', 'd', 'c', 'b', 'a', 'q', 'r', 's', 't', 'u']
+}
+
+
+# chado's primary keys aren't serial, so the fixture numbers its rows
+_ids = itertools.count(1)
+
+
+# creates the cvterms the services use
+def create_terms():
+    db = Db.objects.create(pk=next(_ids), name='fixture')
+    terms = {}
+    for cv_name, name in [('sequence', 'gene'), ('sequence', 'chromosome'),
+                          ('sequence', 'syntenic_region')]:
+        cv = Cv.objects.filter(name=cv_name).first() or\
+            Cv.objects.create(pk=next(_ids), name=cv_name)
+        dbxref = Dbxref.objects.create(pk=next(_ids), db=db, accession=name,
+                                       version='', description='')
+        terms[name] = Cvterm.objects.create(
+            pk=next(_ids), cv=cv, name=name, definition='', dbxref=dbxref,
+            is_obsolete=0, is_relationshiptype=0)
+    return terms
+
+
+def create_feature(name, organism, term, seqlen=None):
+    now = timezone.now()
+    return Feature.objects.create(
+        pk=next(_ids), organism=organism, name=name, uniquename=name,
+        type=Cvterm.objects.get(name=term), seqlen=seqlen, is_analysis=False,
+        is_obsolete=False, timeaccessioned=now, timelastmodified=now)
+
+
+# creates a chromosome whose genes, 1000bp apart, have the given families;
+# returns the chromosome and its genes by name
+def create_chromosome(name, organism, families):
+    chromosome = create_feature(name, organism, 'chromosome', 100000)
+    features = {name: chromosome}
+    for number, family in enumerate(families):
+        gene = create_feature('%s.g%d' % (name, number), organism, 'gene')
+        features[gene.name] = gene
+        Featureloc.objects.create(
+            pk=next(_ids), feature=gene, srcfeature=chromosome,
+            fmin=number*1000, fmax=number*1000 + 800,
+            strand=1 if number % 2 else -1, is_fmin_partial=False,
+            is_fmax_partial=False, locgroup=0, rank=0)
+        GeneOrder.objects.create(pk=next(_ids), chromosome=chromosome,
+                                 gene=gene, number=number)
+        if family is not None:
+            GeneFamilyAssignment.objects.create(
+                pk=next(_ids), gene=gene, family_label=family)
+    return features
+
+
+# creates a small chado database: two organisms with the chromosomes above
+def create_fixture():
+    create_terms()
+    organisms = {}
+    features = {}
+    for name, families in sorted(CHROMOSOME_FAMILIES.items()):
+        genus = name.split('.')[0]
+        if genus not in organisms:
+            organisms[genus] = Organism.objects.create(
+                pk=next(_ids), genus=genus, species='species')
+        features.update(create_chromosome(name, organisms[genus], families))
+    return features
+
+
+# a test case with the fixture in the database and the worker's registries
+# emptied, so each test's cvterms and indexes are loaded from the fixture
+class FixtureTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.features = create_fixture()
+
+    def setUp(self):
+        cvterms.invalidate()
+        indexes.invalidate()
+        versions.invalidate()
+
+    def post(self, url, data, **extra):
+        return self.client.post(url, json.dumps(data),
+                                content_type='application/json', **extra)
+
+    # returns the json a response's content encodes; version 1 responses are
+    # json encoded as a json string, and streamed responses are read whole
+    def decode(self, response):
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        data = json.loads(content.decode('utf-8'))
+        return json.loads(data) if isinstance(data, basestring) else data
+
+
+##########
+# errors #
+##########
+
+# malformed parameters are rejected with a 400
+class BadRequestTests(FixtureTestCase):
+
+    SEARCH = {'query': ['a', 'b', 'c', 'd'], 'matched': 2, 'intermediate': 2}
+
+    def test_search_limit(self):
+        for limit in ('x', 0, -1):
+            params = dict(self.SEARCH, limit=limit)
+            for version in ('v1', 'v2'):
+                response = self.post(
+                    '/services/%s/micro-synteny-search/' % version, params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_search_alignment_params(self):
+        for params in ('x', {'algorithm': 'x'}, {'match': 'x'},
+                       {'gap': None}):
+            for version in ('v1', 'v2'):
+                response = self.post(
+                    '/services/%s/micro-synteny-search/' % version,
+                    dict(self.SEARCH, align=params)
+                )
+                self.assertEqual(response.status_code, 400)
+
+    def test_global_plot(self):
+        chromosome_id = self.features['Genus0.chr0'].pk
+        for params in ({'query': ['a']},
+                       {'query': ['a'], 'chromosome': 'x'},
+                       {'query': ['a'], 'chromosomes': ['x']},
+                       {'query': ['a'], 'chromosome': chromosome_id,
+                        'bins': 0},
+                       {'query': ['a'], 'chromosome': chromosome_id,
+                        'bins': 4, 'positions': [1, 2]}):
+            response = self.post('/services/v1/global-plots/', params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_nearest_gene_chromosome(self):
+        response = self.post('/services/v1/nearest-gene/',
+                             {'chromosome': 'x', 'position': 100})
+        self.assertEqual(response.status_code, 400)
+
+
+###########
+# indexes #
+###########
+
+# the gene order index finds the genes within a range of numbers on a
+# chromosome, e.g. a focus gene's neighborhood, without the database
+class GeneOrderIndexTests(FixtureTestCase):
+
+    def setUp(self):
+        super(GeneOrderIndexTests, self).setUp()
+        self.index = indexes.get('gene_order')
+
+    def gene_ids(self, chromosome, numbers):
+        return [self.features['%s.g%d' % (chromosome, n)].pk for n in numbers]
+
+    def test_lookups(self):
+        chromosome_id = self.features['Genus0.chr1'].pk
+        start, end = self.index.bounds(chromosome_id)
+        self.assertEqual(end - start, 10)
+        self.assertEqual(self.index.bounds(-1), (0, 0))
+        gene_ids = self.gene_ids('Genus0.chr1', [3, 0])
+        positions = self.index.lookup(gene_ids + [-1]).tolist()
+        self.assertEqual(positions[2], -1)
+        self.assertEqual(self.index.gene_ids[positions[:2]].tolist(),
+                         gene_ids)
+        self.assertEqual(self.index.locate(gene_ids + [-1]), {
+            gene_ids[0]: (chromosome_id, 3),
+            gene_ids[1]: (chromosome_id, 0)
+        })
+
+    def test_neighborhoods(self):
+        chromosome_id = self.features['Genus0.chr1'].pk
+        other_id = self.features['Genus1.chr0'].pk
+        self.assertEqual(
+            self.index.neighborhood(chromosome_id, 5, 2).tolist(),
+            self.gene_ids('Genus0.chr1', range(3, 8))
+        )
+        # neighborhoods end at the ends of their chromosomes
+        self.assertEqual(
+            self.index.neighborhood(other_id, 8, 3).tolist(),
+            self.gene_ids('Genus1.chr0', range(5, 10))
+        )
+        self.assertEqual(self.index.neighborhood(-1, 0, 3).tolist(), [])
+        # the ranges of many chromosomes are found at once
+        ranges = [(chromosome_id, 0, 1), (other_id, 2, 4),
+                  (chromosome_id, 8, 12), (-1, 0, 1)]
+        starts, stops = self.index.slices(*zip(*ranges))
+        self.assertEqual(zip(starts.tolist(), stops.tolist()), [
+            (s.start, s.stop) for s in
+            (self.index.slice(*r) for r in ranges)
+        ])
+
+    def test_basic_tracks(self):
+        response = self.post('/services/v1/micro-synteny-basic/', {
+            'genes': ['Genus0.chr0.g1', 'Genus1.chr0.g8'],
+            'neighbors': 2
+        })
+        groups = self.decode(response)['groups']
+        self.assertEqual([[g['id'] for g in group['genes']]
+                          for group in groups], [
+            self.gene_ids('Genus0.chr0', range(0, 4)),
+            self.gene_ids('Genus1.chr0', range(6, 10))
+        ])
+
+
+# the gene family index finds the genes of a set of families, sorted by
+# chromosome and number, from the families' posting lists
+class GeneFamilyIndexTests(FixtureTestCase):
+
+    def setUp(self):
+        super(GeneFamilyIndexTests, self).setUp()
+        self.index = indexes.get('gene_family')
+
+    # the fixture's genes of the given families, sorted by chromosome and
+    # number, and their families
+    def expected(self, families):
+        genes = []
+        for name in sorted(CHROMOSOME_FAMILIES,
+                           key=lambda n: self.features[n].pk):
+            for n, family in enumerate(CHROMOSOME_FAMILIES[name]):
+                if family in families:
+                    genes.append((self.features['%s.g%d' % (name, n)].pk,
+                                  family))
+        return genes
+
+    def test_search(self):
+        positions, codes = self.index.search(['a', 'c', 'unknown', 'a'])
+        gene_ids = self.index.gene_order.gene_ids[positions].tolist()
+        families = [self.index.families[c] for c in codes.tolist()]
+        self.assertEqual(zip(gene_ids, families), self.expected(['a', 'c']))
+        positions, codes = self.index.search(['unknown'])
+        self.assertEqual((positions.tolist(), codes.tolist()), ([], []))
+
+    def test_labels(self):
+        gene_order = self.index.gene_order
+        start, end = gene_order.bounds(self.features['Genus0.chr1'].pk)
+        self.assertEqual(
+            self.index.labels(range(start, end)),
+            [f or '' for f in CHROMOSOME_FAMILIES['Genus0.chr1']]
+        )
+        self.assertEqual(len(self.index.codes(['a', 'b', 'unknown'])), 2)
+
+    def test_search_tracks(self):
+        response = self.post('/services/v1/micro-synteny-search/', {
+            'query': ['a', 'b', 'c', 'd'], 'matched': 2, 'intermediate': 2
+        })
+        groups = self.decode(response)['groups']
+        self.assertEqual(sorted(g['chromosome_name'] for g in groups),
+                         sorted(CHROMOSOME_FAMILIES))
+        # the genes' families are read from the index
+        for group in groups:
+            families = CHROMOSOME_FAMILIES[group['chromosome_name']]
+            for gene in group['genes']:
+                number = int(gene['name'].rsplit('.g', 1)[1])
+                self.assertEqual(gene['family'], families[number] or '')
+
+
+###########
+# queries #
+###########
+
+# the stages' queries take any number of values
+class QueryTests(FixtureTestCase):
+
+    def test_many_values(self):
+        genes = sorted((f for n, f in self.features.items() if '.g' in n),
+                       key=lambda g: g.pk)
+        ids = [g.pk for g in genes] + [-1, -2]
+        # SQLite limits a statement's parameters, so long lists of values
+        # are queried a chunk at a time
+        max_in_values = queries.MAX_IN_VALUES
+        queries.MAX_IN_VALUES = 7
+        try:
+            with CaptureQueriesContext(connection) as context:
+                names, locs, families = queries.gene_details(ids)
+                focus = queries.focus_genes([g.name for g in genes])
+        finally:
+            queries.MAX_IN_VALUES = max_in_values
+        # 32 ids and 30 names, 7 at a time
+        self.assertEqual(len(context.captured_queries), 5 + 5)
+        self.assertEqual(names, dict((g.pk, g.name) for g in genes))
+        self.assertEqual([g.feature_id for g in focus],
+                         [g.pk for g in genes])
+
+
+###########################
+# micro-synteny responses #
+###########################
+
+# the micro-synteny views' results are the same in every format a client can
+# ask for as in the version 1 format
+class MicroSyntenyResponseTests(FixtureTestCase):
+
+    BASIC = {'genes': ['Genus0.chr0.g1', 'Genus0.chr1.g4', 'Genus1.chr0.g8'],
+             'neighbors': 2}
+    SEARCH = {'query': ['a', 'b', 'c', 'd'], 'matched': 2, 'intermediate': 2}
+    VIEWS = (('micro-synteny-basic', BASIC),
+             ('micro-synteny-search', SEARCH))
+
+    # the version 1 result of the given view for the given request
+    def v1(self, view, data):
+        response = self.post('/services/v1/%s/' % view, data)
+        self.assertFalse(response.streaming)
+        return self.decode(response)
+
+    def test_v2(self):
+        query_track = ('gene-to-query-track',
+                       {'gene': 'Genus0.chr1.g4', 'neighbors': 2})
+        for view, data in self.VIEWS + (query_track,):
+            expected = self.v1(view, data)
+            for encoder in serializers.ENCODERS:
+                with self.settings(GCV_JSON_ENCODER=encoder):
+                    response = self.post('/services/v2/%s/' % view, data)
+                # v2 clients get the json object itself
+                result = json.loads(response.content.decode('utf-8'))
+                self.assertIsInstance(result, dict)
+                self.assertEqual(result, expected)
+
+    # converts columnar results back to the version 1 format
+    def decode_columnar(self, result):
+        families = result['families']
+        groups = []
+        for group in result['groups']:
+            columns = group['genes']
+            arrays = dict(
+                (name, np.frombuffer(base64.b64decode(columns[name]),
+                                     dtype=dtype).tolist())
+                for name, dtype in (('id', '<i4'), ('fmin', '<i4'),
+                                    ('fmax', '<i4'), ('strand', '<i1'),
+                                    ('family', '<i4'))
+            )
+            self.assertEqual(len(columns['name']), columns['length'])
+            genes = []
+            for i, name in enumerate(columns['name']):
+                family = arrays['family'][i]
+                genes.append({
+                    'name': name,
+                    'id': arrays['id'][i],
+                    'fmin': arrays['fmin'][i],
+                    'fmax': arrays['fmax'][i],
+                    'strand': arrays['strand'][i],
+                    'family': families[family] if family != -1 else ''
+                })
+            groups.append(dict(group, genes=genes))
+        return {'groups': groups,
+                'families': [{'name': f, 'id': f} for f in families]}
+
+    def test_columnar(self):
+        for view, data in self.VIEWS:
+            expected = self.v1(view, data)
+            # clients ask for columnar results with the format parameter or
+            # the Accept header, and can stream them
+            for version, data, extra in (
+                    ('v1', dict(data, format='columnar'), {}),
+                    ('v2', data,
+                     {'HTTP_ACCEPT': serializers.COLUMNAR_CONTENT_TYPE}),
+                    ('v2', dict(data, format='columnar', stream=True), {})):
+                response = self.post('/services/%s/%s/' % (version, view),
+                                     data, **extra)
+                self.assertTrue(response['Content-Type'].startswith(
+                    serializers.COLUMNAR_CONTENT_TYPE))
+                self.assertIn('Accept', response['Vary'])
+                self.assertEqual(self.decode_columnar(self.decode(response)),
+                                 expected)
+
+    def test_stream(self):
+        for view, data in self.VIEWS:
+            expected = self.v1(view, data)
+            for version in ('v1', 'v2'):
+                response = self.post('/services/%s/%s/' % (version, view),
+                                     dict(data, stream=True))
+                self.assertTrue(response.streaming)
+                self.assertEqual(self.decode(response), expected)
+
+    def test_stream_order(self):
+        # the groups are sent as they're generated, and the families, which
+        # are collected from them, last
+        expected = self.v1('micro-synteny-basic', self.BASIC)
+        chunk_size = serializers.STREAM_CHUNK_SIZE
+        serializers.STREAM_CHUNK_SIZE = 1
+        try:
+            response = self.post('/services/v2/micro-synteny-basic/',
+                                 dict(self.BASIC, stream=True))
+            chunks = list(response.streaming_content)
+        finally:
+            serializers.STREAM_CHUNK_SIZE = chunk_size
+        self.assertEqual(len(chunks), len(expected['groups']) + 1)
+        self.assertTrue(chunks[0].startswith(b'{"groups":['))
+        self.assertTrue(chunks[-1].startswith(b'],"families":'))
+        content = b''.join(chunks).decode('utf-8')
+        self.assertEqual(json.loads(content), expected)
+
+
+# the query tracks of many genes are resolved at once, with as many queries as
+# the track of one gene
+class QueryTracksTests(FixtureTestCase):
+
+    GENES = ['Genus0.chr1.g4', 'unknown', 'Genus1.chr0.g9', 'Genus0.chr1.g4']
+
+    def test_tracks(self):
+        expected = [
+            self.decode(self.post('/services/v1/gene-to-query-track/',
+                                  {'gene': name, 'neighbors': 2}))
+            if name != 'unknown' else None
+            for name in self.GENES
+        ]
+        self.assertEqual(
+            self.post('/services/v1/gene-to-query-track/',
+                      {'gene': 'unknown', 'neighbors': 2}).status_code,
+            404
+        )
+        for version in ('v1', 'v2'):
+            response = self.post('/services/%s/gene-to-query-tracks/' %
+                                 version,
+                                 {'genes': self.GENES, 'neighbors': 2})
+            self.assertEqual(self.decode(response), expected)
+
+    def test_queries(self):
+        # the first request loads the indexes and cvterms, so its queries
+        # aren't counted
+        counts = []
+        for genes in (self.GENES, self.GENES[:1], self.GENES):
+            with CaptureQueriesContext(connection) as context:
+                self.post('/services/v2/gene-to-query-tracks/',
+                          {'genes': genes, 'neighbors': 2})
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[1], counts[2])
+
+    def test_bad_request(self):
+        for data in ({'genes': 'Genus0.chr1.g4', 'neighbors': 2},
+                     {'genes': self.GENES, 'neighbors': 0},
+                     {'genes': self.GENES}):
+            response = self.post('/services/v2/gene-to-query-tracks/', data)
+            self.assertEqual(response.status_code, 400)
+
+
+# overlapping tracks can be merged so their shared genes are only sent once
+class MergedTracksTests(FixtureTestCase):
+
+    # two of the focus genes' neighborhoods overlap on Genus0.chr0
+    GENES = ['Genus0.chr0.g2', 'Genus0.chr1.g4', 'Genus0.chr0.g4']
+
+    def test_merge_blocks(self):
+        chromosome_ids, lowers, uppers, index = search.merge_blocks(
+            [1, 2, 1, 1, 1], [5, 0, 0, 20, 10], [9, 3, 5, 25, 12])
+        # blocks that share a number are merged, those that only abut aren't
+        self.assertEqual(chromosome_ids.tolist(), [1, 2, 1, 1])
+        self.assertEqual(lowers.tolist(), [0, 0, 20, 10])
+        self.assertEqual(uppers.tolist(), [9, 3, 25, 12])
+        self.assertEqual(index.tolist(), [0, 1, 0, 2, 3])
+        self.assertEqual(
+            [a.tolist() for a in search.merge_blocks([], [], [])],
+            [[], [], [], []])
+
+    def test_merge(self):
+        data = {'genes': self.GENES, 'neighbors': 2}
+        expected = self.decode(
+            self.post('/services/v1/micro-synteny-basic/', data))
+        # the overlapping tracks are sent as the first one's, with the genes
+        # of both in order
+        first, second = [group for group in expected['groups']
+                         if group['chromosome_name'] == 'Genus0.chr0']
+        genes = dict((g['id'], g) for g in first['genes'] + second['genes'])
+        merged = dict(first, genes=sorted(genes.values(),
+                                          key=lambda g: g['fmin']))
+        self.assertEqual(len(merged['genes']), 7)
+        groups = [merged if group is first else group
+                  for group in expected['groups'] if group is not second]
+        for version in ('v1', 'v2'):
+            for stream in (False, True):
+                response = self.post(
+                    '/services/%s/micro-synteny-basic/' % version,
+                    dict(data, merge=True, stream=stream))
+                result = self.decode(response)
+                self.assertEqual(result['groups'], groups)
+                self.assertEqual(
+                    sorted(result['families'], key=lambda f: f['id']),
+                    sorted(expected['families'], key=lambda f: f['id']))
+
+    def test_disjoint(self):
+        # tracks that don't overlap are the same merged or not
+        data = MicroSyntenyResponseTests.BASIC
+        expected = self.decode(
+            self.post('/services/v1/micro-synteny-basic/', data))
+        response = self.post('/services/v2/micro-synteny-basic/',
+                             dict(data, merge=True))
+        self.assertEqual(self.decode(response), expected)
+
+
+#################
+# index advisor #
+#################
+
+# the advisor reports the indexes the services' queries need that the
+# database doesn't have, counting an index with the same leading columns
+class AdviseIndexesTests(FixtureTestCase):
+
+    def missing(self):
+        with connection.cursor() as cursor:
+            return [name for name, table, columns, predicate in
+                    advise_indexes.missing_indexes(cursor)]
+
+    def advise(self, *args):
+        out = StringIO()
+        call_command('advise_indexes', *args, stdout=out)
+        return out.getvalue()
+
+    def test_missing(self):
+        missing = self.missing()
+        self.assertIn('gcv_gene_order_chromosome_number', missing)
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE INDEX test_gene_order ON gene_order ' +
+                           '(chromosome_id, number, gene_id)')
+        self.assertEqual(self.missing(), [
+            name for name in missing
+            if name != 'gcv_gene_order_chromosome_number'
+        ])
+
+    def test_create(self):
+        missing = self.missing()
+        out = self.advise('--create', '--explain')
+        for name in missing:
+            self.assertIn('Missing %s on' % name, out)
+            self.assertIn('Created %s in' % name, out)
+        # the fixture has no syntenic regions to time the blocks query with
+        self.assertNotIn('macro-synteny blocks (', out)
+        for query in ('gene order range', 'gene details', 'family search'):
+            self.assertIn('%s (before)' % query, out)
+            self.assertIn('%s (after)' % query, out)
+        self.assertEqual(self.missing(), [])
+        self.assertEqual(self.advise().strip(), 'No indexes are missing')
+
+
+##############
+# read store #
+##############
+
+# genes that aren't in the read store yet, e.g. those ordered since it was
+# built, are read from the database instead
+@override_settings(GCV_READ_STORE=True)
+class ReadStoreTests(FixtureTestCase):
+
+    QUERY = ['a', 'b', 'c', 'd']
+
+    def setUp(self):
+        super(ReadStoreTests, self).setUp()
+        readstore.build()
+        organism = Organism.objects.get(genus='Genus1')
+        self.stale = create_chromosome('Genus1.chr1', organism, self.QUERY)
+
+    def assertStaleTrack(self, groups):
+        tracks = [g['genes'] for g in groups
+                  if g['chromosome_name'] == 'Genus1.chr1']
+        self.assertEqual(len(tracks), 1)
+        self.assertEqual(sorted(g['name'] for g in tracks[0]),
+                         ['Genus1.chr1.g%d' % i for i in range(4)])
+
+    def test_basic(self):
+        response = self.post('/services/v2/micro-synteny-basic/',
+                             {'genes': ['Genus1.chr1.g1'], 'neighbors': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertStaleTrack(json.loads(response.content)['groups'])
+
+    def test_search(self):
+        for align in (None, {}, {'algorithm': 'repeat'}):
+            params = {'query': self.QUERY, 'matched': 3, 'intermediate': 2}
+            if align is not None:
+                params['align'] = align
+            response = self.post('/services/v2/micro-synteny-search/', params)
+            self.assertEqual(response.status_code, 200)
+            self.assertStaleTrack(json.loads(response.content)['groups'])
+
+
+#############
+# alignment #
+#############
+
+# the ports of the client's pairwise alignment algorithms
+class AlignmentTests(SimpleTestCase):
+
+    QUERY = ['a', 'b', 'c', 'd']
+
+    def align(self, tracks, **params):
+        return alignment.align_tracks(self.QUERY, tracks,
+                                      alignment.parse_params(params))
+
+    def test_default_params(self):
+        self.assertEqual(alignment.parse_params({}), {
+            'algorithm': 'smith-waterman', 'match': 5, 'mismatch': 0,
+            'gap': -1, 'threshold': 0
+        })
+        # the client's repeat algorithm has its own threshold
+        self.assertEqual(alignment.parse_params({'algorithm': 'repeat'}), {
+            'algorithm': 'repeat', 'match': 5, 'mismatch': 0, 'gap': -1,
+            'threshold': 10
+        })
+        self.assertEqual(alignment.parse_params(
+            {'algorithm': 'repeat', 'threshold': '25'})['threshold'], 25)
+
+    def test_bad_params(self):
+        for params in ([], {'algorithm': 'x'}, {'match': 'x'}):
+            self.assertRaises(ValueError, alignment.parse_params, params)
+
+    def test_smith_waterman(self):
+        forward, reverse, mismatch, unrelated = self.align([
+            ['a', 'b', 'c', 'd'],
+            ['d', 'c', 'b', 'a'],
+            ['a', 'x', 'c', 'd'],
+            ['x', 'y', 'z']
+        ])
+        self.assertEqual(forward, [alignment.Alignment(
+            20, False, [(0, 0), (1, 1), (2, 2), (3, 3)])])
+        self.assertEqual(reverse, [alignment.Alignment(
+            20, True, [(3, 0), (2, 1), (1, 2), (0, 3)])])
+        self.assertEqual(mismatch[0].score, 15)
+        self.assertEqual(unrelated, [alignment.Alignment(0, False, [])])
+
+    @override_settings(GCV_ALIGNMENT_PROCESSES=2)
+    def test_pool(self):
+        tracks = [['a', 'b', 'c', 'd'], ['d', 'c', 'b', 'a'], ['x', 'y']] *\
+            alignment.CHUNK_SIZE
+        expected = self.align(tracks)
+        self.assertIsNone(alignment.get_pool())
+        self.assertIsNotNone(alignment.start_pool())
+        try:
+            self.assertIsNotNone(alignment.get_pool())
+            self.assertEqual(self.align(tracks), expected)
+        finally:
+            alignment.stop_pool()
+        self.assertIsNone(alignment.get_pool())
+
+    def test_repeat(self):
+        forward, reverse, repeated, unrelated = self.align([
+            ['a', 'b', 'c', 'd'],
+            ['d', 'c', 'b', 'a'],
+            ['a', 'b', 'c', 'd'] + ['x'] * 7 + ['a', 'b', 'c', 'd'],
+            ['x', 'y', 'z']
+        ], algorithm='repeat')
+        self.assertEqual(forward, [alignment.Alignment(
+            20, False, [(0, 0), (1, 1), (2, 2), (3, 3)])])
+        self.assertEqual(reverse, [alignment.Alignment(
+            20, True, [(3, 0), (2, 1), (1, 2), (0, 3)])])
+        # each copy of the query is aligned
+        self.assertEqual(len(repeated), 2)
+        self.assertIn(alignment.Alignment(
+            20, False, [(0, 0), (1, 1), (2, 2), (3, 3)]), repeated)
+        self.assertEqual(unrelated, [])
+
+    def test_apply_alignment(self):
+        genes = [{'name': n, 'strand': 1} for n in ('g0', 'g1', 'g2')]
+        aligned = alignment.apply_alignment(
+            genes, alignment.Alignment(10, True, [(2, 0), (0, 1.5)]))
+        self.assertEqual(aligned, [
+            {'name': 'g2', 'strand': -1, 'x': 0, 'y': 0},
+            {'name': 'g0', 'strand': -1, 'x': 1.5, 'y': 0}
+        ])
+        # genes whose details are missing are skipped
+        genes[2] = None
+        aligned = alignment.apply_alignment(
+            genes, alignment.Alignment(10, False, [(2, 0), (0, 1)]))
+        self.assertEqual([g['name'] for g in aligned], ['g0'])
+
+
+#######
+# msa #
+#######
+
+# tracks are aligned to a profile HMM trained on them, in whichever
+# orientation is more probable
+class MsaTests(FixtureTestCase):
+
+    TRACK = [('a', 1), ('b', 1), ('c', 1), ('d', 1)]
+
+    def groups(self, *tracks):
+        return [{'genes': [{'name': '%s%d' % (f, i), 'family': f,
+                            'strand': s} for i, (f, s) in enumerate(t)]}
+                for t in tracks]
+
+    def test_align(self):
+        forward = [(k, k, False, False) for k in range(4)]
+        self.assertEqual(msa.align([self.TRACK, self.TRACK]), [forward] * 2)
+        # a track in the opposite orientation is flipped
+        reverse = [(f, -s) for f, s in reversed(self.TRACK)]
+        self.assertEqual(msa.align([self.TRACK, reverse])[1],
+                         [(3 - k, k, True, False) for k in range(4)])
+        # genes of families no other track has are inserted between columns
+        inserted = self.TRACK[:1] + [('x', 1)] + self.TRACK[1:]
+        self.assertEqual(msa.align([self.TRACK, inserted])[1], [
+            (0, 0, False, False), (1, 0.5, False, False),
+            (2, 1, False, False), (3, 2, False, False), (4, 3, False, False)
+        ])
+        self.assertEqual(msa.align([]), [])
+
+    def test_path_coordinates(self):
+        path = [(msa.MATCH, 0), (msa.INSERT, 1), (msa.INSERT, 1),
+                (msa.MATCH, 1), (msa.END, 2)]
+        xs = msa.path_coordinates(path, 4)
+        self.assertEqual(xs[0], 0)
+        self.assertAlmostEqual(xs[1], 1 / 3.0)
+        self.assertAlmostEqual(xs[2], 2 / 3.0)
+        self.assertEqual(xs[3], 1)
+
+    def test_orientation_sequence(self):
+        self.assertEqual(msa.orientation_sequence([1, 1, 1], [0, 0, 0]),
+                         ['f', 'f', 'f'])
+        self.assertEqual(msa.orientation_sequence([0, 0, 0], [1, 1, 1]),
+                         ['r', 'r', 'r'])
+        # a single reversed character between forward ones isn't an island
+        self.assertEqual(
+            msa.orientation_sequence([1, 1, 0, 1, 1], [0, 0, 1, 0, 0]),
+            ['f', 'f', 'f', 'f', 'f']
+        )
+
+    def test_tracks_key(self):
+        groups = self.groups(self.TRACK)
+        renamed = [dict(groups[0], chromosome='other')]
+        self.assertEqual(msa.tracks_key(msa.group_tracks(groups)),
+                         msa.tracks_key(msa.group_tracks(renamed)))
+        self.assertNotEqual(
+            msa.tracks_key(msa.group_tracks(groups)),
+            msa.tracks_key(msa.group_tracks(self.groups(self.TRACK[1:])))
+        )
+
+    def test_view(self):
+        reverse = [(f, -s) for f, s in reversed(self.TRACK)]
+        for version in ('v1', 'v2'):
+            response = self.post(
+                '/services/%s/micro-synteny-msa/' % version,
+                {'groups': self.groups(self.TRACK, reverse), 'extra': 1}
+            )
+            self.assertEqual(response.status_code, 200)
+            result = json.loads(response.content)
+            # version 1 clients get the json encoded as a json string
+            if version == 'v1':
+                result = json.loads(result)
+            self.assertEqual(result['extra'], 1)
+            forward, flipped = result['groups']
+            self.assertEqual([g['x'] for g in forward['genes']], range(4))
+            self.assertEqual([g['name'] for g in flipped['genes']],
+                             ['a3', 'b2', 'c1', 'd0'])
+            self.assertEqual([g['strand'] for g in flipped['genes']],
+                             [1] * 4)
+
+    def test_bad_request(self):
+        for data in ([], {}, {'groups': {}}, {'groups': [1]},
+                     {'groups': [{'genes': 1}]},
+                     {'groups': [{'genes': [1]}]}):
+            response = self.post('/services/v2/micro-synteny-msa/', data)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/services/v2/micro-synteny-msa/', 'x',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+######################
+# frequented regions #
+######################
+
+# regions are contracted from the edges between neighboring families, most
+# supported first, and the frequent ones are returned with those below them
+class FrequentedRegionsTests(FixtureTestCase):
+
+    PARAMS = {'alpha': 1, 'kappa': 1, 'minsup': 2}
+
+    def regions(self, tracks, **params):
+        params = frequented_regions.parse_params(dict(self.PARAMS, **params))
+        return frequented_regions.frequented_regions(
+            tracks, params['alpha'], params['kappa'], params['minsup'],
+            params['minsize'])
+
+    def summary(self, regions):
+        return [(r['families'], r['supporting'], self.summary(
+                 r['descendants'])) for r in regions]
+
+    def test_params(self):
+        self.assertEqual(frequented_regions.parse_params(self.PARAMS), {
+            'alpha': 1.0, 'kappa': 1.0, 'minsup': 2, 'minsize': 1
+        })
+        for params in ([], {'alpha': 1}, dict(self.PARAMS, alpha='x'),
+                       dict(self.PARAMS, alpha=None),
+                       dict(self.PARAMS, alpha=0), dict(self.PARAMS, kappa=-1),
+                       dict(self.PARAMS, minsup=1),
+                       dict(self.PARAMS, minsize=0)):
+            self.assertRaises(ValueError, frequented_regions.parse_params,
+                              params)
+
+    def test_merge_intervals(self):
+        self.assertEqual(
+            frequented_regions.merge_intervals([(0, 2, 1), (5, 7, 1)],
+                                               [(1, 3, 1)]),
+            ([(0, 3, 2), (5, 7, 1)], 2)
+        )
+        # an interval can join several
+        self.assertEqual(
+            frequented_regions.merge_intervals([(0, 1, 1), (3, 4, 1)],
+                                               [(1, 3, 1)]),
+            ([(0, 4, 3)], 3)
+        )
+
+    def test_regions(self):
+        tracks = [list('abc')] * 3
+        self.assertEqual(self.summary(self.regions(tracks)),
+                         [(['a', 'b', 'c'], [0, 1, 2], [])])
+        self.assertEqual(self.regions(tracks, minsup=4), [])
+        self.assertEqual(self.regions(tracks, minsize=4), [])
+        self.assertEqual(self.regions([]), [])
+        # a region below a frequent region is frequent if more paths
+        # support it
+        self.assertEqual(
+            self.summary(self.regions([list('abcd')] * 2 + [list('ab')] * 2)),
+            [(['c', 'd', 'a', 'b'], [0, 1], [(['a', 'b'], [0, 1, 2, 3], [])])]
+        )
+
+    def test_kappa(self):
+        # genes without a family aren't nodes but still separate their
+        # neighbors
+        for inserted in ('x', ''):
+            tracks = [list('abc'), ['a', inserted, 'b', 'c'], list('abc')]
+            self.assertEqual(self.summary(self.regions(tracks, minsup=3)), [
+                (['b', 'c'], [0, 1, 2], []), (['a'], [0, 1, 2], [])
+            ])
+            self.assertEqual(
+                self.summary(self.regions(tracks, kappa=2, minsup=3)),
+                [(['a', 'b', 'c'], [0, 1, 2], [])]
+            )
+
+    def test_view(self):
+        groups = [{'genes': [{'family': f} for f in track]}
+                  for track in ('abc', 'abc', 'xyz')]
+        # a result set is used over any chromosomes given with it
+        for data in ({'groups': groups},
+                     {'groups': groups, 'chromosomes': [1]}):
+            response = self.post('/services/v2/frequented-regions/',
+                                 dict(self.PARAMS, **data))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                self.summary(json.loads(response.content)['regions']),
+                [(['a', 'b', 'c'], [0, 1], [])]
+            )
+        chromosome_ids = [self.features[name].pk for name in
+                          ('Genus0.chr0', 'Genus0.chr1', 'Genus1.chr0')]
+        response = self.post('/services/v1/frequented-regions/',
+                             dict(self.PARAMS, chromosomes=chromosome_ids,
+                                  minsup=3))
+        self.assertEqual(response.status_code, 200)
+        regions = json.loads(json.loads(response.content))['regions']
+        # a occurs twice on both of the first chromosomes
+        self.assertEqual(self.summary(regions), [
+            (['a', 'b', 'c'], [0, 1, 2], [(['a'], [0, 0, 1, 1, 2], [])]),
+            (['d'], [0, 1, 2], []),
+            (['e'], [0, 1, 2], [])
+        ])
+
+    def test_bad_request(self):
+        groups = [{'genes': [{'family': 'a'}]}]
+        for data in ([], {}, self.PARAMS, {'groups': groups},
+                     dict(self.PARAMS, minsup=1, groups=groups),
+                     dict(self.PARAMS, groups=1),
+                     dict(self.PARAMS, groups=[{'genes': [1]}]),
+                     dict(self.PARAMS, chromosomes=['x'])):
+            response = self.post('/services/v2/frequented-regions/', data)
+            self.assertEqual(response.status_code, 400)
+
+
+#########
+# cache #
+#########
+
+# responses are cached and given ETags by the request and the data version
+class CacheTests(FixtureTestCase):
+
+    URL = '/services/v2/micro-synteny-search/'
+    SEARCH = {'query': ['a', 'b', 'c', 'd'], 'matched': 2, 'intermediate': 2}
+
+    def setUp(self):
+        super(CacheTests, self).setUp()
+        cache._backend = None
+
+    def tearDown(self):
+        cache._backend = None
+
+    def test_disabled(self):
+        for settings in ({},
+                         {'GCV_RESPONSE_CACHE': 'lru'},
+                         {'GCV_DATA_VERSION': '1'}):
+            with self.settings(**settings):
+                for i in range(2):
+                    response = self.post(self.URL, self.SEARCH)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotIn('X-Cache', response)
+                    # without a data version there are no ETags either
+                    if 'GCV_DATA_VERSION' not in settings:
+                        self.assertNotIn('ETag', response)
+            cache._backend = None
+
+    @override_settings(GCV_RESPONSE_CACHE='lru', GCV_DATA_VERSION='1')
+    def test_hit(self):
+        first = self.post(self.URL, self.SEARCH)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        # the request body is normalized
+        body = '{"intermediate": 2, "matched": 2,  "query": ["a","b","c","d"]}'
+        second = self.client.post(self.URL, body,
+                                  content_type='application/json')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        # a new data version misses
+        with self.settings(GCV_DATA_VERSION='2'):
+            self.assertEqual(self.post(self.URL, self.SEARCH)['X-Cache'],
+                             'MISS')
+
+    @override_settings(GCV_RESPONSE_CACHE='lru', GCV_DATA_VERSION='1')
+    def test_errors_not_cached(self):
+        search = dict(self.SEARCH, limit='x')
+        hits = cache.stats()['hits']
+        for i in range(2):
+            response = self.post(self.URL, search)
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('X-Cache', response)
+        self.assertEqual(cache.stats()['hits'], hits)
+
+    @override_settings(GCV_DATA_VERSION='1')
+    def test_etag(self):
+        response = self.post(self.URL, self.SEARCH)
+        etag = response['ETag']
+        for if_none_match, status in ((etag, 304), ('"x", ' + etag, 304),
+                                      ('*', 304), ('"x"', 200)):
+            response = self.client.post(
+                self.URL, json.dumps(self.SEARCH),
+                content_type='application/json',
+                HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, status)
+            self.assertEqual(response['ETag'], etag)
+        with self.settings(GCV_DATA_VERSION='2'):
+            self.assertNotEqual(self.post(self.URL, self.SEARCH)['ETag'], etag)
+
+    @override_settings(GCV_RESPONSE_CACHE='lru')
+    def test_database_version(self):
+        # there's no version until the data version is bumped
+        self.assertIsNone(versions.data_version())
+        self.assertNotIn('ETag', self.post(self.URL, self.SEARCH))
+        call_command('bump_data_version', stdout=open(os.devnull, 'w'))
+        self.assertEqual(versions.data_version(), '1')
+        first = self.post(self.URL, self.SEARCH)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(self.post(self.URL, self.SEARCH)['X-Cache'], 'HIT')
+        # the version is only read again when the worker reloads its data
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE %s SET version = 5' % versions.TABLE)
+        self.assertEqual(versions.data_version(), '1')
+        versions.invalidate()
+        self.assertEqual(versions.data_version(), '5')
+        second = self.post(self.URL, self.SEARCH)
+        self.assertEqual(second['X-Cache'], 'MISS')
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(versions.bump(), 6)
+        self.assertEqual(versions.data_version(), '6')
+        # the setting overrides the database's version
+        with self.settings(GCV_DATA_VERSION='x'):
+            self.assertEqual(versions.data_version(), 'x')
+
+    def test_lru(self):
+        backend = cache.LRUBackend(10)
+        for key in 'abc':
+            backend.set(key, (200, 'text/plain', key * 4, None))
+        # the least recently used entry is evicted to fit the newest
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.get('b')[2], 'bbbb')
+        backend.set('d', (200, 'text/plain', 'dddd', None))
+        self.assertIsNone(backend.get('c'))
+        self.assertEqual(backend.size, 8)
+        # entries larger than the cache aren't cached
+        backend.set('e', (200, 'text/plain', 'e' * 11, None))
+        self.assertIsNone(backend.get('e'))
+
+
+#################
+# macro-synteny #
+#################
+
+# the block table is swapped in whole, and the blocks it serves are limited to
+# the chromosomes in a request's results
+class MacroSyntenyTableTests(FixtureTestCase):
+
+    def setUp(self):
+        super(MacroSyntenyTableTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'table')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def table(self, partners):
+        arrays = [[1] * len(partners), partners, range(len(partners)),
+                  range(1, len(partners) + 1), [1] * len(partners)]
+        chromosomes = dict((c, ('chr%d' % c, 100, 'Genus', 'species'))
+                           for c in [1] + partners)
+        return indexes.MacroSyntenyTable(
+            [np.asarray(a, dtype=t) for a, t in
+             zip(arrays, indexes.MacroSyntenyTable.DTYPES)],
+            chromosomes
+        )
+
+    def test_save(self):
+        self.table([2, 3]).save(self.path)
+        first = indexes.MacroSyntenyTable.load(self.path)
+        self.assertEqual(first.blocks(1)[0].tolist(), [2, 3])
+        self.table([4]).save(self.path)
+        self.assertTrue(os.path.islink(self.path))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['table', os.readlink(self.path)]))
+        second = indexes.MacroSyntenyTable.load(self.path)
+        self.assertEqual(second.blocks(1)[0].tolist(), [4])
+        self.assertEqual(first.blocks(1, [3])[0].tolist(), [3])
+
+    def test_save_over_directory(self):
+        os.makedirs(self.path)
+        open(os.path.join(self.path, 'chromosomes.json'), 'w').close()
+        self.table([2]).save(self.path)
+        self.assertTrue(os.path.islink(self.path))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        table = indexes.MacroSyntenyTable.load(self.path)
+        self.assertEqual(table.blocks(1)[0].tolist(), [2])
+
+    def test_results(self):
+        self.table([2, 3, 2]).save(self.path)
+        with self.settings(GCV_MACRO_SYNTENY_TABLE=self.path):
+            indexes.invalidate()
+            response = self.post('/services/v1/macro-synteny/',
+                                 {'chromosome': 'chr1', 'results': ['2']})
+            self.assertEqual(response.status_code, 200)
+            tracks = json.loads(response.content)['tracks']
+            self.assertEqual([t['chromosome'] for t in tracks], ['chr2'])
+            self.assertEqual(len(tracks[0]['blocks']), 2)
+            for results in (['x'], [None], 2):
+                response = self.post('/services/v1/macro-synteny/',
+                                     {'chromosome': 'chr1',
+                                      'results': results})
+                self.assertEqual(response.status_code, 400)
+        indexes.invalidate()
+
+
+################
+# global plots #
+################
+
+# a global plot pairs the genes on a chromosome with the query genes of the
+# same family
+class GlobalPlotTests(FixtureTestCase):
+
+    URL = '/services/v1/global-plots/'
+    QUERY = ['a', 'b', '', 'x', 'a']
+
+    def expected(self, name):
+        families = CHROMOSOME_FAMILIES[name]
+        return sorted(
+            ('%s.g%d' % (name, i), f) for i, f in enumerate(families)
+            if f is not None and f in self.QUERY
+        )
+
+    def test_genes(self):
+        response = self.post(self.URL, {
+            'query': self.QUERY,
+            'chromosome': self.features['Genus0.chr1'].pk
+        })
+        genes = json.loads(response.content)
+        self.assertEqual(sorted((g['name'], g['family']) for g in genes),
+                         self.expected('Genus0.chr1'))
+        gene = [g for g in genes if g['name'] == 'Genus0.chr1.g1'][0]
+        self.assertEqual((gene['fmin'], gene['fmax'], gene['strand']),
+                         (1000, 1800, 1))
+
+    def test_unicode_family(self):
+        organism = Organism.objects.get(genus='Genus1')
+        family = u'fam\xedlia'
+        chromosome = create_chromosome('Genus1.chr1', organism,
+                                       [family, 'a'])['Genus1.chr1']
+        response = self.post(self.URL, {'query': [family],
+                                        'chromosome': chromosome.pk})
+        self.assertEqual(response.status_code, 200)
+        genes = json.loads(response.content)
+        self.assertEqual([(g['name'], g['family']) for g in genes],
+                         [('Genus1.chr1.g0', family)])
+
+    def test_chromosomes(self):
+        names = ['Genus0.chr0', 'Genus1.chr0']
+        response = self.post(self.URL, {
+            'query': self.QUERY,
+            'chromosomes': [self.features[n].pk for n in names]
+        })
+        plot = json.loads(response.content)
+        for name in names:
+            genes = plot[str(self.features[name].pk)]
+            self.assertEqual(sorted((g['name'], g['family']) for g in genes),
+                             self.expected(name))
+
+    def test_bins(self):
+        chromosome_id = self.features['Genus0.chr0'].pk
+        response = self.post(self.URL, {
+            'query': self.QUERY,
+            'chromosome': chromosome_id,
+            'bins': [2, 5],
+            'x_range': [0, 10000],
+            'y_range': [0, 5]
+        })
+        plot = json.loads(response.content)
+        # a and b are at genes 0, 1 and 6, and a is twice in the query
+        self.assertEqual(plot['points'], 5)
+        self.assertEqual(plot['x_edges'], [0, 5000, 10000])
+        self.assertEqual(plot['counts'], [
+            [1, 1],
+            [1, 0],
+            [0, 0],
+            [0, 0],
+            [1, 1]
+        ])
+
+    def test_grouped_points(self):
+        x, y = plots.grouped_points({'a': [1, 2], 'b': [3]},
+                                    ['a', '', 'c', 'b', 'a'],
+                                    [10, 11, 12, 13, 14])
+        self.assertEqual(sorted(zip(x.tolist(), y.tolist())),
+                         [(1, 10), (1, 14), (2, 10), (2, 14), (3, 13)])
+
+
+###################
+# connection pool #
+###################
+
+# a connection that records whether it's been closed
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+# the pool reuses connections until they're too old, fail their health check
+# or can't be reset, and makes requests wait for at most its timeout
+class ConnectionPoolTests(SimpleTestCase):
+
+    def create_pool(self, check=True, reset=True, **kwargs):
+        return pool.ConnectionPool(FakeConnection, lambda c: check,
+                                   lambda c: reset, **kwargs)
+
+    def test_reuse(self):
+        connections = self.create_pool()
+        first = connections.acquire()
+        self.assertEqual(connections.stats()['in_use'], 1)
+        connections.release(first)
+        self.assertIs(connections.acquire(), first)
+        second = connections.acquire()
+        self.assertIsNot(second, first)
+        connections.release(second)
+        stats = connections.stats()
+        self.assertEqual((stats['created'], stats['reused'], stats['open'],
+                          stats['in_use'], stats['idle'],
+                          stats['peak_in_use']), (2, 1, 2, 1, 1, 2))
+        self.assertFalse(first.closed or second.closed)
+
+    def test_lifetime(self):
+        connections = self.create_pool(max_lifetime=0)
+        first = connections.acquire()
+        connections.release(first)
+        self.assertTrue(first.closed)
+        self.assertIsNot(connections.acquire(), first)
+        self.assertEqual(connections.stats()['closed_lifetime'], 1)
+
+    def test_health_check(self):
+        # idle connections are only checked after the interval
+        connections = self.create_pool(check=False)
+        first = connections.acquire()
+        connections.release(first)
+        self.assertIs(connections.acquire(), first)
+        connections.release(first)
+        connections.health_check_interval = 0
+        self.assertIsNot(connections.acquire(), first)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections.stats()['closed_health_check'], 1)
+
+    def test_broken(self):
+        connections = self.create_pool(reset=False)
+        first = connections.acquire()
+        connections.release(first)
+        self.assertTrue(first.closed)
+        stats = connections.stats()
+        self.assertEqual((stats['closed_broken'], stats['open']), (1, 0))
+
+    def test_timeout(self):
+        connections = self.create_pool(max_size=1, timeout=0.05)
+        first = connections.acquire()
+        self.assertRaises(pool.PoolTimeout, connections.acquire)
+        # a waiting request gets the connection released by another
+        acquired = []
+        connections.timeout = 10
+        waiter = threading.Thread(
+            target=lambda: acquired.append(connections.acquire()))
+        waiter.start()
+        while connections.stats()['waits'] < 2:
+            time.sleep(0.001)
+        connections.release(first)
+        waiter.join()
+        self.assertEqual(acquired, [first])
+        stats = connections.stats()
+        self.assertEqual((stats['waits'], stats['timeouts']), (2, 1))
+
+    def test_fork(self):
+        # a forked worker forgets its parent's connections and closes them if
+        # they're released
+        connections = self.create_pool()
+        first = connections.acquire()
+        connections.release(connections.acquire())
+        connections._pid = -1
+        stats = connections.stats()
+        self.assertEqual((stats['open'], stats['in_use'], stats['idle']),
+                         (0, 0, 0))
+        connections.release(first)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections.stats()['idle'], 0)
+
+    def test_stats(self):
+        connections = pool.get_pool('test', self.create_pool)
+        try:
+            self.assertIs(pool.get_pool('test', self.create_pool),
+                          connections)
+            connections.release(connections.acquire())
+            response = self.client.get('/services/pool-stats/')
+            stats = json.loads(response.content.decode('utf-8'))['test']
+            self.assertEqual((stats['created'], stats['idle']), (1, 1))
+            pool.close_idle()
+            self.assertEqual(connections.stats()['open'], 0)
+        finally:
+            pool._pools.pop('test', None)
+
+
+###################
+# instrumentation #
+###################
+
+# the queries of views are counted when the GCV_QUERY_STATS setting is on
+@override_settings(GCV_QUERY_STATS=True)
+class InstrumentationTests(FixtureTestCase):
+
+    URL = '/services/v2/micro-synteny-search/'
+    SEARCH = {'query': ['a', 'b', 'c', 'd'], 'matched': 2, 'intermediate': 2}
+
+    def test_counts(self):
+        before = instrumentation.stats().get('v2_micro_synteny_search',
+                                             {'requests': 0})
+        response = self.post(self.URL, self.SEARCH)
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+        after = instrumentation.stats()['v2_micro_synteny_search']
+        self.assertEqual(after['requests'], before['requests'] + 1)
+
+    def test_log(self):
+        # the instrumented queries aren't added to django's log unless django
+        # is in debug mode
+        connection.queries_log.clear()
+        self.post(self.URL, self.SEARCH)
+        self.assertEqual(len(connection.queries_log), 0)
+        # queries made with server-side cursors, e.g. on PostgreSQL, are
+        # recorded by the instrumentation since django doesn't log them
+        recorded = []
+        record = instrumentation.record
+        def record_query(sql, duration):
+            recorded.append(sql)
+            record(sql, duration)
+        instrumentation.record = record_query
+        try:
+            with self.settings(DEBUG=True):
+                response = self.post(self.URL, self.SEARCH)
+        finally:
+            instrumentation.record = record
+        self.assertEqual(len(connection.queries_log) + len(recorded),
+                         int(response['X-DB-Queries']))
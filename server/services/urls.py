@@ -28,12 +28,40 @@ urlpatterns = patterns('services.views',
     url(r'^v1/micro-synteny-basic/$', 'v1_micro_synteny_basic'),
     # gene to query
     url(r'^v1/gene-to-query-track/$', 'v1_gene_to_query_track'),
+    url(r'^v1/gene-to-query-tracks/$', 'v1_gene_to_query_tracks'),
     # search micro-synteny tracks
     url(r'^v1/micro-synteny-search/$', 'v1_micro_synteny_search'),
+    # multiple alignment of micro-synteny tracks
+    url(r'^v1/micro-synteny-msa/$', 'v1_micro_synteny_msa'),
+    # frequented regions of micro-synteny tracks or chromosomes
+    url(r'^v1/frequented-regions/$', 'v1_frequented_regions'),
     # global dot plots
     url(r'^v1/global-plots/$', 'v1_global_plot'),
     # macro-synteny
     url(r'^v1/macro-synteny/$', 'v1_macro_synteny'),
     # genomic location to nearest gene
-    url(r'^v1/nearest-gene/$', 'v1_nearest_gene')
+    url(r'^v1/nearest-gene/$', 'v1_nearest_gene'),
+    # genomic locations to nearest genes
+    url(r'^v1/nearest-genes/$', 'v1_nearest_genes'),
+
+    # v2
+
+    # basic micro-synteny tracks
+    url(r'^v2/micro-synteny-basic/$', 'v2_micro_synteny_basic'),
+    # gene to query
+    url(r'^v2/gene-to-query-track/$', 'v2_gene_to_query_track'),
+    url(r'^v2/gene-to-query-tracks/$', 'v2_gene_to_query_tracks'),
+    # search micro-synteny tracks
+    url(r'^v2/micro-synteny-search/$', 'v2_micro_synteny_search'),
+    # multiple alignment of micro-synteny tracks
+    url(r'^v2/micro-synteny-msa/$', 'v2_micro_synteny_msa'),
+    # frequented regions of micro-synteny tracks or chromosomes
+    url(r'^v2/frequented-regions/$', 'v2_frequented_regions'),
+
+    # response cache hit and miss counts
+    url(r'^cache-stats/$', 'cache_stats'),
+    # per-view query counts and database time
+    url(r'^query-stats/$', 'query_stats'),
+    # database connection pool usage
+    url(r'^pool-stats/$', 'pool_stats')
 )
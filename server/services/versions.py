@@ -0,0 +1,80 @@
+# tracks the version of the data the services serve so cached results can be
+# invalidated when it changes
+import threading
+# django
+from django.conf import settings
+from django.db import connection, transaction
+
+
+# a one-row table holding a counter that's bumped whenever the data are
+# loaded, e.g. by the build_read_store, build_macro_synteny and
+# bump_data_version commands
+TABLE = 'gcv_data_version'
+
+_version = None
+_stale = True
+_lock = threading.Lock()
+
+
+# whether the version table has been created
+def exists():
+    with connection.cursor() as cursor:
+        return TABLE in connection.introspection.table_names(cursor)
+
+
+# returns the version in the database or None if it has never been bumped
+def read():
+    if not exists():
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT version FROM %s' % TABLE)
+        row = cursor.fetchone()
+    return str(row[0]) if row is not None else None
+
+
+# increments the version in the database, creating its table if need be, and
+# returns it; workers see the new version once they're signaled to reload
+def bump():
+    with transaction.atomic():
+        table_exists = exists()
+        with connection.cursor() as cursor:
+            if not table_exists:
+                cursor.execute(
+                    'CREATE TABLE %s (version integer NOT NULL)' % TABLE)
+            cursor.execute('UPDATE %s SET version = version + 1' % TABLE)
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    'INSERT INTO %s (version) VALUES (1)' % TABLE)
+            cursor.execute('SELECT version FROM %s' % TABLE)
+            version = cursor.fetchone()[0]
+    invalidate()
+    return version
+
+
+# returns a stamp that changes whenever the data changes: the GCV_DATA_VERSION
+# setting if it's set, otherwise the version in the database, or None if
+# neither is set. The database's version is read once per worker, when it's
+# first needed, and again after the worker is signaled to reload its data.
+def data_version():
+    global _version, _stale
+    version = getattr(settings, 'GCV_DATA_VERSION', None)
+    if version is not None:
+        return str(version)
+    if _stale:
+        with _lock:
+            if _stale:
+                _version = read()
+                _stale = False
+    return _version
+
+
+# reads the version before the worker serves any requests
+def preload():
+    data_version()
+
+
+# marks the version as stale so it's read again when it's next used; safe to
+# call from a signal handler
+def invalidate():
+    global _stale
+    _stale = True
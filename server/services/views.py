@@ -5,15 +5,20 @@ import json
 # import our models and helpers
 from services.models import Organism, Cvterm, Cv, Feature, Featureloc, Phylonode,\
 FeatureRelationship, GeneOrder, Featureprop, GeneFamilyAssignment
-# search stuffs
-from django.db.models import Q, Func, F
 # context view
-import operator
+import itertools
+import numpy as np
+from services import alignment, cvterms, frequented_regions, indexes, msa,\
+plots, queries, search, serializers
 # so anyone can use the services
 from django.views.decorators.csrf import csrf_exempt
 # time stuff for caching
 from django.utils.http import http_date
 import time
+from services import cache
+from services.cache import cache_response, conditional_response
+from services import instrumentation, pool
+from services.instrumentation import instrument_queries
 
 
 # decorator for invalidating the cache every hour
@@ -33,23 +38,27 @@ def ensure_nocache(view):
 # these are services for the stand alone context viewer #
 #########################################################
 
-######
-# v1 #
-######
+# how many micro-synteny tracks to fetch gene details for at a time
+TRACK_BATCH_SIZE = 500
+
+#################
+# micro-synteny #
+#################
 
 # returns contexts centered at genes in the list provided
-@csrf_exempt
-@ensure_nocache
-def v1_micro_synteny_basic(request):
+def basic_tracks(request, version):
     # parse the POST data (Angular puts it in the request body)
     POST = json.loads(request.body)
 
     # make sure the request type is POST and that it contains a list of genes
     if request.method == 'POST' and 'genes' in POST and 'neighbors' in POST:
         # prepare a generic response
-        generic = HttpResponse(
-            json.dumps('{"families":[], "groups":[]}'),
-            content_type='application/json; charset=utf8'
+        generic = serializers.micro_synteny_response(
+            request,
+            POST,
+            serializers.Families(),
+            [],
+            version
         )
 
         # how many genes will be displayed?
@@ -60,206 +69,211 @@ def v1_micro_synteny_basic(request):
                 raise ValueError("neighbors can't be negative")
         except:
             return HttpResponseBadRequest
-        # get the focus genes
-        focus_genes = Feature.objects.only('organism_id', 'name')\
-        .filter(name__in=POST['genes'])
-        if not focus_genes:
+        # should overlapping tracks be merged?
+        merge = POST.get('merge') in (True, 'true')
+        # get the focus genes with their locations, chromosomes, organisms and
+        # families
+        focus_genes = queries.focus_genes(POST['genes'], ordered=True)
+        if not focus_genes or not any(g.family for g in focus_genes):
             return generic
 
-        #######################
-        # begin fetching data #
-        #######################
-
-        # what we'll use to construct the json
-        groups = []
-        families = {}
-
-        # the gene_family cvterm
-        y = 0
-        family_term = list(Cvterm.objects.filter(name='gene family')[:1])[0]
-        focus_family_id = None
-
-        # get the focus gene locations
-        focus_locs = Featureloc.objects.only(
-            'feature_id',
-            'srcfeature_id',
-            'fmin',
-            'fmax',
-            'strand'
-        ).filter(feature__in=focus_genes)
-        focus_loc_map = dict((o.feature_id, o) for o in focus_locs)
-        if not focus_loc_map:
+        # get the orders for the focus genes from the gene order index
+        gene_order_index = indexes.get('gene_order')
+        order_map = gene_order_index.locate(g.feature_id for g in focus_genes)
+        if not order_map:
             return generic
 
-        # get the source feature names of the feature locs
-        srcfeatures = Feature.objects.only('name').filter(
-            pk__in=focus_locs.values_list('srcfeature_id', flat=True)
+        # get the genes surrounding the focus genes, ordered by number
+        focus_ids = order_map.keys()
+        focus_chromosomes, focus_numbers = map(
+            np.asarray,
+            zip(*[order_map[g] for g in focus_ids])
         )
-        srcfeature_map = dict((o.pk, o) for o in srcfeatures)
-        if not srcfeature_map:
-            return generic
-
-        # get the organisms for all the focus gene
-        organisms = Organism.objects.only('genus', 'species').filter(
-            pk__in=focus_genes.values_list('organism_id', flat=True)
-        )
-        organism_map = dict((o.pk, o) for o in organisms)
-        if not organism_map:
-            return generic
-
-        # get the focus genes family ids
-        family_ids = GeneFamilyAssignment.objects.only(
-            'gene_id', 'family_label'
-        ).filter(gene_id__in=focus_genes)
-        family_map = dict((o.gene_id, o.family_label) for o in family_ids)
-        if not family_map:
-            return generic
-
-        # get the orders for the focus genes
-        orders = list(GeneOrder.objects.filter(gene__in=focus_genes))
-        order_map = dict((o.gene_id, o) for o in orders)
-        if not orders:
-            return generic
-
-        # get the orders for all the genes surrounding the focus genes
-        gene_queries = dict((o.pk,
-            Q(chromosome_id=o.chromosome_id,
-              number__lte=o.number+num,
-              number__gte=o.number-num)
-            ) for o in orders)
-        gene_pool = list(GeneOrder.objects.filter(
-            reduce(operator.or_, gene_queries.values())
-        ))
-        gene_pool_ids = map(lambda g: g.gene_id, gene_pool)
-        group_by_chromosome = {}
-        for g in gene_pool:
-            if g.chromosome_id not in group_by_chromosome:
-                group_by_chromosome[g.chromosome_id] = [g]
-            else:
-                group_by_chromosome[g.chromosome_id].append(g)
-
-        def getNumber(g):
-            return g.number
-
-        track_gene_map = {}
-        for o in orders:
-            if o.chromosome_id in group_by_chromosome:
-                track_gene_map[o.pk] = []
-                for g in group_by_chromosome[o.chromosome_id]:
-                    if g.number <= o.number+num and g.number >= o.number-num:
-                        track_gene_map[o.pk].append(g)
-                track_gene_map[o.pk] = sorted(
-                    track_gene_map[o.pk],
-                    key=getNumber
+        track_chromosomes = focus_chromosomes
+        track_lowers = focus_numbers-num
+        track_uppers = focus_numbers+num
+        track_index = np.arange(len(focus_ids))
+        # optionally merge the tracks that overlap, so their shared genes are
+        # only fetched and sent once
+        if merge:
+            track_chromosomes, track_lowers, track_uppers, track_index =\
+                search.merge_blocks(
+                    track_chromosomes,
+                    track_lowers,
+                    track_uppers
                 )
-
-        # get the feature names for all the genes surrounding the focus genes
-        feature_pool = Feature.objects.only('name')\
-        .filter(pk__in=gene_pool_ids)
-        feature_name_map = dict((o.pk, o.name) for o in feature_pool)
-
-        # get feature locations for all the genes surrounding the focus genes
-        loc_queries = dict((o.pk,
-            Q(chromosome=o.chromosome_id,
-              number__lte=o.number+num,
-              number__gte=o.number-num)
-            ) for o in orders)
-        loc_pool = Featureloc.objects.only(
-            'feature_id',
-            'fmin',
-            'fmax',
-            'strand'
-        ).filter(feature__in=gene_pool_ids)
-        gene_loc_map = dict((o.feature_id, o) for o in loc_pool)
-        track_loc_map = {}
-        for o in orders:
-            track_loc_map[o.pk] = []
-            for g in track_gene_map[o.pk]:
-                track_loc_map[o.pk].append(gene_loc_map[g.gene_id])
-            track_loc_map[o.pk] = sorted(
-                track_loc_map[o.pk],
-                key=lambda loc: loc.fmin
-            )
-
-        # get the families for all the genes surrounding the focus genes
-        gene_families = GeneFamilyAssignment.objects.only(
-            'gene_id',
-            'family_label'
-        ).filter(gene_id__in=gene_pool_ids)
-        gene_family_map = dict(
-            (o.gene_id, o.family_label) for o in gene_families
+        track_positions, track_offsets = search.assemble_tracks(
+            gene_order_index,
+            track_chromosomes,
+            track_lowers,
+            track_uppers
+        )
+        track_genes = gene_order_index.gene_ids[track_positions].tolist()
+        track_offsets = track_offsets.tolist()
+        track_gene_map = dict(
+            (gene_id, track_genes[track_offsets[t]:track_offsets[t+1]])
+            for gene_id, t in zip(focus_ids, track_index.tolist())
         )
 
         #######################
         # begin generate json #
         #######################
 
-        for gene in focus_genes:
-            if gene.pk not in focus_loc_map:
-                continue
-            focus_loc = focus_loc_map[gene.pk]
-            srcfeature = srcfeature_map[focus_loc.srcfeature_id]
-            organism = organism_map[gene.organism_id]
-            family_id = family_map[gene.pk]
-            if len(family_id) > 0:
-                focus_family_id = family_id
-                if family_id not in families:
-                    families[family_id] = ('{"name":"' + family_id +
-                        '", "id":"' + family_id + '"}')
-            group = ('{"chromosome_name":"' + srcfeature.name +
-                '", "chromosome_id":' + str(srcfeature.feature_id) +
-                ', "genus":"' + organism.genus +
-                '", "species":"' + organism.species +
-                '", "species_id":' + str(gene.organism_id)+', "genes":[')
-            order = order_map[gene.pk]
-            track_genes = track_gene_map[order.pk]
-            track_locs = track_loc_map[order.pk]
-
-            # add gene entries for the track_locs
-            genes = []
-            for l in track_locs:
-                family_id = '' if l.feature_id not in gene_family_map\
-                               else gene_family_map[l.feature_id]
-                if family_id != '':
-                    if family_id not in families:
-                            families[family_id] = ('{"name":"' + family_id +
-                                '", "id":"' + family_id + '"}')
-                genes.append('{"name":"' + feature_name_map[l.feature_id] +
-                             '", "id":' + str(l.feature_id) + ',' +
-                             '"fmin":' + str(l.fmin) + ',' +
-                             '"fmax":' + str(l.fmax) + ',' +
-                             '"strand":' + str(l.strand) + ',' +
-                             '"family":"' + family_id + '"}')
-            group += ','.join(genes) + ']}'
-            groups.append(group)
-
-        # write the contents of the file
-        view_json = ('{"families":[' + ','.join(families.values()) + '], "groups":[' +
-            ','.join(groups) + ']}')
+        # the focus genes that have tracks
+        focus_genes = [g for g in focus_genes if g.feature_id in order_map]
+        # the families of the focus genes and their tracks' genes
+        families = serializers.Families(g.family for g in focus_genes)
+        # a merged track is the track of the first of its focus genes
+        if merge:
+            track_map = dict(zip(focus_ids, track_index.tolist()))
+            merged = set()
+            first_genes = []
+            for g in focus_genes:
+                if track_map[g.feature_id] not in merged:
+                    merged.add(track_map[g.feature_id])
+                    first_genes.append(g)
+            focus_genes = first_genes
+
+        # generates the tracks' groups, fetching the details of their genes a
+        # batch of tracks at a time
+        def generate_groups():
+            for batch in serializers.batches(focus_genes, TRACK_BATCH_SIZE):
+                batch_gene_ids = itertools.chain.from_iterable(
+                    track_gene_map[g.feature_id] for g in batch
+                )
 
-        return HttpResponse(
-            json.dumps(view_json),
-            content_type='application/json; charset=utf8'
+                # get the names, locations and families of the batch's genes
+                feature_name_map, gene_loc_map, gene_family_map =\
+                    queries.gene_details(batch_gene_ids, ordered=True)
+
+                for gene in batch:
+                    # genes whose details couldn't be fetched are skipped
+                    track_locs = sorted(
+                        [gene_loc_map[g] for g in
+                         track_gene_map[gene.feature_id]
+                         if g in gene_loc_map and g in feature_name_map],
+                        key=lambda loc: loc.fmin
+                    )
+
+                    # add gene entries for the track_locs
+                    genes = []
+                    for l in track_locs:
+                        family_id = gene_family_map.get(l.feature_id, '')
+                        families.add(family_id)
+                        genes.append({
+                            'name': feature_name_map[l.feature_id],
+                            'id': l.feature_id,
+                            'fmin': l.fmin,
+                            'fmax': l.fmax,
+                            'strand': l.strand,
+                            'family': family_id
+                        })
+                    yield {
+                        'chromosome_name': gene.chromosome_name,
+                        'chromosome_id': gene.loc.srcfeature_id,
+                        'genus': gene.genus,
+                        'species': gene.species,
+                        'species_id': gene.organism_id,
+                        'genes': genes
+                    }
+
+        return serializers.micro_synteny_response(
+            request,
+            POST,
+            families,
+            generate_groups(),
+            version
         )
     return HttpResponseBadRequest
 
 
+# returns the query tracks of the named focus genes, each with num neighbors
+# on either side, in the order the names are given; the track of a name that
+# can't be resolved to an ordered gene is None. The genes' neighborhoods and
+# families come from the in-memory indexes, so the number of queries doesn't
+# depend on how many tracks are requested.
+def query_groups(gene_names, num):
+    # get the focus genes
+    focus_genes = queries.focus_genes(gene_names, ordered=True)
+    focus_map = dict((g.name, g.feature_id) for g in reversed(focus_genes))
+
+    # get the orders of the focus genes and their neighbors from the indexes
+    family_index = indexes.get('gene_family')
+    gene_order_index = family_index.gene_order
+    order_map = gene_order_index.locate(focus_map.values())
+    focus_ids = order_map.keys()
+    if not focus_ids:
+        return [None] * len(gene_names)
+    focus_chromosomes, focus_numbers = map(
+        np.asarray,
+        zip(*[order_map[g] for g in focus_ids])
+    )
+    track_positions, track_offsets = search.assemble_tracks(
+        gene_order_index,
+        focus_chromosomes,
+        focus_numbers-num,
+        focus_numbers+num
+    )
+    track_genes = gene_order_index.gene_ids[track_positions].tolist()
+    track_families = family_index.labels(track_positions)
+    track_offsets = track_offsets.tolist()
+    track_map = dict(
+        (gene_id, (start, stop)) for gene_id, start, stop in
+        zip(focus_ids, track_offsets[:-1], track_offsets[1:])
+    )
+
+    # get the gene names and locations, and the track chromosomes and their
+    # organisms (the families come from the index)
+    gene_name_map, gene_loc_map, gene_family_map =\
+        queries.gene_details(track_genes, ordered=True)
+    chromosome_map = queries.chromosomes(
+        (c for c, n in order_map.values()),
+        ordered=True
+    )
+
+    # generate the json for each query track
+    groups = []
+    for name in gene_names:
+        focus_id = focus_map.get(name)
+        if focus_id not in order_map or\
+           order_map[focus_id][0] not in chromosome_map:
+            groups.append(None)
+            continue
+        start, stop = track_map[focus_id]
+        genes = []
+        for g, family in zip(track_genes[start:stop],
+                             track_families[start:stop]):
+            if g not in gene_name_map or g not in gene_loc_map:
+                continue
+            floc = gene_loc_map[g]
+            genes.append({
+                'name': gene_name_map[g],
+                'id': g,
+                'family': family,
+                'fmin': floc.fmin,
+                'fmax': floc.fmax,
+                'strand': floc.strand,
+                'x': len(genes),
+                'y': 0
+            })
+        chromosome = chromosome_map[order_map[focus_id][0]]
+        groups.append({
+            'species_name': chromosome.genus[0] + '.' + chromosome.species,
+            'species_id': chromosome.organism_id,
+            'chromosome_name': chromosome.name,
+            'chromosome_id': chromosome.feature_id,
+            'genes': genes
+        })
+    return groups
+
+
 # resolves a focus gene name to a query track
-@csrf_exempt
-@ensure_nocache
-def v1_gene_to_query_track(request):
+def query_track(request, version):
     # parse the POST data (Angular puts it in the request body)
     POST = json.loads(request.body)
 
     # make sure the request type is POST and that it contains a focus gene name
     if request.method == 'POST' and 'gene' in POST and 'neighbors' in POST:
-        # get the focus gene of the query track
-        focus = get_object_or_404(Feature, name=POST['gene'])
-        focus_id = focus.pk
-        focus_order = list(GeneOrder.objects.filter(gene=focus))
-        if len(focus_order) == 0:
-            raise Http404
-        focus_order = focus_order[0]
         # how many neighbors should there be?
         num = POST['neighbors']
         try:
@@ -268,89 +282,38 @@ def v1_gene_to_query_track(request):
                 raise ValueError("neighbors can't be negative")
         except:
             return HttpResponseBadRequest
-        # get the gene family type
-        gene_family_type = list(
-            Cvterm.objects.only('pk').filter(name='gene family')
-        )
-        if len(gene_family_type) == 0:
+        # construct the query track
+        query_group = query_groups([POST['gene']], num)[0]
+        if query_group is None:
             raise Http404
-        gene_family_type = gene_family_type[0]
-
-        #################################
-        # begin - construct query track #
-        #################################
-
-        # get the neighbors of focus via their ordering
-        neighbor_ids = list(GeneOrder.objects.filter(
-            chromosome=focus_order.chromosome_id,
-            number__gte=focus_order.number-num,
-            number__lte=focus_order.number+num
-        ).order_by('number').values_list('gene_id', flat=True))
-
-        # actually get the gene families
-        neighbor_families = list(GeneFamilyAssignment.objects.only(
-            'gene_id',
-            'family_label'
-        ).filter(gene_id__in=neighbor_ids))
-        neighbor_family_map = dict(
-            (o.gene_id, o.family_label) for o in neighbor_families
-        )
-        family_ids = []
-        query_families = {}
-        for n in neighbor_family_map.values():
-            if n not in family_ids:
-                family_ids.append(n)
-                query_families[n] = 1
-
-        # make the query track
-        # get the gene names
-        neighbor_features = list(Feature.objects.only('name')\
-            .filter(pk__in=neighbor_ids))
-        neighbor_name_map = dict((o.pk, o.name) for o in neighbor_features)
-        # get the gene flocs
-        neighbor_flocs = list(Featureloc.objects.only(
-            'feature_id',
-            'fmin',
-            'fmax',
-            'strand'
-        ).filter(feature__in=neighbor_ids))
-        neighbor_floc_map = dict((o.feature_id, o) for o in neighbor_flocs)
-        # get the track chromosome
-        chromosome = list(Feature.objects.only('name', 'organism_id')\
-            .filter(pk=neighbor_floc_map[int(focus.pk)].srcfeature_id))
-        chromosome = chromosome[0]
-        # get the track organism
-        organism = list(Organism.objects.only('genus', 'species')\
-            .filter(pk=chromosome.organism_id))
-        organism = organism[0]
-        # generate the json for the query genes
-        genes = []
-        query_align = []
-        for i in range(len(neighbor_ids)):
-            g = neighbor_ids[i]
-            family = str(neighbor_family_map[g] ) if g in neighbor_family_map else ''
-            floc = neighbor_floc_map[g]
-            genes.append('{"name":"' + neighbor_name_map[g] + '", "id":' +
-                str(g) + ', "family":"' + family + '", "fmin":' +
-                str(floc.fmin) + ', "fmax":' + str(floc.fmax) + ', "strand":' +
-                str(floc.strand) + ', "x":' + str(i) + ', "y":0}')
-            query_align.append((g, family))
-        query_group = ('{"species_name":"' + organism.genus[0] + '.' +
-            organism.species + '", "species_id":' + str(organism.pk) +
-            ', "chromosome_name":"' + chromosome.name + '", "chromosome_id":' +
-            str(chromosome.pk) + ', "genes":[' + ','.join(genes) + ']}')
-
-        return HttpResponse(
-            json.dumps(query_group),
-            content_type='application/json; charset=utf8'
-        )
+        return serializers.json_response(query_group, version)
     return HttpResponseBadRequest
 
 
+# resolves a list of focus gene names to their query tracks
+def query_tracks(request, version):
+    # parse the POST data (Angular puts it in the request body)
+    POST = json.loads(request.body)
+
+    # make sure the request type is POST and that it contains focus gene names
+    if request.method == 'POST' and 'genes' in POST and 'neighbors' in POST:
+        # how many neighbors should there be?
+        num = POST['neighbors']
+        try:
+            num = int(num)
+            if num <= 0:
+                raise ValueError("neighbors can't be negative")
+            gene_names = POST['genes']
+            if not isinstance(gene_names, list):
+                raise ValueError("genes must be a list")
+        except:
+            return HttpResponseBadRequest()
+        return serializers.json_response(query_groups(gene_names, num), version)
+    return HttpResponseBadRequest()
+
+
 # returns similar contexts to the families provided
-@csrf_exempt
-@ensure_nocache
-def v1_micro_synteny_search(request):
+def search_tracks(request, version):
     # parse the POST data (Angular puts it in the request body)
     POST = json.loads(request.body)
 
@@ -378,307 +341,498 @@ def v1_micro_synteny_search(request):
                 raise ValueError("intermediate can't be negative")
         except:
             return HttpResponseBadRequest
-        # the number of non query family genes tolerated between each pair of
-        # get the gene family type
-        gene_family_type = list(
-            Cvterm.objects.only('pk').filter(name='gene family')
-        )
-        if len(gene_family_type) == 0:
-            raise Http404
-        gene_family_type = gene_family_type[0]
+        # the maximum number of tracks to return, if any; only the best ranked
+        # blocks become tracks
+        limit = POST.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit <= 0:
+                    raise ValueError("limit must be positive")
+            except:
+                return HttpResponseBadRequest()
 
         ##################
         # begin - search #
         ##################
 
         # find all genes with the same families (excluding the query genes)
-        # huge loss of power here - should use some kind of indexed lookup instead
-        # of the value field
+        # via the inverted family index; their positions in the gene order
+        # index are sorted by chromosome and number
         family_ids = POST['query']
-        related_genes = list(GeneFamilyAssignment.objects.only(
-            'gene_id',
-            'family_label'
-        ).filter(family_label__in=family_ids))
-        gene_family_map = dict((o.gene_id, o.family_label) for o in related_genes)
-
-        # get the orders (and chromosomes) of the genes
-        related_orders = list(GeneOrder.objects.only(
-            'gene_id',
-            'number',
-            'chromosome_id'
-        ).filter(gene__in=gene_family_map.keys()))
-        gene_order_map = dict((o.gene_id, o.number) for o in related_orders)
-        # group the genes by their chromosomes
-        chromosome_genes_map = {}
-        for o in related_orders:
-            if o.chromosome_id in chromosome_genes_map:
-                chromosome_genes_map[o.chromosome_id].append(o.gene_id)
-            else:
-                chromosome_genes_map[o.chromosome_id] = [o.gene_id]
-
-        # fetch all the chromosome names (organism_id and pk are implicit)
-        chromosomes = Feature.objects.only('organism_id', 'name')\
-            .filter(pk__in=chromosome_genes_map.keys())
-        id_chromosome_map = dict((o.pk, o) for o in chromosomes)
-
-        # fetch the chromosome organisms
-        organism_ids = chromosomes.values_list('organism_id', flat=True)
-        organisms = list(Organism.objects.only('genus', 'species')\
-            .filter(pk__in=organism_ids))
-        id_organism_map = dict((o.pk, o) for o in organisms)
-
-        # construct tracks for each chromosome
-        tracks = {}
-        gene_queries = []
-        for chromosome_id, genes in chromosome_genes_map.iteritems():
-            if len(genes) < 2:
-                continue
-            # put the genes in order
-            genes.sort(key=lambda g: gene_order_map[g])
-            # find all disjoint subsets of the genes where all sequential genes in
-            # the set are separated by no more than non_family non-query-family
-            # genes
-            block = [0]
-            matched_families = set([gene_family_map[genes[0]]])
-            # traverse the genes in the order they appear on the chromosome
-            for i in range(1, len(genes)):
-                g = genes[i]
-                # add the gene to the current block if it meets the non query family
-                # criteria
-                gap_size = gene_order_map[g]-gene_order_map[genes[block[-1]]]-1
-                if gap_size <= non_family:
-                    matched_families.add(gene_family_map[g])
-                    block.append(i)
-                # otherwise, generate a track from the block and start a new block
-                if gap_size > non_family or i == len(genes)-1:
-                    # generate a track from the block
-                    if len(matched_families) >= num_matched_families:
-                        # get all the gene ids
-                        tracks[
-                            (chromosome_id, gene_order_map[genes[block[0]]],
-                            gene_order_map[genes[block[-1]]])
-                        ] = []
-                        gene_queries.append(
-                            Q(chromosome=chromosome_id,
-                              number__gte=gene_order_map[genes[block[0]]],
-                              number__lte=gene_order_map[genes[block[-1]]])
-                        )
-                    # start the next block
-                    block = [i]
-                    matched_families = set([gene_family_map[g]])
-
-        # are there any queries to operate on?
-        if len(gene_queries) != 0:
-            # get the track genes
-            gene_pool = list(GeneOrder.objects\
-                .filter(reduce(operator.or_, gene_queries)))
-            gene_ids = map(lambda x: x.gene_id, gene_pool)
-
-            # get the track gene families
-            track_gene_families = list(GeneFamilyAssignment.objects.only(
-                'gene_id',
-                'family_label'
-            ).filter(gene_id__in=gene_ids))
-            track_family_map = dict(
-                (o.gene_id, o.family_label) for o in track_gene_families
-            )
+        family_index = indexes.get('gene_family')
+        gene_order_index = family_index.gene_order
+        positions, family_codes = family_index.search(family_ids)
+
+        # find all disjoint subsets of the genes where all sequential genes in
+        # the set are separated by no more than non_family non-query-family
+        # genes and construct tracks from those with enough matched families
+        track_chromosomes, track_lowers, track_uppers, family_counts,\
+        gene_counts = search.find_blocks(
+            gene_order_index.chromosomes(positions),
+            gene_order_index.numbers[positions],
+            family_codes,
+            num_matched_families,
+            non_family,
+            return_counts=True
+        )
 
-            # make sure all families are present in the json
-            for f in track_family_map.values():
-                if f not in family_ids:
-                    family_ids.append(f)
-
-            # get all the gene names
-            gene_names = list(Feature.objects.only('name').filter(pk__in=gene_ids))
-            gene_name_map = dict((o.pk, o.name) for o in gene_names)
-
-            # get all the gene featurelocs
-            gene_locs = list(Featureloc.objects.only(
-                'feature_id',
-                'fmin',
-                'fmax',
-                'strand'
-            ).filter(feature__in=gene_ids))
-            gene_loc_map = dict((o.feature_id, o) for o in gene_locs)
-
-            # construct a list of genes for each track
-            for key in tracks.keys():
-                chromosome_id, lower_bound, upper_bound = key
-                for o in gene_pool:
-                    if o.chromosome_id == chromosome_id and o.number >= lower_bound\
-                    and o.number <= upper_bound:
-                        tracks[key].append(o)
-                tracks[key] = map(
-                    lambda x: x.gene_id,
-                    sorted(tracks[key], key=lambda o: o.number)
-                )
+        # keep only the best blocks if there's a limit, best first
+        extra = {}
+        if limit is not None:
+            best = np.asarray(search.rank_blocks(
+                family_counts,
+                gene_counts,
+                track_lowers,
+                track_uppers,
+                limit
+            ), dtype=np.int64)
+            extra['pruned'] = len(track_chromosomes) - len(best)
+            track_chromosomes = track_chromosomes[best]
+            track_lowers = track_lowers[best]
+            track_uppers = track_uppers[best]
+
+        # get the track genes, ordered by number, in a single sweep of the index
+        track_positions, track_offsets = search.assemble_tracks(
+            gene_order_index,
+            track_chromosomes,
+            track_lowers,
+            track_uppers
+        )
+        gene_ids = gene_order_index.gene_ids[track_positions].tolist()
+        gene_families = family_index.labels(track_positions)
+        track_offsets = track_offsets.tolist()
+        tracks = zip(
+            track_chromosomes.tolist(),
+            track_offsets[:-1],
+            track_offsets[1:]
+        )
 
-        # jsonify the tracks... that's right, jsonify
-        groups = []
-        y = 1
-        for key in tracks.keys():
-            chromosome_id, lower_order, upper_order = key
-            gene_json = []
-            for g in tracks[key]:
-                family = track_family_map[g] if g in track_family_map else ''
-                gene_json.append('{"name":"' + gene_name_map[g] + '", "id":' +
-                    str(g) + ', "family":"' +family + '", "fmin":' +
-                    str(gene_loc_map[g].fmin) + ', "fmax":' +
-                    str(gene_loc_map[g].fmax) + ', "strand":' +
-                    str(gene_loc_map[g].strand)+'}')
-            o = id_organism_map[id_chromosome_map[chromosome_id].organism_id]
-            group = ('{"genus":"' + o.genus +
-                '", "species":"' + o.species +
-                '", "species_id":' +
-                str(id_chromosome_map[chromosome_id].organism_id) +
-                ', "chromosome_name":"' + id_chromosome_map[chromosome_id].name +
-                '", "chromosome_id":' + str(chromosome_id) + ', "genes":[' +
-                ','.join(gene_json)+']}')
-            groups.append(group)
-            # prepare for the next track
-            y += 1
+        # optionally align the tracks to the query and drop those that score
+        # below the threshold before any of their details are fetched
+        track_alignments = [None] * len(tracks)
+        if 'align' in POST:
+            try:
+                params = alignment.parse_params(POST['align'])
+            except (TypeError, ValueError):
+                return HttpResponseBadRequest()
+            alignments = alignment.align_tracks(
+                family_ids,
+                [gene_families[start:stop] for c, start, stop in tracks],
+                params
+            )
+            # a track can have many alignments and each becomes a group
+            aligned = [(t, a) for t, results in zip(tracks, alignments)
+                for a in results if a.score >= params['threshold']]
+            tracks = [t for t, a in aligned]
+            track_alignments = [a for t, a in aligned]
+
+        # fetch all the chromosome names and organisms
+        id_chromosome_map = queries.chromosomes(
+            (c for c, start, stop in tracks),
+            ordered=True
+        )
 
         ################
         # begin - json #
         ################
 
-        # make the family json
-        family_json = []
-        for f in family_ids :
-            family_json.append('{"name":"'+f+'", "id":"'+f+'"}')
-        view_json = '{"families":['+','.join(family_json)+'], "groups":['
-
-        # make the final json
-        view_json += ','.join(groups)+']}'
+        # the query families and the families of the track genes
+        families = serializers.Families(family_ids)
 
-        return HttpResponse(
-            json.dumps(view_json),
-            content_type='application/json; charset=utf8'
+        # jsonify the tracks... that's right, jsonify; the details of their
+        # genes are fetched a batch of tracks at a time
+        def generate_groups():
+            aligned_tracks = zip(tracks, track_alignments)
+            for batch in serializers.batches(aligned_tracks, TRACK_BATCH_SIZE):
+                batch_gene_ids = itertools.chain.from_iterable(
+                    gene_ids[start:stop] for (c, start, stop), a in batch
+                )
+                gene_name_map, gene_loc_map, gene_family_map =\
+                    queries.gene_details(batch_gene_ids, ordered=True)
+                for (chromosome_id, start, stop), track_alignment in batch:
+                    if chromosome_id not in id_chromosome_map:
+                        continue
+                    # genes whose details couldn't be fetched are None, so
+                    # the alignments' gene indexes still line up, and skipped
+                    gene_json = []
+                    for g, family in zip(gene_ids[start:stop],
+                                         gene_families[start:stop]):
+                        if g not in gene_name_map or g not in gene_loc_map:
+                            gene_json.append(None)
+                            continue
+                        families.add(family)
+                        gene_json.append({
+                            'name': gene_name_map[g],
+                            'id': g,
+                            'family': family,
+                            'fmin': gene_loc_map[g].fmin,
+                            'fmax': gene_loc_map[g].fmax,
+                            'strand': gene_loc_map[g].strand
+                        })
+                    chromosome = id_chromosome_map[chromosome_id]
+                    group = {
+                        'genus': chromosome.genus,
+                        'species': chromosome.species,
+                        'species_id': chromosome.organism_id,
+                        'chromosome_name': chromosome.name,
+                        'chromosome_id': chromosome_id,
+                        'genes': gene_json
+                    }
+                    if track_alignment is not None:
+                        group['genes'] = alignment.apply_alignment(
+                            gene_json,
+                            track_alignment
+                        )
+                        group['score'] = track_alignment.score
+                    else:
+                        group['genes'] = [g for g in gene_json
+                                          if g is not None]
+                    yield group
+
+        return serializers.micro_synteny_response(
+            request,
+            POST,
+            families,
+            generate_groups(),
+            version,
+            extra
         )
     return HttpResponseBadRequest
 
 
+# returns the multiple alignment of the tracks in the result set provided
+def msa_tracks(request, version):
+    # parse the POST data (Angular puts it in the request body)
+    try:
+        POST = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    # make sure the request type is POST and that it contains a result set
+    if request.method == 'POST' and isinstance(POST, dict) and\
+       isinstance(POST.get('groups'), list):
+        groups = POST['groups']
+        if not all(isinstance(group, dict) and
+                   isinstance(group.get('genes'), list) and
+                   all(isinstance(gene, dict) for gene in group['genes'])
+                   for group in groups):
+            return HttpResponseBadRequest()
+        # the same tracks have the same alignment, whatever else the result
+        # sets have, so alignments are cached by a hash of their tracks
+        tracks = msa.group_tracks(groups)
+        alignments = cache.cached_value(
+            msa.tracks_key(tracks),
+            lambda: msa.align(tracks)
+        )
+        result = dict(POST)
+        result['groups'] = msa.apply_alignments(groups, alignments)
+        return serializers.json_response(result, version)
+    return HttpResponseBadRequest()
+
+
+# returns the frequented regions of the tracks in the result set provided, or
+# of the chromosomes with the ids provided (in gene order); the regions'
+# supporting paths are indexes of the tracks or chromosomes
+def find_regions(request, version):
+    # parse the POST data (Angular puts it in the request body)
+    try:
+        POST = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    # make sure the request type is POST and that it contains the parameters
+    # and either a result set or chromosomes
+    if request.method == 'POST' and isinstance(POST, dict) and\
+       ('groups' in POST or 'chromosomes' in POST):
+        try:
+            params = frequented_regions.parse_params(POST)
+            if 'groups' in POST:
+                tracks = [[g.get('family') or '' for g in group['genes']]
+                          for group in POST['groups']]
+            else:
+                chromosome_ids = [int(c) for c in POST['chromosomes']]
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return HttpResponseBadRequest()
+        if 'groups' not in POST:
+            family_index = indexes.get('gene_family')
+            gene_order_index = family_index.gene_order
+            tracks = [
+                family_index.labels(np.arange(*gene_order_index.bounds(c)))
+                for c in chromosome_ids
+            ]
+        regions = frequented_regions.frequented_regions(
+            tracks,
+            params['alpha'],
+            params['kappa'],
+            params['minsup'],
+            params['minsize']
+        )
+        return serializers.json_response({'regions': regions}, version)
+    return HttpResponseBadRequest()
+
+
+######
+# v1 #
+######
+
+# returns contexts centered at genes in the list provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v1_micro_synteny_basic(request):
+    return basic_tracks(request, 1)
+
+
+# resolves a focus gene name to a query track
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v1_gene_to_query_track(request):
+    return query_track(request, 1)
+
+
+# returns the query tracks of the focus genes in the list provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v1_gene_to_query_tracks(request):
+    return query_tracks(request, 1)
+
+
+# returns similar contexts to the families provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v1_micro_synteny_search(request):
+    return search_tracks(request, 1)
+
+
+# returns the multiple alignment of the tracks in the result set provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v1_micro_synteny_msa(request):
+    return msa_tracks(request, 1)
+
+
+# returns the frequented regions of the tracks or chromosomes provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v1_frequented_regions(request):
+    return find_regions(request, 1)
+
+
 # returns all the GENES for the given chromosome that have the same family as
-# the query
+# the query; many chromosomes can be plotted at once, in which case the plots
+# are returned by chromosome id
 @csrf_exempt
 @ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
 def v1_global_plot(request):
     # parse the POST data (Angular puts it in the request body)
     POST = json.loads(request.body)
 
     # make sure the request type is POST and that it contains a query (families)
-    if request.method == 'POST' and 'query' in POST and 'chromosome' in POST:
-        # get the gene family type
-        gene_family_type = list(Cvterm.objects.only('pk')\
-            .filter(name='gene family'))
-        if len(gene_family_type) == 0:
-            raise Http404
-        gene_family_type = gene_family_type[0]
+    if request.method == 'POST' and 'query' in POST and\
+            ('chromosome' in POST or 'chromosomes' in POST):
+        many = 'chromosomes' in POST
+        try:
+            if many:
+                chromosome_ids = [int(c) for c in POST['chromosomes']]
+            else:
+                chromosome_ids = [int(POST['chromosome'])]
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest()
+
+        # each chromosome's genes are grouped by family in an index, so a
+        # chromosome's genes in the query's families are a lookup per family
+        family_index = indexes.get('chromosome_family')
+
+        # optionally bin the plot's points into a grid of counts instead of
+        # returning the genes, so the response's size doesn't depend on the
+        # size of the chromosome; a point's x is its gene's midpoint and its y
+        # the position of its query gene, which defaults to its index
+        if 'bins' in POST:
+            try:
+                bins, x_range, y_range = plots.parse_grid(
+                    POST['bins'],
+                    POST.get('x_range'),
+                    POST.get('y_range')
+                )
+                positions = [float(p) for p in
+                             POST.get('positions', range(len(POST['query'])))]
+                if len(positions) != len(POST['query']):
+                    raise ValueError('positions must parallel the query')
+            except (TypeError, ValueError):
+                return HttpResponseBadRequest()
+            plot_json = {}
+            for c in chromosome_ids:
+                x, y = plots.grouped_points(
+                    family_index.chromosome(c)[1],
+                    POST['query'],
+                    positions
+                )
+                counts, x_edges, y_edges = plots.density(
+                    x,
+                    y,
+                    bins,
+                    x_range,
+                    y_range
+                )
+                plot_json[c] = {
+                    'points': len(x),
+                    'x_edges': x_edges.tolist(),
+                    'y_edges': y_edges.tolist(),
+                    'counts': counts.tolist()
+                }
+        else:
+            # find the genes with the same families on each chromosome
+            gene_order = indexes.get('gene_order')
+            chromosome_genes = []
+            for c in chromosome_ids:
+                positions, families = family_index.genes(c, POST['query'])
+                chromosome_genes.append(
+                    (c, gene_order.gene_ids[positions].tolist(), families))
+
+            # get all the genes' names and locations at once
+            gene_name_map, gene_loc_map, _ = queries.gene_details(
+                itertools.chain.from_iterable(
+                    gene_ids for c, gene_ids, families in chromosome_genes),
+                ordered=True
+            )
 
-        # find all genes with the same families
-        chromosome_gene_orders = GeneOrder.objects.filter(
-            chromosome=POST["chromosome"]
-        )
-        chromosome_gene_ids = chromosome_gene_orders.values_list(
-            "gene", flat=True
-        )
-        related_genes = Featureprop.objects.only('feature').filter(
-            type=gene_family_type,
-            value__in=POST['query'],
-            feature__in=chromosome_gene_ids
-        )
-        gene_family_map = dict((o.feature_id, o.value) for o in related_genes)
-        related_gene_ids = gene_family_map.keys()
+            # make the json
+            plot_json = {}
+            for c, gene_ids, families in chromosome_genes:
+                gene_json = []
+                for g, family in zip(gene_ids, families):
+                    loc = gene_loc_map.get(g)
+                    if loc is None:
+                        continue
+                    gene_json.append({
+                        "name": gene_name_map[g],
+                        "id": g,
+                        "family": family,
+                        "fmin": loc.fmin,
+                        "fmax": loc.fmax,
+                        "strand": loc.strand,
+                        "x": 0,
+                        "y": 0
+                    })
+                plot_json[c] = gene_json
 
-        # get all the gene names
-        gene_names = Feature.objects.only('name').filter(
-            pk__in=related_gene_ids
-        )
-        gene_name_map = dict((o.pk, o.name) for o in gene_names)
-
-        # get all the gene featurelocs
-        gene_locs = Featureloc.objects.only('fmin', 'fmax', 'strand')\
-            .filter(feature__in=related_gene_ids)
-        gene_loc_map = dict((o.feature_id, o) for o in gene_locs)
-
-        # make the json
-        gene_json = []
-        for g in related_gene_ids:
-            loc = gene_loc_map[g]
-            gene_json.append({
-                "name": gene_name_map[g],
-                "id": g,
-                "family": str(gene_family_map[g]),
-                "fmin": loc.fmin,
-                "fmax": loc.fmax,
-                "strand": loc.strand,
-                "x": 0,
-                "y": 0
-            })
         # return the plot data as encoded as json
         return HttpResponse(
-            json.dumps(gene_json),
+            json.dumps(plot_json if many else plot_json[chromosome_ids[0]]),
             content_type='application/json; charset=utf8'
         )
-    return HttpResponseBadRequest
+    return HttpResponseBadRequest()
 
 
 # returns chromosome scale synteny blocks for the chromosome of the given gene
 @csrf_exempt
 @ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
 def v1_macro_synteny(request):
     # parse the POST data (Angular puts it in the request body)
     POST = json.loads(request.body)
     # make sure the request type is POST and that it contains a query (families)
     if request.method == 'POST' and 'chromosome' in POST:
-        # get the query chromosome
-        chromosome = get_object_or_404(Feature, name=POST['chromosome'])
-        # get the syntenic region cvterm
-        synteny_type = list(Cvterm.objects.only('pk')\
-            .filter(name='syntenic_region'))
-        if len(synteny_type) == 0:
-            raise Http404
-        synteny_type = synteny_type[0]
-        # get all the related featurelocs
-        blocks = list(Featureloc.objects\
-            .only('feature', 'fmin', 'fmax', 'strand')\
-            .filter(srcfeature=chromosome, feature__type=synteny_type, rank=0))
-        # get the chromosome each region belongs to
-        region_ids = map(lambda b: b.feature_id, blocks)
-        regions = None
-        if 'results' in POST:
-            regions = list(Featureloc.objects\
-                .only('feature', 'srcfeature')\
-                .filter(feature__in=region_ids, srcfeature__in=POST['results'], rank=1))
+        # the chromosomes the blocks are limited to, if any
+        results = POST.get('results')
+        if results is not None:
+            try:
+                results = [int(r) for r in results]
+            except (TypeError, ValueError):
+                return HttpResponseBadRequest()
+        # answer from the block table if it has the query chromosome
+        table = indexes.get('macro_synteny')
+        chromosome_id = table.chromosome_id(POST['chromosome'])
+        if chromosome_id is not None:
+            chromosome_name, chromosome_length =\
+                table.chromosomes[chromosome_id][:2]
+            partners, fmins, fmaxs, orientations = table.blocks(
+                chromosome_id,
+                results
+            )
+            # group the blocks by partner
+            feature_locs = {}
+            for p, fmin, fmax, strand in zip(partners.tolist(), fmins.tolist(),
+                                             fmaxs.tolist(),
+                                             orientations.tolist()):
+                name, length, genus, species = table.chromosomes[p]
+                feature_locs.setdefault((name, species, genus), []).append({
+                    'start': fmin,
+                    'stop': fmax,
+                    'orientation': '-' if strand == -1 else '+'
+                })
         else:
-            regions = list(Featureloc.objects\
-                .only('feature', 'srcfeature')\
-                .filter(feature__in=region_ids, rank=1))
-        region_to_chromosome = dict(
-            (r.feature_id, r.srcfeature_id) for r in regions
-        )
-        # actually get the chromosomes
-        chromosomes = list(Feature.objects.only('name', 'organism')\
-            .filter(pk__in=region_to_chromosome.values()))
-        chromosome_map = dict((c.pk, c) for c in chromosomes)
-        # get the chromosomes' organisms
-        organisms = Organism.objects.only('genus', 'species').filter(
-            pk__in=map(lambda c: c.organism_id, chromosomes)
-        )
-        organism_map = dict((o.pk, o) for o in organisms)
-        # group the blocks by feature
-        feature_locs = {}
-        for l in blocks:
-            if l.feature_id in region_to_chromosome:
-                orientation = '-' if l.strand == -1 else '+'
-                c = chromosome_map[region_to_chromosome[l.feature_id]]
-                name = c.name
-                o = organism_map[c.organism_id]
-                species = o.species
-                genus = o.genus
-                feature_locs.setdefault((name, species, genus), []).append(
-                    {'start':l.fmin, 'stop':l.fmax, 'orientation':orientation}
-                )
+            # get the query chromosome
+            chromosome = get_object_or_404(Feature, name=POST['chromosome'])
+            # get the syntenic region cvterm
+            synteny_type = cvterms.get('syntenic_region')
+            if synteny_type is None:
+                raise Http404
+            # get all the related featurelocs
+            blocks = list(Featureloc.objects\
+                .only('feature', 'fmin', 'fmax', 'strand')\
+                .filter(srcfeature=chromosome, feature__type=synteny_type, rank=0))
+            # get the chromosome each region belongs to
+            region_ids = map(lambda b: b.feature_id, blocks)
+            regions = None
+            if results is not None:
+                regions = list(Featureloc.objects\
+                    .only('feature', 'srcfeature')\
+                    .filter(feature__in=region_ids, srcfeature__in=results, rank=1))
+            else:
+                regions = list(Featureloc.objects\
+                    .only('feature', 'srcfeature')\
+                    .filter(feature__in=region_ids, rank=1))
+            region_to_chromosome = dict(
+                (r.feature_id, r.srcfeature_id) for r in regions
+            )
+            # actually get the chromosomes
+            chromosomes = list(Feature.objects.only('name', 'organism')\
+                .filter(pk__in=region_to_chromosome.values()))
+            chromosome_map = dict((c.pk, c) for c in chromosomes)
+            # get the chromosomes' organisms
+            organisms = Organism.objects.only('genus', 'species').filter(
+                pk__in=map(lambda c: c.organism_id, chromosomes)
+            )
+            organism_map = dict((o.pk, o) for o in organisms)
+            # group the blocks by feature
+            feature_locs = {}
+            for l in blocks:
+                if l.feature_id in region_to_chromosome:
+                    orientation = '-' if l.strand == -1 else '+'
+                    c = chromosome_map[region_to_chromosome[l.feature_id]]
+                    name = c.name
+                    o = organism_map[c.organism_id]
+                    species = o.species
+                    genus = o.genus
+                    feature_locs.setdefault((name, species, genus), []).append(
+                        {'start':l.fmin, 'stop':l.fmax, 'orientation':orientation}
+                    )
+            chromosome_name = chromosome.name
+            chromosome_length = chromosome.seqlen
         # generate the json
         tracks = []
         for (name, species, genus), blocks in feature_locs.iteritems():
@@ -688,8 +842,8 @@ def v1_macro_synteny(request):
                 'genus': genus,
                 'blocks': blocks
             })
-        synteny_json = {'chromosome': chromosome.name,
-                        'length': chromosome.seqlen,
+        synteny_json = {'chromosome': chromosome_name,
+                        'length': chromosome_length,
                         'tracks': tracks}
         # return the synteny data as encoded as json
         return HttpResponse(
@@ -702,6 +856,9 @@ def v1_macro_synteny(request):
 # returns the gene on the given chromosome that is closest to the given position
 @csrf_exempt
 @ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
 def v1_nearest_gene(request):
     # parse the POST data (Angular puts it in the request body)
     POST = json.loads(request.body)
@@ -715,41 +872,16 @@ def v1_nearest_gene(request):
                 raise ValueError("matched can't be negative")
         except:
             return HttpResponseBadRequest
-        # get the gene type
-        sequence_cv = Cv.objects.only('pk').filter(name='sequence')
-        gene_type = list(
-            Cvterm.objects.only('pk').filter(name='gene', cv_id=sequence_cv)
-        )
-        if len(gene_type) == 0:
-            raise Http404
-        gene_type = gene_type[0]
         # find the gene closest to the given position
-        loc = Featureloc.objects.only(
-            'feature_id',
-            'srcfeature_id',
-            'fmin',
-            'fmax',
-            'strand'
-        ).filter(
-            feature__type=gene_type, srcfeature=POST['chromosome']
-        ).annotate(dist=Func(
-            ((F('fmin') + F('fmax')) / 2) - pos, function='ABS'
-        )).order_by('dist').first()
-        gene = get_object_or_404(Feature, pk=loc.feature.pk)
-        family = None
         try:
-            family = GeneFamilyAssignment.objects.get(gene_id=gene.pk)
-        except GeneFamilyAssignment.DoesNotExist:
-            family = GeneFamilyAssignment(family_label='')
+            chromosome_id = int(POST['chromosome'])
+        except:
+            return HttpResponseBadRequest()
+        loc = indexes.get('nearest_gene').nearest(chromosome_id, [pos])[0]
+        if loc is None:
+            raise Http404
         # jsonify the gene and return it
-        data = {
-            "name": gene.name,
-            "id": gene.pk,
-            "family": family.family_label,
-            "fmin": loc.fmin,
-            "fmax": loc.fmax,
-            "strand": loc.strand
-        }
+        data = nearest_gene_json([loc])[0]
         # return the synteny data as encoded as json
         return HttpResponse(
             json.dumps(data),
@@ -757,6 +889,150 @@ def v1_nearest_gene(request):
         )
     return HttpResponseBadRequest
 
+
+# returns the genes on the given chromosomes that are closest to the given
+# positions; the locations are a list of chromosome and position objects and
+# null is returned for locations with no genes
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v1_nearest_genes(request):
+    # parse the POST data (Angular puts it in the request body)
+    POST = json.loads(request.body)
+    # make sure the request type is POST and that it contains the correct data
+    if request.method == 'POST' and 'locations' in POST:
+        # parse the locations and group them by chromosome
+        chromosome_positions = {}
+        try:
+            for i, location in enumerate(POST['locations']):
+                chromosome_id = int(location['chromosome'])
+                pos = int(location['position'])
+                if pos < 0:
+                    raise ValueError("position can't be negative")
+                chromosome_positions.setdefault(chromosome_id, [])\
+                    .append((i, pos))
+        except:
+            return HttpResponseBadRequest()
+        # find the genes closest to the positions, a chromosome at a time
+        nearest_gene_index = indexes.get('nearest_gene')
+        locs = [None] * len(POST['locations'])
+        for chromosome_id, positions in chromosome_positions.iteritems():
+            indices, positions = zip(*positions)
+            nearest = nearest_gene_index.nearest(chromosome_id, positions)
+            for i, loc in zip(indices, nearest):
+                locs[i] = loc
+        # jsonify the genes and return them
+        found = [loc for loc in locs if loc is not None]
+        genes = iter(nearest_gene_json(found))
+        data = [next(genes) if loc is not None else None for loc in locs]
+        return HttpResponse(
+            json.dumps(data),
+            content_type='application/json; charset=utf8'
+        )
+    return HttpResponseBadRequest()
+
+
+# returns the json for the genes with the given (id, fmin, fmax, strand)
+def nearest_gene_json(locs):
+    gene_name_map, gene_loc_map, family_map =\
+        queries.gene_details(l[0] for l in locs)
+    return [{
+        "name": gene_name_map[gene_id],
+        "id": gene_id,
+        "family": family_map.get(gene_id, ''),
+        "fmin": fmin,
+        "fmax": fmax,
+        "strand": strand
+    } for gene_id, fmin, fmax, strand in locs]
+
+######
+# v2 #
+######
+
+# the v2 services return json objects instead of json encoded strings
+
+# returns contexts centered at genes in the list provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v2_micro_synteny_basic(request):
+    return basic_tracks(request, 2)
+
+
+# resolves a focus gene name to a query track
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v2_gene_to_query_track(request):
+    return query_track(request, 2)
+
+
+# returns the query tracks of the focus genes in the list provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v2_gene_to_query_tracks(request):
+    return query_tracks(request, 2)
+
+
+# returns similar contexts to the families provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v2_micro_synteny_search(request):
+    return search_tracks(request, 2)
+
+
+# returns the multiple alignment of the tracks in the result set provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v2_micro_synteny_msa(request):
+    return msa_tracks(request, 2)
+
+
+# returns the frequented regions of the tracks or chromosomes provided
+@csrf_exempt
+@ensure_nocache
+@instrument_queries
+@conditional_response
+@cache_response
+def v2_frequented_regions(request):
+    return find_regions(request, 2)
+
+# reports the response cache's hit and miss counts
+def cache_stats(request):
+    return HttpResponse(
+        json.dumps(cache.stats()),
+        content_type='application/json; charset=utf8'
+    )
+
+# reports each view's query counts and database time
+def query_stats(request):
+    return HttpResponse(
+        json.dumps(instrumentation.stats()),
+        content_type='application/json; charset=utf8'
+    )
+
+# reports each database connection pool's size and usage
+def pool_stats(request):
+    return HttpResponse(
+        json.dumps(pool.stats()),
+        content_type='application/json; charset=utf8'
+    )
+
 ###############
 # depreciated #
 ###############